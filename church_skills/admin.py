@@ -1,3 +1,216 @@
-from django.contrib import admin
+"""
+    Admin for the directory, built for tables with hundreds of thousands of rows.
 
-# Register your models here.
+    The change lists never count a whole table: EstimatedCountPaginator takes the row count of an unfiltered list from
+    the database's statistics (on SQLite those ANALYZE writes) and stops counting anything else at a limit, showing
+    "10000+" and letting the pages go on past it, and show_full_result_count is off.  Search goes through the directory
+    search index instead of LIKE scans, which also serves the autocomplete widgets used for Skill.provider and
+    Provider.categories in place of selects listing every row.  The bulk actions work on sets of rows with a few
+    UPDATE/DELETE/INSERT statements per chunk rather than saving each object, and bring the denormalized data the save
+    signals would have maintained (category counts, directory entries, cached pages and users) up to date themselves
+"""
+# Django imports
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth.models import User
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connection, transaction
+from django.utils.functional import cached_property
+
+# Local imports
+from . import backends, cache, counts, directory
+from .models import Category, Provider, Skill
+from .search import get_backend
+
+
+# Rows selected for a bulk action are written this many at a time
+CHUNK_SIZE = 500
+
+
+def chunks(values, size=CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def estimated_count(model):
+    """
+        The number of rows in the model's table according to the database's statistics, without counting them.  None
+        when there are no statistics, the paginator then counts up to its limit
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+            # -1 for a table that has never been analyzed
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+            row = cursor.fetchone()
+            return row[0] if row else None
+        if connection.vendor == 'sqlite':
+            # SQLite only has the row counts ANALYZE wrote, the first number of each of the table's sqlite_stat1 rows.
+            # The largest id would be no estimate, it never comes down after rows are deleted
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class CappedCount(int):
+    """
+        A count that stopped at a limit, shown as "10000+"
+    """
+    def __str__(self):
+        return '{}+'.format(int(self))
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+        Counts exactly only what is cheap to count: an unfiltered list larger than exact_limit by its estimate, a
+        filtered one (or one without an estimate) up to exact_limit rows.  Past a capped count the number of pages
+        isn't known, any page is accepted and there is always a link to the page after the furthest one asked for
+    """
+    exact_limit = 10000
+
+    def __init__(self, *args, **kwargs):
+        super(EstimatedCountPaginator, self).__init__(*args, **kwargs)
+        self.furthest = 1
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate > self.exact_limit:
+                return estimate
+        counted = queryset.order_by()[:self.exact_limit + 1].count()
+        return CappedCount(self.exact_limit) if counted > self.exact_limit else counted
+
+    @property
+    def capped(self):
+        return isinstance(self.count, CappedCount)
+
+    @property
+    def num_pages(self):
+        pages = super(EstimatedCountPaginator, self).num_pages
+        return max(pages, self.furthest + 1) if self.capped else pages
+
+    def validate_number(self, number):
+        if not self.capped:
+            return super(EstimatedCountPaginator, self).validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        self.furthest = max(self.furthest, number)
+        return number
+
+    def page(self, number):
+        # The last page isn't cut off at an estimate that may be short
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+        Searches with the directory search index, search_fields is only there for the search box and autocomplete
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    ordering = ['-id']
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return get_backend().filter_queryset(queryset, search_term), False
+
+
+# ------------------------------------------------- Bulk actions -------------------------------------------------------
+class RecategorizeForm(ActionForm):
+    category = forms.ModelChoiceField(queryset=Category.objects.order_by('name'), required=False,
+                                      help_text='For "Move to category"')
+
+
+def refresh_providers(provider_ids, category_ids):
+    """
+        What the save signals would have done after the categories of provider_ids changed
+    """
+    counts.reconcile(category_ids)
+    directory.refresh_providers(provider_ids)
+    keys = [cache.directory_key()]
+    keys += [cache.category_key(slug) for slug in Category.objects.filter(pk__in=category_ids)
+             .values_list('slug', flat=True)]
+    for chunk in chunks(provider_ids):
+        keys += [cache.provider_key(username) for username in User.objects.filter(pk__in=chunk)
+                 .values_list('username', flat=True)]
+    cache.bump(keys)
+
+
+@admin.action(description='Move to category (replacing their categories)')
+def recategorize(model_admin, request, queryset):
+    category = Category.objects.filter(pk=request.POST.get('category') or None).first()
+    if category is None:
+        model_admin.message_user(request, 'Choose the category to move the providers to.', messages.WARNING)
+        return
+    # Taken as a list, the search index filter doesn't survive being nested in another query
+    provider_ids = list(queryset.values_list('pk', flat=True))
+    through = Provider.categories.through
+    affected = {category.pk}
+    with transaction.atomic():
+        for chunk in chunks(provider_ids):
+            links = through.objects.filter(provider_id__in=chunk)
+            affected.update(links.values_list('category_id', flat=True))
+            links.delete()
+            through.objects.bulk_create([through(provider_id=pk, category_id=category.pk) for pk in chunk])
+        refresh_providers(provider_ids, affected)
+    model_admin.message_user(request, 'Moved {} providers to {}.'.format(len(provider_ids), category))
+
+
+@admin.action(description='Deactivate (they can no longer log in)')
+def deactivate(model_admin, request, queryset):
+    user_ids = list(queryset.values_list('pk', flat=True))
+    with transaction.atomic():
+        for chunk in chunks(user_ids):
+            User.objects.filter(pk__in=chunk).update(is_active=False)
+    # Logged in sessions end once the cached users are gone, see backends.py
+    backends.get_cache().delete_many([backends.user_key(pk) for pk in user_ids])
+    model_admin.message_user(request, 'Deactivated {} providers.'.format(len(user_ids)))
+
+
+# ------------------------------------------------- Model admins -------------------------------------------------------
+@admin.register(Category)
+class CategoryAdmin(LargeTableAdmin):
+    list_display = ['name', 'slug', 'skill_count', 'provider_count', 'last_updated']
+    search_fields = ['name']
+    # Maintained by signals.py
+    readonly_fields = ['skill_count', 'provider_count']
+
+
+@admin.register(Provider)
+class ProviderAdmin(LargeTableAdmin):
+    list_display = ['username', 'company_name', 'first_name', 'last_name', 'is_active', 'last_updated']
+    search_fields = ['company_name', 'first_name', 'last_name', 'about_me']
+    fields = ['username', 'first_name', 'last_name', 'email', 'is_active', 'company_name', 'phone_number',
+              'email_address', 'website', 'about_me', 'picture', 'categories']
+    autocomplete_fields = ['categories']
+    action_form = RecategorizeForm
+    actions = [recategorize, deactivate]
+
+
+@admin.register(Skill)
+class SkillAdmin(LargeTableAdmin):
+    list_display = ['name', 'provider', 'cost_range', 'last_updated']
+    list_select_related = ['provider']
+    search_fields = ['name', 'description']
+    fields = ['name', 'provider', 'cost_range', 'description', 'slug']
+    autocomplete_fields = ['provider']
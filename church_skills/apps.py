@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ChurchSkillsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'church_skills'
+
+    def ready(self):
+        # Connects the model and database signal handlers and registers the system checks
+        from . import checks, db, profiling, signals  # noqa: F401
@@ -0,0 +1,42 @@
+"""
+    Authentication backend that keeps logged in users in the cache.
+
+    AuthenticationMiddleware loads request.user from the database on every request that uses it.  With the cached_db
+    session engine the session comes from the cache too, so an authenticated page view makes no auth queries once both
+    are cached.  Cached users are dropped whenever the user row is saved or deleted (a password change saves it) and
+    when the user logs out, see signals.py.  The cached user carries the password hash that session verification
+    checks, so other sessions are still logged out by a password change.  The cache must be shared by every worker
+    process, or the entries dropped in one worker live on in the others, see checks.py
+"""
+# Django imports
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+
+KEY_FORMAT = 'skills:user:{}'
+
+
+def get_cache():
+    # Kept alongside the sessions, whose lifetime they share
+    return caches[settings.SESSION_CACHE_ALIAS]
+
+
+def user_key(user_id):
+    return KEY_FORMAT.format(user_id)
+
+
+def forget_user(user_id):
+    get_cache().delete(user_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        cache = get_cache()
+        key = user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super(CachedModelBackend, self).get_user(user_id)
+            if user is not None:
+                cache.set(key, user, getattr(settings, 'SKILLS_USER_CACHE_TIMEOUT', 300))
+        return user
@@ -0,0 +1,252 @@
+"""
+    Synthetic directory data and a benchmark of the directory views.
+
+    generate() fills the database with a reproducible directory, the same seed and sizes always produce the same
+    rows.  Everything is written with bulk inserts, which skip the model signals, so the search index, the category
+    counts, the directory entries and the response cache are brought up to date once at the end.  run() requests each
+    view through the test client a number of times and reports latency percentiles and SQL query counts, which can be
+    written out as JSON and compared between commits
+"""
+# Python imports
+import datetime
+import math
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+# Django imports
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+# Local imports
+from . import cache, counts, directory
+from .importer import insert_child_rows
+from .models import Category, Provider, Skill
+from .search import get_backend
+
+
+WORDS = [
+    'plumbing', 'electrical', 'carpentry', 'painting', 'roofing', 'tutoring', 'piano', 'guitar', 'baking', 'catering',
+    'gardening', 'landscaping', 'cleaning', 'tax', 'accounting', 'legal', 'photography', 'video', 'design', 'web',
+    'computer', 'repair', 'auto', 'bicycle', 'sewing', 'tailoring', 'childcare', 'eldercare', 'pet', 'dog', 'moving',
+    'hauling', 'welding', 'masonry', 'tile', 'flooring', 'drywall', 'hvac', 'appliance', 'locksmith', 'fitness',
+    'yoga', 'counseling', 'translation', 'spanish', 'french', 'math', 'science', 'writing', 'editing', 'music',
+    'singing', 'dance', 'art', 'pottery', 'knitting', 'quilting', 'woodworking', 'framing', 'fencing', 'concrete',
+    'pressure', 'washing', 'window', 'gutter', 'snow', 'removal', 'event', 'planning', 'wedding', 'florist', 'hair',
+    'makeup', 'massage', 'nursing', 'first', 'aid', 'cpr', 'resume', 'coaching', 'marketing', 'bookkeeping',
+]
+FIRST_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+               'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Daniel', 'Karen']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Lee']
+COST_RANGES = [None, '$', '$$', '$$$', 'Free', '$20-$40', '$50/hour', 'Varies']
+
+USERNAME_FORMAT = 'provider{:06d}'
+BATCH_SIZE = 2000
+
+
+def phrase(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def batches(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def generate(providers=50000, skills=500000, categories=200, seed=0, progress=None):
+    """
+        Adds categories, providers (each in one to three categories, popular categories first) and skills (spread
+        unevenly over the providers) to the database.  Returns the number of rows created per model
+    """
+    rng = random.Random(seed)
+    report = progress or (lambda message: None)
+
+    with transaction.atomic():
+        category_objs = []
+        for number in range(categories):
+            name = '{} {}'.format(phrase(rng, 2).title(), number)
+            category_objs.append(Category(name=name, slug='{}-{}'.format(name.split()[0].lower(), number)))
+        Category.objects.bulk_create(category_objs, batch_size=BATCH_SIZE)
+        category_ids = list(Category.objects.filter(slug__in=[obj.slug for obj in category_objs])
+                            .order_by('pk').values_list('pk', flat=True))
+        report('{} categories'.format(len(category_ids)))
+
+    # Zipf-like popularity, the first categories get most of the providers
+    category_weights = [1 / (rank + 1) for rank in range(len(category_ids))]
+    usernames = [USERNAME_FORMAT.format(number) for number in range(providers)]
+    password = make_password(None)
+    provider_ids = []
+    for chunk in batches(usernames):
+        with transaction.atomic():
+            users = []
+            for username in chunk:
+                users.append(User(username=username, password=password, first_name=rng.choice(FIRST_NAMES),
+                                  last_name=rng.choice(LAST_NAMES)))
+            User.objects.bulk_create(users)
+            user_ids = dict(User.objects.filter(username__in=chunk).values_list('username', 'pk'))
+
+            provider_objs, links = [], []
+            through = Provider.categories.through
+            for username in chunk:
+                provider_objs.append(Provider(
+                    user_ptr_id=user_ids[username], username=username, slug=username,
+                    company_name='{} Services'.format(phrase(rng, 1).title()) if rng.random() < 0.5 else None,
+                    phone_number='555{:07d}'.format(rng.randrange(10 ** 7)),
+                    email_address='{}@example.com'.format(username),
+                    about_me=phrase(rng, rng.randint(5, 30)),
+                ))
+                for category_id in set(rng.choices(category_ids, category_weights, k=rng.randint(1, 3))):
+                    links.append(through(provider_id=user_ids[username], category_id=category_id))
+            insert_child_rows(Provider, provider_objs)
+            through.objects.bulk_create(links, batch_size=BATCH_SIZE)
+            provider_ids += [user_ids[username] for username in chunk]
+    report('{} providers'.format(providers))
+
+    # A long tail, a few providers list many skills and most list a handful
+    provider_weights = [1 / math.sqrt(rank + 1) for rank in range(len(provider_ids))]
+    created = 0
+    while created < skills and provider_ids:
+        size = min(BATCH_SIZE * 5, skills - created)
+        owners = rng.choices(provider_ids, provider_weights, k=size)
+        skill_objs = []
+        for offset, provider_id in enumerate(owners):
+            name = phrase(rng, rng.randint(1, 3))
+            skill_objs.append(Skill(provider_id=provider_id, name=name,
+                                    slug='{}-{}'.format(name.replace(' ', '-'), created + offset),
+                                    description=phrase(rng, rng.randint(5, 40)),
+                                    cost_range=rng.choice(COST_RANGES)))
+        with transaction.atomic():
+            Skill.objects.bulk_create(skill_objs, batch_size=BATCH_SIZE)
+        created += size
+        report('{} skills'.format(created))
+
+    with transaction.atomic():
+        indexed = get_backend().rebuild(chunk_size=BATCH_SIZE)
+    report('{} search index rows'.format(indexed))
+    report('{} directory entries'.format(directory.rebuild(chunk_size=BATCH_SIZE)))
+    counts.reconcile()
+    cache.bump([cache.directory_key()])
+    return {'categories': len(category_ids), 'providers': providers, 'skills': created}
+
+
+def percentile(values, fraction):
+    """
+        Nearest rank percentile of a sorted list
+    """
+    return values[min(max(math.ceil(fraction * len(values)) - 1, 0), len(values) - 1)]
+
+
+def summarize(latencies, query_counts):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'min_ms': latencies[0] * 1000,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p90_ms': percentile(latencies, 0.90) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'queries_median': statistics.median(query_counts),
+        'queries_max': max(query_counts),
+    }
+
+
+def scenarios(seed=0):
+    """
+        (name, url, xhr) for each view benchmarked, using the busiest category and provider and a common search word
+    """
+    rng = random.Random(seed)
+    category = Category.objects.order_by('-skill_count', 'pk').first()
+    provider = Skill.objects.filter(provider__isnull=False).values('provider__username')\
+        .annotate(skills=Count('pk')).order_by('-skills', 'provider__username').first()
+    term = rng.choice(WORDS)
+    search = '{}?name={}'.format(reverse('church_skills:search_results'), term)
+
+    found = [
+        ('main', reverse('church_skills:main'), False),
+        ('search', search, False),
+        ('search_json', search, True),
+        ('category_list', reverse('church_skills:category_list'), False),
+        ('category_list_json', reverse('church_skills:category_list'), True),
+    ]
+    if category is not None:
+        url = reverse('church_skills:category_detail', args=[category.slug])
+        found += [('category_detail', url, False), ('category_detail_json', url, True)]
+    if provider is not None:
+        found.append(('profile_detail', reverse('church_skills:profile_detail',
+                                                args=[provider['provider__username']]), False))
+    return found
+
+
+def measure(client, url, xhr, iterations, warmup=2, warm_cache=False):
+    headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if xhr else {}
+    latencies, query_counts = [], []
+    for number in range(warmup + iterations):
+        if not warm_cache:
+            # Measure the view itself rather than the response cache in front of it
+            cache.get_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url, **headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise ValueError('{} returned {}'.format(url, response.status_code))
+        if number >= warmup:
+            latencies.append(elapsed)
+            query_counts.append(len(queries))
+    return summarize(latencies, query_counts)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(iterations=20, warmup=2, warm_cache=False, only=None, seed=0, progress=None):
+    """
+        Benchmarks every scenario (or just those named in only) and returns the results with enough about the run
+        to tell whether two result files are comparable
+    """
+    client = Client()
+    results = []
+    # The test client calls itself testserver
+    with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+        for name, url, xhr in scenarios(seed):
+            if only and name not in only:
+                continue
+            result = {'name': name, 'url': url, 'xhr': xhr}
+            result.update(measure(client, url, xhr, iterations, warmup=warmup, warm_cache=warm_cache))
+            results.append(result)
+            if progress is not None:
+                progress(result)
+    return {
+        'revision': git_revision(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'rows': {
+            'categories': Category.objects.count(),
+            'providers': Provider.objects.count(),
+            'skills': Skill.objects.count(),
+        },
+        'iterations': iterations,
+        'warm_cache': warm_cache,
+        'results': results,
+    }
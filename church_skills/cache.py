@@ -0,0 +1,155 @@
+"""
+    Response cache for the read-mostly directory pages.
+
+    Cached responses are keyed on version stamps instead of expiring after a guessed TTL.  There is one stamp for the
+    whole directory and one per category (by slug) and per provider (by username).  signals.py bumps the stamps when
+    a Category, Provider or Skill changes, which moves every page that showed it onto a new key, the stale entries are
+    never read again and simply age out of the cache.  Only get, set, add and get_many are used, so any of Django's
+    cache backends works, as long as every worker process shares it (see checks.py).  The per user page chrome cached
+    by the cachedfragment tag (see templatetags/fragments.py) is keyed on a stamp per user, and so are a logged in
+    user's cached pages, which have that chrome rendered into them
+"""
+# Python imports
+import hashlib
+import uuid
+from collections import Counter
+
+# Django imports
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+# Local imports
+from .routers import replica_version
+
+
+CSRF_PLACEHOLDER = 'csrf-placeholder-6b3a9c1e'
+KEY_PREFIX = 'skills:'
+
+# Per process hit/miss counters
+stats = Counter()
+
+
+def get_cache():
+    return caches[getattr(settings, 'SKILLS_CACHE_ALIAS', 'default')]
+
+
+def version_key(scope, name=None):
+    if name is None:
+        return '{}version:{}'.format(KEY_PREFIX, scope)
+    return '{}version:{}:{}'.format(KEY_PREFIX, scope, name)
+
+
+def directory_key():
+    return version_key('directory')
+
+
+def category_key(slug):
+    return version_key('category', slug)
+
+
+def provider_key(username):
+    return version_key('provider', username)
+
+
+def search_key():
+    # Bumped whenever the search index changes, see searchcache.py
+    return version_key('search')
+
+
+def user_fragments_key(user_id):
+    return version_key('user_fragments', user_id)
+
+
+def new_stamp():
+    # Random rather than incrementing, if a stamp is evicted it must not come back as a value it had before
+    return uuid.uuid4().hex
+
+
+def get_versions(keys):
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            stamp = new_stamp()
+            # add() so that two processes starting the same stamp at once end up agreeing on one
+            if not cache.add(key, stamp, None):
+                stamp = cache.get(key, stamp)
+            versions[key] = stamp
+    return [versions[key] for key in keys]
+
+
+def bump(keys):
+    keys = set(keys)
+    if keys:
+        get_cache().set_many({key: new_stamp() for key in keys}, None)
+
+
+def response_key(request, versions):
+    user = request.user.pk if request.user.is_authenticated else 'anonymous'
+    xhr = request.headers.get('x_requested_with') == 'XMLHttpRequest'
+    raw = '|'.join([request.get_full_path(), str(xhr), str(user), replica_version()] + list(versions))
+    return '{}response:{}'.format(KEY_PREFIX, hashlib.md5(raw.encode()).hexdigest())
+
+
+def fragment_cache_key(name, user, versions, extra=''):
+    raw = '|'.join([name, str(user), extra] + list(versions))
+    return '{}fragment:{}'.format(KEY_PREFIX, hashlib.md5(raw.encode()).hexdigest())
+
+
+def invalidate_user_fragments(user_id):
+    """
+        Drops the per_user fragments cached for one user
+    """
+    bump([user_fragments_key(user_id)])
+
+
+def fill_csrf_token(request, content):
+    if CSRF_PLACEHOLDER.encode() in content:
+        content = content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+    return content
+
+
+class VersionedCacheMixin:
+    """
+        Caches GET responses under the version stamps returned by get_cache_versions().  Pages are rendered with a
+        placeholder CSRF token that is swapped for the visitor's own token whenever the page is served, so the same
+        cached copy can go to every anonymous visitor
+    """
+    def get_cache_versions(self):
+        return [directory_key()]
+
+    def get_context_data(self, *args, **kwargs):
+        context = super(VersionedCacheMixin, self).get_context_data(*args, **kwargs)
+        context['csrf_token'] = CSRF_PLACEHOLDER
+        return context
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super(VersionedCacheMixin, self).dispatch(request, *args, **kwargs)
+
+        cache = get_cache()
+        keys = self.get_cache_versions()
+        if request.user.is_authenticated:
+            # The page includes the logged in user's navigation, whose stamp moves when the user is renamed
+            keys = keys + [user_fragments_key(request.user.pk)]
+        key = response_key(request, get_versions(keys))
+        cached = cache.get(key)
+        if cached is not None:
+            stats['hits'] += 1
+            content, content_type = cached
+            response = HttpResponse(fill_csrf_token(request, content), content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        stats['misses'] += 1
+        response = super(VersionedCacheMixin, self).dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            cache.set(key, (response.content, response['Content-Type']),
+                      getattr(settings, 'SKILLS_CACHE_TIMEOUT', 60 * 60 * 24))
+            response.content = fill_csrf_token(request, response.content)
+            response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,38 @@
+"""
+    System checks for settings that only break once the site runs in more than one worker process.
+
+    Sessions, the cached users of backends.CachedModelBackend and the version stamps of cache.py must be seen by every
+    worker: a logout, password change or deactivation only clears the entries of the worker that handled it, and a
+    stamp bumped in one worker leaves the others serving the pages it was meant to retire.  A process local cache
+    (LocMemCache) is fine for a single process such as runserver and wrong for anything more, SKILLS_WORKERS (by
+    default the WEB_CONCURRENCY gunicorn and uvicorn read) says how many processes there are
+"""
+# Django imports
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.utils.module_loading import import_string
+
+
+PROCESS_LOCAL_BACKENDS = ['django.core.cache.backends.locmem.LocMemCache']
+
+
+def process_local(alias):
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if not backend:
+        return False
+    return any(issubclass(import_string(backend), import_string(local)) for local in PROCESS_LOCAL_BACKENDS)
+
+
+@register(Tags.caches)
+def shared_caches_check(app_configs, **kwargs):
+    workers = getattr(settings, 'SKILLS_WORKERS', 1)
+    if workers <= 1:
+        return []
+    uses = {}
+    uses.setdefault(settings.SESSION_CACHE_ALIAS, []).append('sessions and logged in users')
+    uses.setdefault(getattr(settings, 'SKILLS_CACHE_ALIAS', 'default'), []).append('cache version stamps')
+    return [Error('The {!r} cache holds the {} but is local to each of the {} worker processes'.format(
+                      alias, ', '.join(used_for), workers),
+                  hint='Point it at a shared cache such as RedisCache or PyMemcacheCache',
+                  id='church_skills.E001')
+            for alias, used_for in uses.items() if process_local(alias)]
@@ -0,0 +1,69 @@
+"""
+    Conditional GET (ETag) for the directory pages.
+
+    A view lists the aggregate state of the rows it shows in get_validators(), usually the max last_updated and a row
+    count, which is a cheap indexed query.  When the browser or a proxy already holds a copy with the same validators
+    it gets a 304 before anything is rendered.  Only an ETag is sent: a Last-Modified date can't tell that a row was
+    deleted or that the visitor logged in or out, and a client sending only If-Modified-Since would get a wrong 304
+"""
+# Python imports
+import hashlib
+
+# Django imports
+from django.db.models import Count, Max, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+# Local imports
+from .cache import get_versions, user_fragments_key
+
+
+def table_state(queryset):
+    """
+        The (latest last_updated, row count) of a queryset.  The count catches deletions, which don't move the max
+    """
+    state = queryset.order_by().aggregate(updated=Max('last_updated'), rows=Count('pk'))
+    return state['updated'], state['rows']
+
+
+def latest(queryset):
+    """
+        Subquery for the newest last_updated of a queryset, for folding several validators into a single query
+    """
+    return Subquery(queryset.order_by('-last_updated').values('last_updated')[:1])
+
+
+class ConditionalGetMixin:
+    def get_validators(self):
+        """
+            Returns a list of values (datetimes, counts...) that change whenever the page content does
+        """
+        raise NotImplementedError
+
+    def get_etag(self, validators):
+        request = self.request
+        user = ['anonymous']
+        if request.user.is_authenticated:
+            # The navigation shows the user's name, which the user's fragment stamp follows
+            user = [str(request.user.pk)] + get_versions([user_fragments_key(request.user.pk)])
+        xhr = request.headers.get('x_requested_with') == 'XMLHttpRequest'
+        # The same url serves HTML and JSON and shows the logged in user in the navigation, all of which must
+        # produce different tags
+        raw = '|'.join([request.get_full_path(), str(xhr)] + user + [str(value) for value in validators])
+        return 'W/"{}"'.format(hashlib.md5(raw.encode()).hexdigest())
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs)
+
+        etag = self.get_etag(self.get_validators())
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            response['ETag'] = etag
+            return response
+
+        response = super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            # Let clients keep the page but have them check back every time, which is what makes the 304s happen
+            patch_cache_control(response, max_age=0, must_revalidate=True)
+        return response
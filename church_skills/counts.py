@@ -0,0 +1,97 @@
+"""
+    Category.skill_count and Category.provider_count are denormalized so listing pages don't have to count rows for
+    every category.  They are adjusted in place (UPDATE ... SET count = count + n) by the handlers in signals.py, and
+    reconcile() recomputes them from scratch should they ever drift
+"""
+# Django imports
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+# Local imports
+from .db import retry_on_locked
+from .models import Category, Provider, Skill
+
+
+def adjust(category_ids, skills=0, providers=0):
+    category_ids = list(category_ids)
+    if not category_ids or (skills == 0 and providers == 0):
+        return
+    # last_updated moves along with the counts, update() skips auto_now and the conditional GET validators rely on it
+    Category.objects.filter(pk__in=category_ids).update(skill_count=F('skill_count') + skills,
+                                                        provider_count=F('provider_count') + providers,
+                                                        last_updated=timezone.now())
+
+
+def provider_category_ids(provider_id):
+    if provider_id is None:
+        return []
+    return list(Provider.categories.through.objects.filter(provider_id=provider_id)
+                .values_list('category_id', flat=True))
+
+
+def skill_moved(old_provider_id, new_provider_id):
+    """
+        Moves one skill's contribution from the categories of old_provider_id to those of new_provider_id
+    """
+    with transaction.atomic():
+        adjust(provider_category_ids(old_provider_id), skills=-1)
+        adjust(provider_category_ids(new_provider_id), skills=1)
+
+
+def providers_linked(provider_ids, category_ids, sign):
+    """
+        Called when provider/category links are added (sign=1) or removed (sign=-1).  Every provider adds itself and
+        all of its skills to every category it is linked to
+    """
+    provider_ids = list(provider_ids)
+    category_ids = list(category_ids)
+    if not provider_ids or not category_ids:
+        return
+    skill_count = Skill.objects.filter(provider_id__in=provider_ids).count()
+    if len(provider_ids) == 1 or len(category_ids) == 1:
+        # The normal case, either one provider changing its categories or one category changing its providers
+        adjust(category_ids, skills=sign * skill_count, providers=sign * len(provider_ids))
+        return
+    for provider_id in provider_ids:
+        adjust(category_ids, skills=sign * Skill.objects.filter(provider_id=provider_id).count(), providers=sign)
+
+
+def counted_categories():
+    """
+        Categories annotated with their real counts as true_skill_count and true_provider_count
+    """
+    through = Provider.categories.through
+    skills = Skill.objects.filter(provider__categories=OuterRef('pk')).order_by()\
+        .values('provider__categories').annotate(count=Count('pk')).values('count')
+    providers = through.objects.filter(category_id=OuterRef('pk')).order_by()\
+        .values('category_id').annotate(count=Count('pk')).values('count')
+    return Category.objects.annotate(
+        true_skill_count=Coalesce(Subquery(skills, output_field=IntegerField()), 0),
+        true_provider_count=Coalesce(Subquery(providers, output_field=IntegerField()), 0),
+    )
+
+
+def drifted():
+    return counted_categories().filter(~Q(skill_count=F('true_skill_count'))
+                                       | ~Q(provider_count=F('true_provider_count')))
+
+
+@retry_on_locked
+def reconcile(category_ids=None):
+    """
+        Repairs every category (or every one of category_ids) whose stored counts are wrong, returns the number of
+        categories that were fixed
+    """
+    fixed = 0
+    categories = drifted()
+    if category_ids is not None:
+        categories = categories.filter(pk__in=list(category_ids))
+    with transaction.atomic():
+        for category in categories.select_for_update():
+            Category.objects.filter(pk=category.pk).update(skill_count=category.true_skill_count,
+                                                           provider_count=category.true_provider_count,
+                                                           last_updated=timezone.now())
+            fixed += 1
+    return fixed
@@ -0,0 +1,73 @@
+"""
+    Compact columnar payloads for the sortable tables.
+
+    When a table's whole result fits under SKILLS_TABLE_DATASET_LIMIT rows the page asks for it once with ?dataset=1
+    and sorts it in the browser from then on, rather than asking the server for every header click.  The payload is a
+    set of parallel arrays, one per column, plus one array of ranks per sort field: row i comes at position
+    sort_keys[field][i] when sorted ascending by (sort key, id), the same order the keyset pages use, so the browser
+    only sorts numbers and never compares strings itself.  Larger results get the usual keyset page instead, which has
+    "dataset": false
+"""
+# Python imports
+import hashlib
+import json
+from urllib.parse import quote
+
+# Django imports
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import RFC3986_SUBDELIMS
+
+
+PLACEHOLDER = 'dataset-placeholder'
+
+
+def dataset_limit():
+    return getattr(settings, 'SKILLS_TABLE_DATASET_LIMIT', 2000)
+
+
+def url_builder(viewname):
+    """
+        A function making the url of viewname for one argument.  reverse() runs once, each row is then a string
+        replace rather than a trip through the url resolver
+    """
+    pattern = reverse(viewname, args=[PLACEHOLDER])
+    return lambda value: pattern.replace(PLACEHOLDER, quote(str(value), safe=RFC3986_SUBDELIMS + '/~:@'))
+
+
+def sort_ranks(keys, pks):
+    """
+        The position of each row when sorted ascending by (key, pk)
+    """
+    ranks = [0] * len(keys)
+    # None sorts first, as NULL does in SQLite
+    order = sorted(range(len(keys)), key=lambda row: (keys[row] is not None, keys[row], pks[row]))
+    for position, row in enumerate(order):
+        ranks[row] = position
+    return ranks
+
+
+def dataset_response(request, columns, sort_keys, content_etag=True):
+    """
+        The columnar payload with an ETag over its content, or a 304 when the browser already has it.  Views whose
+        own ETag already covers the rows (see conditional.py) pass content_etag=False, so there is only ever one
+        validator for the resource
+    """
+    data = {
+        'dataset': True,
+        'count': len(columns['id']),
+        'columns': columns,
+        'sort_keys': sort_keys,
+    }
+    body = json.dumps(data, separators=(',', ':'), cls=DjangoJSONEncoder).encode()
+    if not content_etag:
+        return HttpResponse(body, content_type='application/json')
+    etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
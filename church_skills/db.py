@@ -0,0 +1,66 @@
+"""
+    SQLite concurrency settings and a retry helper for writes.
+
+    Every new SQLite connection gets the pragmas in settings.SKILLS_SQLITE_PRAGMAS: WAL so readers and the writer don't
+    block each other, a busy_timeout so a writer waits for the lock instead of failing straight away, and
+    synchronous=NORMAL which is safe with WAL.  busy_timeout doesn't help when a transaction that started out reading
+    has to be upgraded to a write while another connection holds the lock, SQLite gives up on those immediately, so
+    write paths are wrapped in retry_on_locked which reruns them a bounded number of times with backoff
+"""
+# Python imports
+import functools
+import random
+import time
+
+# Django imports
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+}
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SKILLS_SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def is_locked_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_locked(func=None, attempts=6, base_delay=0.05, max_delay=2.0, using=None):
+    """
+        Reruns func when the database reports it is locked, waiting base_delay, 2 * base_delay... (capped at
+        max_delay, with full jitter so the waiting writers don't all come back at the same moment) and giving up
+        after attempts tries.  func should do its writes in its own transaction.atomic() block, inside somebody
+        else's transaction a retry would repeat only part of the work, so there the error is raised straight away.
+        Can be used as @retry_on_locked or @retry_on_locked(attempts=...)
+    """
+    if func is None:
+        return functools.partial(retry_on_locked, attempts=attempts, base_delay=base_delay, max_delay=max_delay,
+                                 using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if (not is_locked_error(error) or attempt == attempts - 1
+                        or transaction.get_connection(using).in_atomic_block):
+                    raise
+                time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+    return wrapper
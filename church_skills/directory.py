@@ -0,0 +1,140 @@
+"""
+    The materialized directory the listing pages read, see models.DirectoryEntry.
+
+    There is one entry per skill and category of the skill's provider, a skill whose provider has no categories gets
+    a single entry with no category, and one entry of each skill is marked is_primary for pages listing each skill
+    once.  The names, urls and sort keys the pages show are copied in, so the category and search tables are single
+    table index scans.  Skills without a provider aren't listed anywhere and have no entries.
+
+    signals.py keeps the entries up to date: a saved skill or a provider whose categories changed gets its entries
+    rewritten, renamed providers and categories have their copied fields updated in place.  Bulk writes skip the
+    signals, the importer refreshes the entries of every chunk and rebuild() (the rebuild_directory command) writes
+    the whole table again
+"""
+# Django imports
+from django.db import transaction
+
+# Local imports
+from .dataset import url_builder
+from .models import DirectoryEntry, Provider, Skill
+
+
+BATCH_SIZE = 2000
+
+SKILL_FIELDS = ['pk', 'name', 'description', 'cost_range', 'provider_id', 'provider__username',
+                'provider__company_name', 'provider__first_name', 'provider__last_name']
+
+
+def provider_name(company_name, first_name, last_name, username):
+    # Provider.__str__
+    return company_name or '{} {}'.format(first_name, last_name).strip() or username
+
+
+def category_links(through, provider_ids):
+    """
+        {provider id: [(category id, name, slug)...]} in category id order
+    """
+    links = {}
+    rows = through.objects.filter(provider_id__in=provider_ids).order_by('provider_id', 'category_id')\
+        .values_list('provider_id', 'category_id', 'category__name', 'category__slug')
+    for provider_id, category_id, name, slug in rows:
+        links.setdefault(provider_id, []).append((category_id, name, slug))
+    return links
+
+
+def entry_fields(skill_rows, links):
+    """
+        Yields the field values of the entries of skill_rows, tuples of SKILL_FIELDS
+    """
+    profile_url = url_builder('church_skills:profile_detail')
+    category_url = url_builder('church_skills:category_detail')
+    for pk, name, description, cost_range, provider_id, username, company_name, first_name, last_name in skill_rows:
+        if provider_id is None:
+            continue
+        shared = {
+            'skill_id': pk,
+            'provider_id': provider_id,
+            'skill_name': name,
+            'skill_description': description or '',
+            'cost_range': cost_range,
+            'cost_sort': cost_range or '',
+            'provider_username': username,
+            'provider_name': provider_name(company_name, first_name, last_name, username),
+            'provider_url': profile_url(username),
+        }
+        for number, (category_id, category_name, slug) in enumerate(links.get(provider_id, [(None, None, None)])):
+            yield dict(shared, category_id=category_id, category_name=category_name, is_primary=number == 0,
+                       category_url=category_url(slug) if category_id is not None else '')
+
+
+def populate(entry_model, skills, through, chunk_size=BATCH_SIZE):
+    """
+        Inserts the entries of a Skill queryset, returns the number written.  Migration 0008 has a copy of this as it
+        was then, changes here don't reach it
+    """
+    written = 0
+    last = None
+    rows = skills.filter(provider__isnull=False).order_by('pk').values_list(*SKILL_FIELDS)
+    while True:
+        # Keyset chunks rather than one long running cursor while the inserts go on
+        chunk = list((rows if last is None else rows.filter(pk__gt=last))[:chunk_size])
+        if not chunk:
+            return written
+        links = category_links(through, {row[4] for row in chunk})
+        entries = [entry_model(**fields) for fields in entry_fields(chunk, links)]
+        entry_model.objects.bulk_create(entries, batch_size=chunk_size)
+        written += len(entries)
+        last = chunk[-1][0]
+
+
+def rebuild(chunk_size=BATCH_SIZE):
+    with transaction.atomic():
+        DirectoryEntry.objects.all().delete()
+        return populate(DirectoryEntry, Skill.objects.all(), Provider.categories.through, chunk_size)
+
+
+def refresh_skills(skill_ids):
+    """
+        Rewrites the entries of the given skills
+    """
+    skill_ids = list(skill_ids)
+    if not skill_ids:
+        return
+    with transaction.atomic():
+        DirectoryEntry.objects.filter(skill_id__in=skill_ids).delete()
+        populate(DirectoryEntry, Skill.objects.filter(pk__in=skill_ids), Provider.categories.through)
+
+
+def refresh_providers(provider_ids):
+    """
+        Rewrites the entries of every skill of the given providers, after their categories changed
+    """
+    provider_ids = [pk for pk in provider_ids if pk is not None]
+    if not provider_ids:
+        return
+    with transaction.atomic():
+        DirectoryEntry.objects.filter(provider_id__in=provider_ids).delete()
+        populate(DirectoryEntry, Skill.objects.filter(provider_id__in=provider_ids), Provider.categories.through)
+
+
+def update_providers(provider_ids):
+    """
+        Copies the providers' names into their entries
+    """
+    profile_url = url_builder('church_skills:profile_detail')
+    rows = Provider.objects.filter(pk__in=list(provider_ids))\
+        .values_list('pk', 'username', 'company_name', 'first_name', 'last_name')
+    for pk, username, company_name, first_name, last_name in rows:
+        DirectoryEntry.objects.filter(provider_id=pk).update(
+            provider_username=username, provider_url=profile_url(username),
+            provider_name=provider_name(company_name, first_name, last_name, username))
+
+
+def update_categories(categories):
+    """
+        Copies the categories' names into their entries
+    """
+    category_url = url_builder('church_skills:category_detail')
+    for category in categories:
+        DirectoryEntry.objects.filter(category_id=category.pk).update(category_name=category.name,
+                                                                      category_url=category_url(category.slug))
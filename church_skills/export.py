@@ -0,0 +1,96 @@
+"""
+    Streaming export of the provider/skill directory as CSV or NDJSON.
+
+    Rows are read with iterator() and written out one at a time, so neither the export view nor the export_directory
+    command ever holds more than one chunk of skills in memory.  The CSV columns match what import_directory reads
+"""
+# Python imports
+import csv
+import datetime
+import json
+
+# Django imports
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+# Local imports
+from .importer import CATEGORY_SEPARATOR
+from .models import Skill
+
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+COLUMNS = ['skill_id', 'name', 'description', 'cost_range', 'provider', 'provider_name', 'company_name',
+           'phone_number', 'email_address', 'website', 'categories', 'last_updated']
+
+
+def parse_since(value):
+    """
+        Parses an ISO 8601 date or date/time, raises ValueError for anything else
+    """
+    since = parse_datetime(value)
+    if since is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('{} is not an ISO 8601 date or date/time'.format(value))
+        since = datetime.datetime.combine(day, datetime.time.min)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def export_queryset(category=None, updated_since=None):
+    queryset = Skill.objects.filter(provider__isnull=False).select_related('provider')\
+        .prefetch_related('provider__categories').order_by('pk')
+    if category:
+        queryset = queryset.filter(provider__categories__slug=category)
+    if updated_since:
+        queryset = queryset.filter(Q(last_updated__gte=updated_since) | Q(provider__last_updated__gte=updated_since))
+    return queryset
+
+
+def export_rows(queryset, chunk_size=2000):
+    for skill in queryset.iterator(chunk_size=chunk_size):
+        provider = skill.provider
+        yield {
+            'skill_id': skill.pk,
+            'name': skill.name,
+            'description': skill.description,
+            'cost_range': skill.cost_range,
+            'provider': provider.username,
+            'provider_name': provider.get_full_name(),
+            'company_name': provider.company_name,
+            'phone_number': provider.phone_number,
+            'email_address': provider.email_address,
+            'website': provider.website,
+            'categories': CATEGORY_SEPARATOR.join(category.slug for category in provider.categories.all()),
+            'last_updated': skill.last_updated.isoformat() if skill.last_updated else None,
+        }
+
+
+class Echo:
+    """
+        File-like object that hands back what is written to it, lets csv.writer produce one line at a time
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([row[column] for column in COLUMNS])
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def export_lines(file_format, category=None, updated_since=None, chunk_size=2000):
+    rows = export_rows(export_queryset(category, updated_since), chunk_size=chunk_size)
+    return csv_lines(rows) if file_format == 'csv' else ndjson_lines(rows)
@@ -0,0 +1,150 @@
+"""
+    Trigram index for finding names spelled nearly like a search, "plumbng" finding Plumbing.
+
+    Every distinct word of the category, provider and skill names is stored once (SearchWord) together with its
+    trigrams, the three letter sequences of the word padded with two spaces in front and one behind as PostgreSQL's
+    pg_trgm does it (SearchTrigram), and SearchName records which names contain which words.  The vocabulary is far
+    smaller than the number of names, and a word's trigrams are only written the first time it is seen.
+
+    A query word's trigrams are looked up in the (trigram, word, size) index, the words sharing enough of them are
+    grouped and ranked by similarity, |shared| / |query trigrams + word trigrams - shared|, in the database, and the
+    names containing the closest words are found through the (word, kind, object_id) index and scored in the same
+    query.  Nothing is ever compared against every row.  The search backends keep the index up to date along with
+    their own, see search.py, and the rebuild_search_index command fills it from scratch
+"""
+# Python imports
+import math
+import re
+
+# Django imports
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Max, Value, When
+from django.db.models.functions import Cast
+
+# Local imports
+from .models import SearchName, SearchTrigram, SearchWord
+
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+MAX_WORD_LENGTH = 100
+# Query words looked at, and the closest indexed words kept for each
+MAX_QUERY_WORDS = 4
+SIMILAR_WORDS = 10
+BATCH_SIZE = 1000
+
+
+def threshold():
+    return getattr(settings, 'SKILLS_FUZZY_THRESHOLD', 0.3)
+
+
+def words(text):
+    return [word[:MAX_WORD_LENGTH] for word in WORD_RE.findall((text or '').lower())]
+
+
+def trigrams(word):
+    padded = '  {} '.format(word)
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+
+def word_ids(new_words):
+    """
+        {word: id} for new_words, adding the words seen for the first time along with their trigrams
+    """
+    new_words = set(new_words)
+    known = dict(SearchWord.objects.filter(word__in=new_words).values_list('word', 'pk'))
+    missing = new_words - set(known)
+    if missing:
+        # Another process may be adding the same words, the unique constraints turn the second copy into a no-op
+        SearchWord.objects.bulk_create([SearchWord(word=word) for word in missing], batch_size=BATCH_SIZE,
+                                       ignore_conflicts=True)
+        added = dict(SearchWord.objects.filter(word__in=missing).values_list('word', 'pk'))
+        rows = []
+        for word, pk in added.items():
+            grams = trigrams(word)
+            rows += [SearchTrigram(trigram=gram, word_id=pk, size=len(grams)) for gram in grams]
+        SearchTrigram.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        known.update(added)
+    return known
+
+
+def remove(objects):
+    """
+        Drops the names of objects, (kind, pk) pairs
+    """
+    by_kind = {}
+    for kind, pk in objects:
+        by_kind.setdefault(kind, []).append(pk)
+    for kind, pks in by_kind.items():
+        SearchName.objects.filter(kind=kind, object_id__in=pks).delete()
+
+
+def index(names):
+    """
+        Indexes names, (kind, pk, text) tuples, replacing whatever was indexed for them before
+    """
+    names = list(names)
+    if not names:
+        return
+    with transaction.atomic():
+        remove((kind, pk) for kind, pk, text in names)
+        ids = word_ids(word for kind, pk, text in names for word in words(text))
+        SearchName.objects.bulk_create([SearchName(word_id=ids[word], kind=kind, object_id=pk)
+                                        for kind, pk, text in names for word in set(words(text))],
+                                       batch_size=BATCH_SIZE)
+
+
+def clear():
+    SearchName.objects.all().delete()
+    SearchTrigram.objects.all().delete()
+    SearchWord.objects.all().delete()
+
+
+def similar_words(word, minimum_similarity):
+    """
+        [(word id, similarity)] of the indexed words closest to word, best first
+    """
+    grams = trigrams(word)
+    # A word sharing m of the query's q trigrams is at most m / q similar
+    needed = max(1, math.ceil(minimum_similarity * len(grams)))
+    rows = SearchTrigram.objects.filter(trigram__in=grams).values('word_id')\
+        .annotate(shared=Count('word_id'), word_size=Max('size'))\
+        .filter(shared__gte=needed)\
+        .annotate(similarity=Cast('shared', FloatField()) / (Value(len(grams)) + F('word_size') - F('shared')))\
+        .filter(similarity__gte=minimum_similarity)\
+        .order_by('-similarity', 'word_id')\
+        .values_list('word_id', 'similarity')
+    return list(rows[:SIMILAR_WORDS])
+
+
+def search(query, kinds=None, limit=None):
+    """
+        [(kind, pk, score)] of the names closest to query, best first.  A name scores the mean over the query words
+        of the similarity of its closest word to each
+    """
+    minimum_similarity = threshold()
+    query_words = list(dict.fromkeys(words(query)))[:MAX_QUERY_WORDS]
+    scores = {}
+    word_pks = set()
+    for number, word in enumerate(query_words):
+        similar = similar_words(word, minimum_similarity)
+        if similar:
+            word_pks.update(pk for pk, similarity in similar)
+            scores['score_{}'.format(number)] = Max(Case(
+                *[When(word_id=pk, then=Value(similarity)) for pk, similarity in similar],
+                default=Value(0.0), output_field=FloatField()))
+    if not scores:
+        return []
+
+    names = SearchName.objects.filter(word_id__in=word_pks)
+    if kinds:
+        names = names.filter(kind__in=kinds)
+    total = sum((F(name) for name in scores), Value(0.0))
+    rows = names.values('kind', 'object_id').annotate(**scores)\
+        .annotate(score=total / Value(float(len(query_words))))\
+        .filter(score__gte=minimum_similarity)\
+        .order_by('-score', 'kind', 'object_id')\
+        .values_list('kind', 'object_id', 'score')
+    if limit:
+        rows = rows[:limit]
+    return list(rows)
@@ -0,0 +1,341 @@
+"""
+    Streaming bulk import of categories, providers and skills from CSV or JSON-lines files.
+
+    Rows are read one at a time and written a chunk at a time, every chunk is upserted on its natural key (category
+    slug, provider username, provider + skill slug) with bulk_create/bulk_update inside its own transaction.  Only one
+    chunk is ever held in memory.  Bulk operations skip the model signals, so each chunk also updates the search index,
+    the directory entries and the response cache itself, and the counts of the categories the import touched are
+    reconciled once it is done.  Slugs keep non-ASCII letters, as the urls do, and rows whose name makes no slug at
+    all are skipped rather than merged into one another under the empty slug
+"""
+# Python imports
+import csv
+import json
+import os
+import time
+
+# Django imports
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+# Local imports
+from . import cache, counts, directory
+from .db import retry_on_locked
+from .models import Category, Provider, Skill
+from .search import get_backend
+
+
+CATEGORY_SEPARATOR = '|'
+# Categories whose counts are reconciled per query
+RECONCILE_CHUNK = 500
+
+
+def read_rows(path, file_format):
+    """
+        Yields one dict per input row
+    """
+    with open(path, newline='', encoding='utf-8') as input_file:
+        if file_format == 'csv':
+            for row in csv.DictReader(input_file):
+                yield row
+        else:
+            for line in input_file:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return 'csv' if extension == '.csv' else 'jsonl'
+
+
+def clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def make_slug(value):
+    return slugify(value, allow_unicode=True)
+
+
+def category_slugs(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(CATEGORY_SEPARATOR)
+    return [make_slug(slug) for slug in value if make_slug(slug)]
+
+
+def unique_by(rows, key):
+    """
+        Later rows win when a chunk names the same natural key twice
+    """
+    return list({key(row): row for row in rows}.values())
+
+
+class Checkpoint:
+    """
+        Remembers how many input rows have been committed so a failed import can pick up after the last good chunk
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as checkpoint_file:
+            return json.load(checkpoint_file)['rows']
+
+    def save(self, rows):
+        if self.path is None:
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as checkpoint_file:
+            json.dump({'rows': rows}, checkpoint_file)
+        os.replace(temporary, self.path)
+
+    def clear(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Importer:
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        # Categories whose links or skills the import changed
+        self.category_ids = set()
+        self.search = get_backend()
+
+    def import_chunk(self, rows):
+        raise NotImplementedError
+
+    def finish(self):
+        category_ids = sorted(self.category_ids)
+        for start in range(0, len(category_ids), RECONCILE_CHUNK):
+            counts.reconcile(category_ids[start:start + RECONCILE_CHUNK])
+        cache.bump([cache.directory_key()])
+
+
+class CategoryImporter(Importer):
+    def import_chunk(self, rows):
+        valid = []
+        for row in rows:
+            if not clean(row.get('name')):
+                continue
+            row['slug'] = make_slug(row.get('slug') or row['name'])
+            if not row['slug']:
+                self.skipped += 1
+                continue
+            valid.append(row)
+        rows = unique_by(valid, lambda row: row['slug'])
+
+        existing = {category.slug: category for category in
+                    Category.objects.filter(slug__in=[row['slug'] for row in rows])}
+        now = timezone.now()
+        new, changed = [], []
+        for row in rows:
+            category = existing.get(row['slug'])
+            if category is None:
+                new.append(Category(name=clean(row['name']), slug=row['slug']))
+            else:
+                category.name = clean(row['name'])
+                category.last_updated = now
+                changed.append(category)
+        Category.objects.bulk_create(new)
+        Category.objects.bulk_update(changed, ['name', 'last_updated'])
+
+        objects = list(Category.objects.filter(slug__in=[row['slug'] for row in rows]))
+        self.search.index_many(objects)
+        directory.update_categories(objects)
+        cache.bump([cache.category_key(category.slug) for category in objects])
+        self.created += len(new)
+        self.updated += len(changed)
+
+
+class ProviderImporter(Importer):
+    user_fields = ['first_name', 'last_name', 'email']
+    provider_fields = ['company_name', 'phone_number', 'email_address', 'about_me', 'website']
+
+    def import_chunk(self, rows):
+        rows = [row for row in rows if clean(row.get('username'))]
+        for row in rows:
+            row['username'] = clean(row['username'])
+        rows = unique_by(rows, lambda row: row['username'])
+        usernames = [row['username'] for row in rows]
+        now = timezone.now()
+
+        # Users first, the provider rows hang off the user primary keys
+        users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+        new_users = []
+        for row in rows:
+            user = users.get(row['username'])
+            if user is None:
+                user = User(username=row['username'], password=make_password(None))
+                new_users.append(user)
+            for field in self.user_fields:
+                setattr(user, field, clean(row.get(field)) or '')
+        User.objects.bulk_create(new_users)
+        User.objects.bulk_update(list(users.values()), self.user_fields)
+        user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'pk'))
+
+        providers = {provider.username: provider for provider in Provider.objects.filter(username__in=usernames)}
+        new_providers, changed = [], []
+        for row in rows:
+            provider = providers.get(row['username'])
+            if provider is None:
+                provider = Provider(user_ptr_id=user_ids[row['username']], username=row['username'])
+                new_providers.append(provider)
+            else:
+                provider.last_updated = now
+                changed.append(provider)
+            for field in self.provider_fields:
+                setattr(provider, field, clean(row.get(field)))
+            provider.slug = make_slug(row.get('slug') or row['username'])
+        insert_child_rows(Provider, new_providers)
+        Provider.objects.bulk_update(changed, self.provider_fields + ['slug', 'last_updated'])
+
+        # A categories column replaces the provider's links, rows without one leave them alone
+        linked_rows = [row for row in rows if 'categories' in row]
+        category_ids = dict(Category.objects.filter(
+            slug__in={slug for row in linked_rows for slug in category_slugs(row['categories'])}
+        ).values_list('slug', 'pk'))
+        through = Provider.categories.through
+        old_links = through.objects.filter(provider_id__in=[user_ids[row['username']] for row in linked_rows])
+        self.category_ids.update(old_links.values_list('category_id', flat=True))
+        old_links.delete()
+        links = []
+        for row in linked_rows:
+            for slug in category_slugs(row['categories']):
+                if slug in category_ids:
+                    links.append(through(provider_id=user_ids[row['username']], category_id=category_ids[slug]))
+                else:
+                    self.skipped += 1
+        through.objects.bulk_create(links, ignore_conflicts=True)
+        self.category_ids.update(link.category_id for link in links)
+
+        self.search.index_many(Provider.objects.filter(pk__in=user_ids.values()))
+        # Names and category links both end up in the entries, rewriting them covers either
+        directory.refresh_providers(user_ids.values())
+        cache.bump([cache.provider_key(username) for username in usernames]
+                   + [cache.category_key(slug) for slug in category_ids])
+        self.created += len(new_providers)
+        self.updated += len(changed)
+
+
+class SkillImporter(Importer):
+    fields = ['name', 'description', 'cost_range']
+
+    def import_chunk(self, rows):
+        provider_ids = dict(Provider.objects.filter(
+            username__in={clean(row.get('provider')) for row in rows}
+        ).values_list('username', 'pk'))
+        valid = []
+        for row in rows:
+            provider_id = provider_ids.get(clean(row.get('provider')))
+            slug = make_slug(row.get('slug') or row.get('name') or '')
+            if provider_id is None or not clean(row.get('name')) or not slug:
+                self.skipped += 1
+                continue
+            row['provider_id'] = provider_id
+            row['slug'] = slug
+            valid.append(row)
+        rows = unique_by(valid, lambda row: (row['provider_id'], row['slug']))
+
+        existing = {(skill.provider_id, skill.slug): skill for skill in
+                    Skill.objects.filter(provider_id__in={row['provider_id'] for row in rows},
+                                         slug__in={row['slug'] for row in rows})}
+        now = timezone.now()
+        new, changed = [], []
+        for row in rows:
+            skill = existing.get((row['provider_id'], row['slug']))
+            if skill is None:
+                skill = Skill(provider_id=row['provider_id'], slug=row['slug'])
+                new.append(skill)
+            else:
+                skill.last_updated = now
+                changed.append(skill)
+            for field in self.fields:
+                setattr(skill, field, clean(row.get(field)))
+        Skill.objects.bulk_create(new)
+        Skill.objects.bulk_update(changed, self.fields + ['last_updated'])
+
+        touched = list(provider_ids.values())
+        skills = Skill.objects.filter(provider_id__in=touched, slug__in={row['slug'] for row in rows})
+        self.search.index_many(skills)
+        directory.refresh_skills(skills.values_list('pk', flat=True))
+        categories = dict(Category.objects.filter(provider__in=touched).values_list('pk', 'slug'))
+        self.category_ids.update(categories)
+        cache.bump([cache.provider_key(username) for username in provider_ids]
+                   + [cache.category_key(slug) for slug in categories.values()])
+        self.created += len(new)
+        self.updated += len(changed)
+
+
+IMPORTERS = {
+    'category': CategoryImporter,
+    'provider': ProviderImporter,
+    'skill': SkillImporter,
+}
+
+
+def insert_child_rows(model, objs):
+    """
+        bulk_create refuses multi-table inherited models, but when the parent rows already exist only the child table
+        needs inserting, which is what save() does for the child table too
+    """
+    fields = model._meta.local_concrete_fields
+    batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+    for start in range(0, len(objs), batch_size):
+        model._base_manager._insert(objs[start:start + batch_size], fields=fields)
+
+
+def run(kind, path, file_format=None, chunk_size=1000, checkpoint=None, progress=None):
+    """
+        Imports path a chunk at a time.  Each chunk commits on its own and is recorded in the checkpoint, so a rerun
+        after a failure skips the rows that already made it in.  Returns the importer with its counters
+    """
+    importer = IMPORTERS[kind](chunk_size=chunk_size)
+    checkpoint = Checkpoint(checkpoint)
+    done = checkpoint.load()
+    start = time.monotonic()
+    processed = 0
+    chunk = []
+
+    @retry_on_locked
+    def commit_chunk():
+        with transaction.atomic():
+            importer.import_chunk(chunk)
+
+    def flush():
+        nonlocal done, processed
+        commit_chunk()
+        done += len(chunk)
+        processed += len(chunk)
+        checkpoint.save(done)
+        if progress is not None:
+            progress(done, processed / max(time.monotonic() - start, 1e-6))
+        chunk.clear()
+
+    for number, row in enumerate(read_rows(path, file_format or detect_format(path))):
+        if number < done:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    importer.finish()
+    checkpoint.clear()
+    importer.rows = processed
+    importer.seconds = time.monotonic() - start
+    return importer
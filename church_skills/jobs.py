@@ -0,0 +1,157 @@
+"""
+    Database backed queue for work that shouldn't hold up a request.
+
+    enqueue() adds a Job row naming a function by its dotted path and the keyword arguments to call it with, the
+    run_jobs command claims queued jobs and runs them.  The row is written in the caller's transaction, so a job
+    queued by a save that is rolled back never runs and one queued by a save that commits can't run before the save is
+    visible.  Jobs given a dedupe_key are only queued once while they wait: the search index job of a skill edited
+    five times before the worker gets to it runs once, against the latest row.
+
+    Several workers can run at once.  Where the database has SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL, MySQL 8)
+    each claims rows the others haven't locked, on SQLite a single UPDATE marks the rows as claimed, which SQLite's one
+    writer at a time makes atomic.  A job that raises is queued again after SKILLS_JOB_RETRY_DELAY seconds, doubling
+    with each attempt, and marked failed once it has used up its attempts.  Finished jobs are deleted, failed ones are
+    kept for looking at.  A worker that dies leaves its jobs running, once they have been running for
+    SKILLS_JOB_TIMEOUT seconds they count as a failed attempt.  Tasks must therefore be safe to run more than once
+"""
+# Python imports
+import datetime
+import logging
+import os
+import socket
+import traceback
+
+# Django imports
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# Local imports
+from .db import retry_on_locked
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts):
+    """
+        Seconds before a job that has failed attempts times runs again
+    """
+    base = getattr(settings, 'SKILLS_JOB_RETRY_DELAY', 30)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'SKILLS_JOB_MAX_RETRY_DELAY', 60 * 60))
+
+
+def worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())[:100]
+
+
+def task_path(task):
+    if isinstance(task, str):
+        return task
+    return '{}.{}'.format(task.__module__, task.__qualname__)
+
+
+def enqueue(task, arguments=None, priority=0, dedupe_key=None, delay=0, max_attempts=5):
+    """
+        Queues a call of task (a function or its dotted path) with arguments, a dict of JSON values.  Does nothing
+        when a job with the same dedupe_key is already waiting
+    """
+    job = Job(task=task_path(task), arguments=arguments or {}, priority=priority, dedupe_key=dedupe_key,
+              run_at=timezone.now() + datetime.timedelta(seconds=delay), max_attempts=max_attempts)
+    # ignore_conflicts turns a duplicate into a no-op (INSERT OR IGNORE / ON CONFLICT DO NOTHING) rather than an error
+    # that would break the caller's transaction
+    Job.objects.bulk_create([job], ignore_conflicts=dedupe_key is not None)
+
+
+def claimable(now):
+    return Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('-priority', 'run_at', 'id')
+
+
+@retry_on_locked
+def claim(worker, limit=1):
+    """
+        Marks up to limit due jobs as running by worker and returns them, highest priority first
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = {'status': Job.RUNNING, 'locked_by': worker, 'locked_at': now, 'attempts': F('attempts') + 1}
+        if connection.features.has_select_for_update_skip_locked:
+            pks = list(claimable(now).select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=pks).update(**claimed)
+        else:
+            # Candidates are picked and claimed in the one statement, the status check keeps two workers from
+            # claiming the same row should they ever interleave
+            Job.objects.filter(pk__in=claimable(now).values('pk')[:limit], status=Job.QUEUED).update(**claimed)
+        # A worker runs one batch at a time, its running jobs are the ones it has just claimed
+        return list(Job.objects.filter(status=Job.RUNNING, locked_by=worker, locked_at=now)
+                    .order_by('-priority', 'run_at', 'id'))
+
+
+@retry_on_locked
+def finish(job):
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).delete()
+
+
+@retry_on_locked
+def fail(job, error):
+    """
+        Queues job again after its backoff delay, or marks it failed when it has no attempts left
+    """
+    jobs = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    if job.attempts >= job.max_attempts:
+        jobs.update(status=Job.FAILED, locked_by='', locked_at=None, last_error=error)
+        return
+    run_at = timezone.now() + datetime.timedelta(seconds=retry_delay(job.attempts))
+    try:
+        with transaction.atomic():
+            jobs.update(status=Job.QUEUED, locked_by='', locked_at=None, run_at=run_at, last_error=error)
+    except IntegrityError:
+        # The same work was queued again while this ran, that job will do it
+        jobs.delete()
+
+
+def run(job):
+    """
+        Runs a claimed job, returns whether it succeeded
+    """
+    try:
+        import_string(job.task)(**job.arguments)
+    except Exception:
+        logger.exception('Job %s (%s) failed on attempt %s', job.pk, job.task, job.attempts)
+        fail(job, traceback.format_exc())
+        return False
+    finish(job)
+    return True
+
+
+def release_stale(timeout=None):
+    """
+        Treats the jobs of workers that died while running them as failed attempts, returns how many there were
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'SKILLS_JOB_TIMEOUT', 10 * 60)
+    cutoff = timezone.now() - datetime.timedelta(seconds=timeout)
+    stale = list(Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff))
+    for job in stale:
+        fail(job, 'Still running on {} after {} seconds'.format(job.locked_by, timeout))
+    return len(stale)
+
+
+def run_pending(worker=None, batch_size=10):
+    """
+        Runs due jobs until there are none left, returns (succeeded, failed)
+    """
+    worker = worker or worker_name()
+    succeeded = failed = 0
+    while True:
+        batch = claim(worker, batch_size)
+        if not batch:
+            return succeeded, failed
+        for job in batch:
+            if run(job):
+                succeeded += 1
+            else:
+                failed += 1
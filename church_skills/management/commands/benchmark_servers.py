@@ -0,0 +1,140 @@
+# Python imports
+import asyncio
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+# Django imports
+from django.core.management.base import BaseCommand, CommandError
+
+
+SERVERS = {
+    'wsgi': '{python} -m gunicorn djangoProject.wsgi:application --workers 1 --threads {threads} '
+            '--bind 127.0.0.1:{port}',
+    'asgi': '{python} -m uvicorn djangoProject.asgi:application --workers 1 --host 127.0.0.1 --port {port} '
+            '--log-level warning',
+}
+
+DEFAULT_PATHS = [
+    '/search_results?name=a',
+    '/api/Categories/',
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError('The server exited with status {}'.format(process.returncode))
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError('The server did not start listening on port {}'.format(port))
+
+
+async def fetch(port, path, headers, slow_client):
+    """
+        One HTTP/1.1 request on its own connection, returns the status code.  A slow client sends its headers in two
+        halves slow_client seconds apart, the way a visitor on a poor connection would
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        head = 'GET {} HTTP/1.1\r\nHost: 127.0.0.1\r\n'.format(path)
+        rest = ''.join('{}: {}\r\n'.format(name, value) for name, value in headers.items())
+        rest += 'Connection: close\r\n\r\n'
+        writer.write(head.encode())
+        if slow_client:
+            await writer.drain()
+            await asyncio.sleep(slow_client)
+        writer.write(rest.encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1]) if response else 0
+
+
+async def load(port, paths, headers, requests, concurrency, slow_client):
+    latencies = []
+    failures = 0
+    queue = asyncio.Queue()
+    for number in range(requests):
+        queue.put_nowait(paths[number % len(paths)])
+
+    async def client():
+        nonlocal failures
+        while not queue.empty():
+            path = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, path, headers, slow_client)
+            except OSError:
+                status = 0
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return time.perf_counter() - start, latencies, failures
+
+
+class Command(BaseCommand):
+    help = ('Runs the site under a WSGI server (gunicorn, threaded) and an ASGI server (uvicorn), one worker each, '
+            'and compares their throughput with many concurrent clients.  Needs gunicorn and uvicorn installed and '
+            'a populated database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', action='append', choices=sorted(SERVERS),
+                            help='Server to benchmark, can be repeated (default: both)')
+        parser.add_argument('--path', action='append',
+                            help='Path to request, can be repeated (default: a search and the category JSON)')
+        parser.add_argument('--xhr', action='store_true', help='Send X-Requested-With so table views return JSON')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--threads', type=int, default=8, help='Threads for the WSGI worker')
+        parser.add_argument('--slow-client', type=float, default=0.0,
+                            help='Seconds each client pauses halfway through sending its request')
+        parser.add_argument('--warmup', type=int, default=50, help='Requests sent before measuring')
+
+    def handle(self, *args, **options):
+        paths = options['path'] or DEFAULT_PATHS
+        headers = {'X-Requested-With': 'XMLHttpRequest'} if options['xhr'] else {}
+        for path in paths:
+            if urlsplit(path).scheme:
+                raise CommandError('Give paths, not full urls: {}'.format(path))
+
+        for name in options['server'] or ['wsgi', 'asgi']:
+            port = free_port()
+            command = SERVERS[name].format(python=sys.executable, threads=options['threads'], port=port)
+            process = subprocess.Popen(shlex.split(command), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            try:
+                try:
+                    wait_for_port(port, process)
+                except CommandError:
+                    error = process.stderr.read().decode(errors='replace').strip().splitlines()
+                    raise CommandError('Could not start {} ({}): {}'.format(name, command,
+                                                                            error[-1] if error else 'no output'))
+                asyncio.run(load(port, paths, headers, options['warmup'], min(options['concurrency'], 10), 0))
+                seconds, latencies, failures = asyncio.run(load(port, paths, headers, options['requests'],
+                                                                options['concurrency'], options['slow_client']))
+            finally:
+                process.terminate()
+                process.wait()
+
+            latencies.sort()
+            self.stdout.write('{:5} {:8.1f} req/s  p50 {:7.1f} ms  p99 {:7.1f} ms  failed {}'.format(
+                name, len(latencies) / seconds, statistics.median(latencies) * 1000,
+                latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, failures))
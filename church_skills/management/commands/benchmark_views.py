@@ -0,0 +1,67 @@
+# Python imports
+import json
+
+# Django imports
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+# Local imports
+from church_skills import benchmark
+from church_skills.models import Category, Provider, Skill
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the directory views against a synthetic directory in a separate benchmark database and '
+            'writes latency percentiles and query counts as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--providers', type=int, default=50000)
+        parser.add_argument('--skills', type=int, default=500000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=20, help='Measured requests per view')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per view before measuring')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Leave the response cache in place between requests instead of clearing it')
+        parser.add_argument('--only', action='append', help='Only benchmark this view, can be repeated')
+        parser.add_argument('--output', default='benchmark-results.json', help='File the JSON results go to')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the benchmark database afterwards and reuse it when it has the same sizes, '
+                                 'generating 500k skills takes a while')
+        parser.add_argument('--database-file', default='benchmark.sqlite3',
+                            help='SQLite file for the benchmark database (SQLite only)')
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        if connection.vendor == 'sqlite' and not settings_dict['TEST']['NAME']:
+            # The default SQLite test database lives in memory, which can't be kept
+            settings_dict['TEST']['NAME'] = options['database_file']
+        old_name = settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'], serialize=False)
+        try:
+            self.populate(options)
+            results = benchmark.run(iterations=options['iterations'], warmup=options['warmup'],
+                                    warm_cache=options['warm_cache'], only=options['only'], seed=options['seed'],
+                                    progress=self.report)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        results['seed'] = options['seed']
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, indent=2)
+        self.stdout.write(self.style.SUCCESS('Results written to {}'.format(options['output'])))
+
+    def populate(self, options):
+        wanted = (options['categories'], options['providers'], options['skills'])
+        if (Category.objects.count(), Provider.objects.count(), Skill.objects.count()) == wanted:
+            self.stdout.write('Reusing the existing benchmark data')
+            return
+        call_command('flush', interactive=False, verbosity=0)
+        self.stdout.write('Generating {} categories, {} providers and {} skills...'.format(*wanted))
+        benchmark.generate(categories=options['categories'], providers=options['providers'],
+                           skills=options['skills'], seed=options['seed'])
+
+    def report(self, result):
+        self.stdout.write('{name:22} p50 {p50_ms:8.1f} ms  p95 {p95_ms:8.1f} ms  p99 {p99_ms:8.1f} ms  '
+                          'queries {queries_median:g} (max {queries_max})'.format(**result))
@@ -0,0 +1,37 @@
+# Python imports
+import sys
+
+# Django imports
+from django.core.management.base import BaseCommand, CommandError
+
+# Local imports
+from church_skills import export
+
+
+class Command(BaseCommand):
+    help = 'Streams the provider/skill directory out as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv')
+        parser.add_argument('--category', help='Only skills of providers in the category with this slug')
+        parser.add_argument('--since', help='Only rows updated at or after this ISO 8601 date/time')
+        parser.add_argument('--output', help='File to write to (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows read from the database at a time')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = export.parse_since(options['since'])
+            except ValueError as error:
+                raise CommandError(error)
+
+        lines = export.export_lines(options['format'], category=options['category'], updated_since=since,
+                                    chunk_size=options['chunk_size'])
+        output = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in lines:
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
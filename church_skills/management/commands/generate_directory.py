@@ -0,0 +1,27 @@
+# Python imports
+import time
+
+# Django imports
+from django.core.management.base import BaseCommand
+
+# Local imports
+from church_skills import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a reproducible synthetic directory of categories, providers and skills'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--providers', type=int, default=50000)
+        parser.add_argument('--skills', type=int, default=500000)
+        parser.add_argument('--seed', type=int, default=0, help='The same seed always generates the same rows')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        created = benchmark.generate(providers=options['providers'], skills=options['skills'],
+                                     categories=options['categories'], seed=options['seed'],
+                                     progress=self.stdout.write if options['verbosity'] > 1 else None)
+        self.stdout.write(self.style.SUCCESS('Created {categories} categories, {providers} providers and {skills} '
+                                             'skills'.format(**created)
+                                             + ' in {:.1f}s'.format(time.monotonic() - start)))
@@ -0,0 +1,38 @@
+# Django imports
+from django.core.management.base import BaseCommand
+
+# Local imports
+from church_skills import cache, thumbnails
+from church_skills.db import retry_on_locked
+from church_skills.models import Provider
+
+
+class Command(BaseCommand):
+    help = 'Generates the thumbnails of every provider picture that is missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate thumbnails that already exist')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Providers read from the database at a time')
+
+    def handle(self, *args, **options):
+        generate = retry_on_locked(thumbnails.generate)
+        done = failed = 0
+        changed = []
+        providers = Provider.objects.exclude(picture='').exclude(picture__isnull=True).order_by('pk')
+        for provider in providers.iterator(chunk_size=options['chunk_size']):
+            previous = provider.picture_hash
+            try:
+                generate(provider, force=options['force'])
+            except (OSError, SyntaxError, ValueError) as error:
+                # Pillow raises these for missing, truncated and unreadable files
+                failed += 1
+                self.stderr.write('{}: {}'.format(provider.username, error))
+                continue
+            done += 1
+            if provider.picture_hash != previous:
+                changed.append(cache.provider_key(provider.username))
+            if len(changed) >= options['chunk_size']:
+                cache.bump(changed)
+                changed = []
+        cache.bump(changed)
+        self.stdout.write(self.style.SUCCESS('Thumbnails for {} pictures, {} failed'.format(done, failed)))
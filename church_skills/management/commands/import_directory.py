@@ -0,0 +1,43 @@
+# Django imports
+from django.core.management.base import BaseCommand, CommandError
+
+# Local imports
+from church_skills import importer
+
+
+class Command(BaseCommand):
+    help = ('Streams categories, providers or skills from a CSV or JSON-lines file into the directory, upserting on '
+            'category slug, provider username and provider + skill slug.  Import categories first, then providers '
+            '(their "categories" column holds category slugs separated by "|"), then skills (their "provider" column '
+            'holds the provider username)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(importer.IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to csv for .csv files, else jsonl')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per bulk insert and transaction')
+        parser.add_argument('--checkpoint',
+                            help='File recording committed rows, a rerun resumes after the last committed chunk '
+                                 '(default: <path>.checkpoint)')
+        parser.add_argument('--no-checkpoint', action='store_true', help='Always start from the first row')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        checkpoint = None
+        if not options['no_checkpoint']:
+            checkpoint = options['checkpoint'] or options['path'] + '.checkpoint'
+
+        def progress(rows, rate):
+            self.stdout.write('{} rows committed ({:.0f} rows/s)'.format(rows, rate))
+
+        try:
+            result = importer.run(options['kind'], options['path'], file_format=options['format'],
+                                  chunk_size=options['chunk_size'], checkpoint=checkpoint, progress=progress)
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError('Import stopped, rerun to resume from the last committed chunk: {}'.format(error))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} rows in {:.2f}s ({:.0f} rows/s): {} created, {} updated, {} skipped'.format(
+                result.rows, result.seconds, result.rows / max(result.seconds, 1e-6),
+                result.created, result.updated, result.skipped)))
@@ -0,0 +1,22 @@
+# Python imports
+import time
+
+# Django imports
+from django.core.management.base import BaseCommand
+
+# Local imports
+from church_skills import cache, directory
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the directory entries the listing pages read from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=directory.BATCH_SIZE,
+                            help='Number of skills read from the database at a time')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        count = directory.rebuild(chunk_size=options['chunk_size'])
+        cache.bump([cache.directory_key()])
+        self.stdout.write(self.style.SUCCESS('Wrote {} entries in {:.2f}s'.format(count, time.monotonic() - start)))
@@ -0,0 +1,25 @@
+# Python imports
+import time
+
+# Django imports
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+# Local imports
+from church_skills import cache
+from church_skills.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the directory search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of rows read from the database at a time')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        with transaction.atomic():
+            count = get_backend().rebuild(chunk_size=options['chunk_size'])
+        cache.bump([cache.search_key()])
+        self.stdout.write(self.style.SUCCESS('Indexed {} rows in {:.2f}s'.format(count, time.monotonic() - start)))
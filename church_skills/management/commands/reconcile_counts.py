@@ -0,0 +1,22 @@
+# Django imports
+from django.core.management.base import BaseCommand
+
+# Local imports
+from church_skills import counts
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized Category.skill_count and Category.provider_count and repairs any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report categories with wrong counts')
+
+    def handle(self, *args, **options):
+        for category in counts.drifted():
+            self.stdout.write('{}: skills {} -> {}, providers {} -> {}'.format(
+                category, category.skill_count, category.true_skill_count,
+                category.provider_count, category.true_provider_count))
+        if options['dry_run']:
+            return
+        fixed = counts.reconcile()
+        self.stdout.write(self.style.SUCCESS('Repaired {} categories'.format(fixed)))
@@ -0,0 +1,57 @@
+# Python imports
+import sqlite3
+import time
+
+# Django imports
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+# Local imports
+from church_skills import routers
+
+
+class Command(BaseCommand):
+    help = ('Copies the primary SQLite database into the replica file with the SQLite backup API, once or every '
+            '--interval seconds')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help='Alias of the replica, SKILLS_REPLICA_ALIAS by default')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running and copy again this many seconds after the primary last changed')
+
+    def handle(self, *args, **options):
+        alias = options['database'] or routers.replica_alias()
+        if alias is None or alias not in settings.DATABASES:
+            raise CommandError('No replica database configured, see SKILLS_REPLICA_ALIAS in settings.py')
+        if alias == DEFAULT_DB_ALIAS:
+            raise CommandError('The replica must be a different database from the primary')
+        primary, replica = settings.DATABASES[DEFAULT_DB_ALIAS], settings.DATABASES[alias]
+        if not (primary['ENGINE'].endswith('sqlite3') and replica['ENGINE'].endswith('sqlite3')):
+            raise CommandError("Only SQLite databases can be copied, use the database's own replication")
+
+        source = sqlite3.connect(str(primary['NAME']), timeout=20)
+        copied = None
+        try:
+            while True:
+                # Changes whenever another connection commits to the primary, an unchanged primary isn't copied again
+                version = source.execute('PRAGMA data_version').fetchone()[0]
+                if version != copied:
+                    start = time.perf_counter()
+                    target = sqlite3.connect(str(replica['NAME']), timeout=20)
+                    try:
+                        # A consistent snapshot of the primary, readers of the replica wait for the copy to finish
+                        # and then see all of it
+                        source.backup(target)
+                    finally:
+                        target.close()
+                    copied = version
+                    self.stdout.write('Copied {} to {} in {:.2f}s'.format(primary['NAME'], replica['NAME'],
+                                                                          time.perf_counter() - start))
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            source.close()
@@ -0,0 +1,42 @@
+# Python imports
+import time
+
+# Django imports
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+# Local imports
+from church_skills import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued background jobs, several workers can run side by side'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Run the jobs that are due and exit')
+        parser.add_argument('--batch-size', type=int, default=10, help='Jobs claimed at a time')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before looking again when there is nothing to do')
+
+    def handle(self, *args, **options):
+        worker = jobs.worker_name()
+        succeeded = failed = 0
+        try:
+            while True:
+                # A long running process has to drop connections the database has closed itself
+                close_old_connections()
+                released = jobs.release_stale()
+                if released:
+                    self.stderr.write('Released {} jobs of workers that stopped responding'.format(released))
+                done, errors = jobs.run_pending(worker, options['batch_size'])
+                succeeded += done
+                failed += errors
+                if options['burst']:
+                    break
+                if not done and not errors:
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            close_old_connections()
+        self.stdout.write(self.style.SUCCESS('Ran {} jobs, {} failed'.format(succeeded + failed, failed)))
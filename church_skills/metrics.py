@@ -0,0 +1,288 @@
+"""
+    Request metrics in the Prometheus text format, aggregated over every worker process.
+
+    Each process keeps its counters in its own memory-mapped file in SKILLS_METRICS_DIR and is the only writer of that
+    file, so recording a request is a few float additions into shared memory under a process-local lock, with no file
+    locking and nothing shared between processes.  The /metrics view reads every process's file and adds them up.
+    Files of processes that have exited are still counted, which keeps counters from going backwards when a worker is
+    recycled, empty the directory when the site is deployed (clear()).  The paths, rates and process details are only
+    shown to staff and to the scrapers can_scrape() lets in.
+
+    MetricsMiddleware records a latency histogram and the response status per url name, the SQL queries measured by
+    ProfilingMiddleware and whether the response cache answered, so it has to come after ProfilingMiddleware
+"""
+# Python imports
+import glob
+import hmac
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+# Django imports
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Local imports
+from . import profiling
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+METRICS = {
+    'skills_request_duration_seconds': ('histogram', 'Time taken to respond, by url name'),
+    'skills_responses_total': ('counter', 'Responses sent, by url name and status class'),
+    'skills_request_exceptions_total': ('counter', 'Unhandled exceptions raised by views, by url name'),
+    'skills_db_queries_total': ('counter', 'SQL queries run while responding, by url name'),
+    'skills_db_query_seconds_total': ('counter', 'Time spent in SQL queries, by url name'),
+    'skills_response_cache_total': ('counter', 'Response cache lookups, by url name and result'),
+    'skills_search_cache_total': ('counter', 'Search result cache lookups, by result (hit, miss or coalesced)'),
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metrics_dir():
+    return str(getattr(settings, 'SKILLS_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'skills_metrics')))
+
+
+class MmapStore:
+    """
+        Float values keyed by string in a memory-mapped file.  The file starts with the number of bytes in use,
+        followed by entries of (key length, key padded to 8 bytes, value).  A new entry is written before the used
+        size is moved past it, so a reader never sees half an entry
+    """
+    initial_size = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < self.initial_size:
+            self.file.truncate(self.initial_size)
+            size = self.initial_size
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.used = struct.unpack_from('q', self.map, 0)[0] or 8
+        self.positions = {key: position for key, position, value in read_entries(self.map, self.used)}
+
+    def add(self, key, amount):
+        position = self.positions.get(key)
+        if position is None:
+            position = self.append(key)
+        value = struct.unpack_from('d', self.map, position)[0]
+        struct.pack_into('d', self.map, position, value + amount)
+
+    def append(self, key):
+        encoded = key.encode()
+        padded = len(encoded) + (-len(encoded) % 8)
+        size = 8 + padded + 8
+        while self.used + size > len(self.map):
+            self.map.close()
+            self.file.truncate(os.fstat(self.file.fileno()).st_size * 2)
+            self.map = mmap.mmap(self.file.fileno(), os.fstat(self.file.fileno()).st_size)
+        struct.pack_into('q{}sd'.format(padded), self.map, self.used, len(encoded), encoded, 0.0)
+        position = self.used + 8 + padded
+        self.used += size
+        struct.pack_into('q', self.map, 0, self.used)
+        self.positions[key] = position
+        return position
+
+
+def read_entries(buffer, used):
+    offset = 8
+    while offset < used:
+        length = struct.unpack_from('q', buffer, offset)[0]
+        padded = length + (-length % 8)
+        key = bytes(buffer[offset + 8:offset + 8 + length]).decode()
+        position = offset + 8 + padded
+        yield key, position, struct.unpack_from('d', buffer, position)[0]
+        offset = position + 8
+
+
+def read_file(path):
+    with open(path, 'rb') as data_file:
+        content = data_file.read()
+    if len(content) < 8:
+        return
+    used = struct.unpack_from('q', content, 0)[0]
+    for key, position, value in read_entries(content, min(used, len(content))):
+        yield key, value
+
+
+_store = None
+_store_pid = None
+_lock = threading.Lock()
+
+
+def sample_key(name, **labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def record(samples):
+    """
+        Adds each (key, amount) of samples to this process's file
+    """
+    global _store, _store_pid
+    with _lock:
+        if _store_pid != os.getpid():
+            # First use, or this is a forked child that must not write into its parent's file
+            directory = metrics_dir()
+            os.makedirs(directory, exist_ok=True)
+            _store = MmapStore(os.path.join(directory, 'metrics-{}.db'.format(os.getpid())))
+            _store_pid = os.getpid()
+        for key, amount in samples:
+            _store.add(key, amount)
+
+
+def collect():
+    """
+        The sum over every process's file, as {key: value}
+    """
+    totals = {}
+    for path in glob.glob(os.path.join(metrics_dir(), 'metrics-*.db')):
+        for key, value in read_file(path):
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def clear():
+    global _store_pid
+    with _lock:
+        for path in glob.glob(os.path.join(metrics_dir(), 'metrics-*.db')):
+            os.remove(path)
+        _store_pid = None
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for name, value in labels]
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in escaped) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def exposition(totals):
+    """
+        Renders the collected totals in the Prometheus text format.  Histogram buckets are stored as plain counts and
+        made cumulative here, which keeps recording to a single addition per request
+    """
+    samples = {}
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        samples.setdefault(name, []).append((tuple(tuple(label) for label in labels), value))
+
+    lines = []
+    for metric, (kind, description) in METRICS.items():
+        lines += ['# HELP {} {}'.format(metric, description), '# TYPE {} {}'.format(metric, kind)]
+        if kind != 'histogram':
+            for labels, value in sorted(samples.get(metric, [])):
+                lines.append('{}{} {}'.format(metric, format_labels(labels), format_value(value)))
+            continue
+
+        buckets = {}
+        for labels, value in samples.get(metric + '_bucket', []):
+            labels = dict(labels)
+            bound = float(labels.pop('le'))
+            buckets.setdefault(tuple(sorted(labels.items())), {})[bound] = value
+        sums = dict(samples.get(metric + '_sum', []))
+        for labels in sorted(buckets):
+            running = 0
+            for bound in BUCKETS:
+                running += buckets[labels].get(bound, 0)
+                lines.append('{}_bucket{} {}'.format(metric, format_labels(labels + (('le', format_value(bound)),)),
+                                                     format_value(running)))
+            lines.append('{}_sum{} {}'.format(metric, format_labels(labels), format_value(sums.get(labels, 0))))
+            lines.append('{}_count{} {}'.format(metric, format_labels(labels), format_value(running)))
+
+    cache_lookups = {}
+    for labels, value in samples.get('skills_response_cache_total', []):
+        labels = dict(labels)
+        cache_lookups.setdefault(labels['view'], {})[labels['result']] = value
+    lines += ['# HELP skills_response_cache_hit_ratio Fraction of response cache lookups answered from the cache',
+              '# TYPE skills_response_cache_hit_ratio gauge']
+    for view, results in sorted(cache_lookups.items()):
+        lookups = sum(results.values())
+        lines.append('skills_response_cache_hit_ratio{} {}'.format(
+            format_labels([('view', view)]), format_value(results.get('hit', 0) / lookups if lookups else 0)))
+    return '\n'.join(lines) + '\n'
+
+
+def can_scrape(request):
+    """
+        Whether request may read /metrics: staff users, clients from SKILLS_METRICS_ALLOWED_IPS and scrapers sending
+        "Authorization: Bearer <SKILLS_METRICS_TOKEN>"
+    """
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'SKILLS_METRICS_ALLOWED_IPS', []):
+        return True
+    token = getattr(settings, 'SKILLS_METRICS_TOKEN', None)
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    # Unmatched urls all share one label, a label per path would let anybody add series
+    return match.view_name if match is not None else 'unmatched'
+
+
+def bucket_for(seconds):
+    for bound in BUCKETS:
+        if seconds <= bound:
+            return bound
+
+
+class MetricsMiddleware:
+    """
+        Records every request, goes after ProfilingMiddleware whose query counts it reports
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def finish(self, request, response, start):
+        seconds = time.perf_counter() - start
+        view = view_name(request)
+        histogram = 'skills_request_duration_seconds'
+        samples = [
+            (sample_key(histogram + '_bucket', view=view, le=format_value(bucket_for(seconds))), 1),
+            (sample_key(histogram + '_sum', view=view), seconds),
+            (sample_key('skills_responses_total', view=view, status='{}xx'.format(response.status_code // 100)), 1),
+        ]
+        timing = profiling.current.get()
+        if timing is not None:
+            samples += [(sample_key('skills_db_queries_total', view=view), timing.queries),
+                        (sample_key('skills_db_query_seconds_total', view=view), timing.query_time)]
+        if response.has_header('X-Cache'):
+            samples.append((sample_key('skills_response_cache_total', view=view,
+                                       result=response['X-Cache'].lower()), 1))
+        record(samples)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        return self.finish(request, self.get_response(request), start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        return self.finish(request, await self.get_response(request), start)
+
+    def process_exception(self, request, exception):
+        record([(sample_key('skills_request_exceptions_total', view=view_name(request)), 1)])
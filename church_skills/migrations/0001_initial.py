@@ -0,0 +1,70 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:43
+
+from django.conf import settings
+import django.contrib.auth.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_added', models.DateTimeField(blank=True, null=True)),
+                ('last_updated', models.DateTimeField(blank=True, null=True)),
+                ('name', models.CharField(blank=True, default=None, help_text='Major category like plumbing, construction, etc...', max_length=100, null=True)),
+                ('slug', models.CharField(default='', max_length=150)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Provider',
+            fields=[
+                ('user_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('date_added', models.DateTimeField(blank=True, null=True)),
+                ('last_updated', models.DateTimeField(blank=True, null=True)),
+                ('company_name', models.CharField(blank=True, default=None, help_text='Company name that you associate with', max_length=150, null=True)),
+                ('phone_number', models.CharField(blank=True, default=None, help_text='10 digit phone number you would like displayed', max_length=30, null=True)),
+                ('email_address', models.EmailField(blank=True, default=None, help_text='Valid e-mail address should you choose to add one', max_length=254, null=True)),
+                ('picture', models.ImageField(blank=True, default=None, null=True, upload_to='')),
+                ('about_me', models.TextField(blank=True, default='', help_text='Extra info you wish to display about yourself', null=True)),
+                ('website', models.URLField(blank=True, default=None, help_text='A link to your website, if you have one, for more info', null=True)),
+                ('slug', models.CharField(default='', max_length=150)),
+                ('categories', models.ManyToManyField(blank=True, to='church_skills.category')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=('auth.user', models.Model),
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Skill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_added', models.DateTimeField(blank=True, null=True)),
+                ('last_updated', models.DateTimeField(blank=True, null=True)),
+                ('name', models.CharField(max_length=100)),
+                ('description', models.TextField(blank=True, default='', help_text='Please enter detailed description of this skill or service', null=True)),
+                ('cost_range', models.CharField(blank=True, default=None, help_text='Enter info like $20-$30/hour or Cost varies', max_length=100, null=True)),
+                ('slug', models.CharField(default='', max_length=150)),
+                ('provider', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='church_skills.provider')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+# The FTS5 table as SQLiteFTSBackend (church_skills/search.py) expected it when this migration was written, inlined
+# so that later changes to the backend don't change what this migration does
+CREATE_SEARCH_INDEX = ("CREATE VIRTUAL TABLE IF NOT EXISTS church_skills_search_index USING fts5("
+                       "kind UNINDEXED, title, body, tokenize='porter unicode61 remove_diacritics 2')")
+DROP_SEARCH_INDEX = 'DROP TABLE IF EXISTS church_skills_search_index'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(CREATE_SEARCH_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_skills', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:45
+
+import church_skills.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_skills', '0002_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(church_skills.models.EmptyIfNull('name'), models.F('id'), name='category_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='skill',
+            index=models.Index(fields=['name', 'id'], name='skill_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='skill',
+            index=models.Index(church_skills.models.EmptyIfNull('cost_range'), models.F('id'), name='skill_cost_range_id_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+def populate_counts(apps, schema_editor):
+    Category = apps.get_model('church_skills', 'Category')
+    Skill = apps.get_model('church_skills', 'Skill')
+    Through = apps.get_model('church_skills', 'Provider').categories.through
+    for category in Category.objects.all().iterator():
+        category.provider_count = Through.objects.filter(category_id=category.pk).count()
+        category.skill_count = Skill.objects.filter(provider__categories=category.pk).count()
+        category.save(update_fields=['provider_count', 'skill_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_skills', '0003_table_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='provider_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='skill_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['skill_count', 'id'], name='category_skill_count_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['provider_count', 'id'], name='category_provider_count_id_idx'),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
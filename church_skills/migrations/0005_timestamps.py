@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:48
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_timestamps(apps, schema_editor):
+    now = timezone.now()
+    for name in ['Category', 'Provider', 'Skill']:
+        model = apps.get_model('church_skills', name)
+        model.objects.filter(date_added__isnull=True).update(date_added=now)
+        model.objects.filter(last_updated__isnull=True).update(last_updated=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_skills', '0004_category_counts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='date_added',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='provider',
+            name='date_added',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='provider',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='skill',
+            name='date_added',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='skill',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_timestamps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_skills', '0005_timestamps'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.CharField(db_index=True, default='', max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name='skill',
+            index=models.Index(fields=['provider', 'slug'], name='skill_provider_slug_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_skills', '0006_natural_key_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provider',
+            name='picture_hash',
+            field=models.CharField(blank=True, db_index=True, default=None, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:15
+
+from urllib.parse import quote
+
+from django.db import migrations, models
+from django.urls import reverse
+from django.utils.http import RFC3986_SUBDELIMS
+import django.db.models.deletion
+
+
+# A copy of church_skills.directory.populate() as it was when this migration was written, so that later changes to
+# the directory don't change what this migration does
+BATCH_SIZE = 2000
+PLACEHOLDER = 'url-placeholder'
+
+
+def url_builder(viewname):
+    pattern = reverse(viewname, args=[PLACEHOLDER])
+    return lambda value: pattern.replace(PLACEHOLDER, quote(str(value), safe=RFC3986_SUBDELIMS + '/~:@'))
+
+
+def populate_directory(apps, schema_editor):
+    DirectoryEntry = apps.get_model('church_skills', 'DirectoryEntry')
+    Skill = apps.get_model('church_skills', 'Skill')
+    through = apps.get_model('church_skills', 'Provider').categories.through
+    profile_url = url_builder('church_skills:profile_detail')
+    category_url = url_builder('church_skills:category_detail')
+
+    rows = Skill.objects.filter(provider__isnull=False).order_by('pk').values_list(
+        'pk', 'name', 'description', 'cost_range', 'provider_id', 'provider__username', 'provider__company_name',
+        'provider__first_name', 'provider__last_name')
+    last = None
+    while True:
+        chunk = list((rows if last is None else rows.filter(pk__gt=last))[:BATCH_SIZE])
+        if not chunk:
+            return
+        links = {}
+        for provider_id, category_id, name, slug in through.objects.filter(
+                provider_id__in={row[4] for row in chunk}).order_by('provider_id', 'category_id')\
+                .values_list('provider_id', 'category_id', 'category__name', 'category__slug'):
+            links.setdefault(provider_id, []).append((category_id, name, slug))
+        entries = []
+        for pk, name, description, cost_range, provider_id, username, company_name, first_name, last_name in chunk:
+            shared = {
+                'skill_id': pk,
+                'provider_id': provider_id,
+                'skill_name': name,
+                'skill_description': description or '',
+                'cost_range': cost_range,
+                'cost_sort': cost_range or '',
+                'provider_username': username,
+                'provider_name': company_name or '{} {}'.format(first_name, last_name).strip() or username,
+                'provider_url': profile_url(username),
+            }
+            for number, (category_id, category_name, slug) in enumerate(links.get(provider_id, [(None, None, None)])):
+                entries.append(DirectoryEntry(category_id=category_id, category_name=category_name,
+                                              is_primary=number == 0,
+                                              category_url=category_url(slug) if category_id is not None else '',
+                                              **shared))
+        DirectoryEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+        last = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_skills', '0007_provider_picture_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_primary', models.BooleanField(default=False)),
+                ('skill_name', models.CharField(max_length=100)),
+                ('skill_description', models.TextField(blank=True, default='')),
+                ('cost_range', models.CharField(blank=True, default=None, max_length=100, null=True)),
+                ('cost_sort', models.CharField(blank=True, default='', max_length=100)),
+                ('provider_username', models.CharField(max_length=150)),
+                ('provider_name', models.CharField(max_length=300)),
+                ('provider_url', models.CharField(max_length=300)),
+                ('category_name', models.CharField(blank=True, default=None, max_length=100, null=True)),
+                ('category_url', models.CharField(blank=True, default='', max_length=300)),
+                ('category', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='church_skills.category')),
+                ('provider', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='church_skills.provider')),
+                ('skill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='directory_entries', to='church_skills.skill')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'skill_name', 'id'], name='entry_category_name_idx'), models.Index(fields=['category', 'cost_sort', 'id'], name='entry_category_cost_idx'), models.Index(fields=['provider', 'is_primary', 'skill_name'], name='entry_provider_idx')],
+            },
+        ),
+        migrations.RunPython(populate_directory, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_skills', '0009_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('size', models.PositiveSmallIntegerField()),
+                ('word', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='church_skills.searchword')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchName',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField()),
+                ('object_id', models.BigIntegerField()),
+                ('word', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='church_skills.searchword')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchtrigram',
+            constraint=models.UniqueConstraint(fields=('trigram', 'word', 'size'), name='trigram_word_size_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='searchname',
+            index=models.Index(fields=['word', 'kind', 'object_id'], name='search_name_word_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchname',
+            index=models.Index(fields=['kind', 'object_id'], name='search_name_object_idx'),
+        ),
+    ]
@@ -1,13 +1,25 @@
 from django.db import models
+from django.db.models import Func
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 
+class EmptyIfNull(Func):
+    """
+        COALESCE(field, '') with the empty string written into the SQL instead of passed as a parameter, the database
+        can only match a query against an expression index when the two expressions are identical
+    """
+    function = 'COALESCE'
+    template = "%(function)s(%(expressions)s, '')"
+    output_field = models.CharField()
+
+
 # Create your models here.
 class BaseModel(models.Model):
-    id = models.AutoField(primary_key=True)
-    date_added = models.DateTimeField(null=True, blank=True)
-    last_updated = models.DateTimeField(null=True, blank=True)
+    # Indexed because the conditional GET validators in conditional.py take the max of last_updated
+    date_added = models.DateTimeField(auto_now_add=True, null=True, blank=True, db_index=True)
+    last_updated = models.DateTimeField(auto_now=True, null=True, blank=True, db_index=True)
 
     class Meta:
         abstract = True
@@ -15,11 +27,30 @@ class BaseModel(models.Model):
 
 class Category(BaseModel):
     name = models.CharField(max_length=100, default=None, null=True, blank=True, help_text="Major category like plumbing, construction, etc...")
-    slug = models.CharField(max_length=150, default="")
+    slug = models.CharField(max_length=150, default="", db_index=True)
+    # Denormalized, kept up to date by the handlers in signals.py (see counts.py)
+    skill_count = models.PositiveIntegerField(default=0)
+    provider_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Sort keys for the keyset paginated tables, see pagination.py
+            models.Index(EmptyIfNull('name'), 'id', name='category_name_id_idx'),
+            models.Index(fields=['skill_count', 'id'], name='category_skill_count_id_idx'),
+            models.Index(fields=['provider_count', 'id'], name='category_provider_count_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # The counts are only ever moved by counts.py, an instance loaded before they last moved (an admin form, say)
+        # would otherwise write its stale copies back
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in ('skill_count', 'provider_count')]
+        super(Category, self).save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('church_skills:category_detail', args=[str(self.slug)])
 
@@ -33,20 +64,22 @@ class Provider(BaseModel, User):
     phone_number = models.CharField(max_length=30, default=None, null=True, blank=True, help_text="10 digit phone number you would like displayed")
     email_address = models.EmailField(default=None, null=True, blank=True, help_text="Valid e-mail address should you choose to add one")
     picture = models.ImageField(default=None, null=True, blank=True)
+    # Hash of the picture file, names its thumbnails, see thumbnails.py
+    picture_hash = models.CharField(max_length=64, default=None, null=True, blank=True, editable=False, db_index=True)
     about_me = models.TextField(default="", null=True, blank=True, help_text="Extra info you wish to display about yourself")
     website = models.URLField(default=None, null=True, blank=True, help_text="A link to your website, if you have one, for more info")
     categories = models.ManyToManyField(Category, blank=True)
     slug = models.CharField(max_length=150, default="")
 
     def __str__(self):
-        return self.company_name
+        return self.company_name or self.get_full_name() or self.username
 
     def get_absolute_url(self):
-        return reverse('church_skills:category_detail', args=[str(self.slug)])
+        return reverse('church_skills:profile_detail', args=[str(self.username)])
 
     @staticmethod
-    def create_url(slug):
-        return reverse('church_skills:category_detail', args=[str(slug)])
+    def create_url(username):
+        return reverse('church_skills:profile_detail', args=[str(username)])
 
 
 class Skill(BaseModel):
@@ -56,12 +89,141 @@ class Skill(BaseModel):
     provider = models.ForeignKey(Provider, on_delete=models.CASCADE, null=True, blank=True)
     slug = models.CharField(max_length=150, default="")
 
+    class Meta:
+        indexes = [
+            # Sort keys for the keyset paginated tables, see pagination.py
+            models.Index(fields=['name', 'id'], name='skill_name_id_idx'),
+            models.Index(EmptyIfNull('cost_range'), 'id', name='skill_cost_range_id_idx'),
+            # Natural key used by the bulk importer
+            models.Index(fields=['provider', 'slug'], name='skill_provider_slug_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
     def get_absolute_url(self):
-        return reverse('church_skills:category_detail', args=[str(self.slug)])
+        # Skills are listed on their provider's profile page rather than a page of their own
+        if self.provider_id is None:
+            return ''
+        return reverse('church_skills:profile_detail', args=[str(self.provider.username)])
 
     @staticmethod
-    def create_url(slug):
-        return reverse('church_skills:category_detail', args=[str(slug)])
+    def create_url(username):
+        return reverse('church_skills:profile_detail', args=[str(username)])
+
+
+class DirectoryEntry(models.Model):
+    """
+        One row per skill and category of its provider (a single row with no category for providers without any),
+        with everything the listing pages show copied in so they read one table without joins.  Derived from Skill,
+        Provider and Category and kept up to date by the handlers in signals.py, see directory.py
+    """
+    skill = models.ForeignKey(Skill, on_delete=models.CASCADE, related_name='directory_entries')
+    # Not indexed on their own, the indexes below start with them
+    provider = models.ForeignKey(Provider, on_delete=models.CASCADE, related_name='+', db_index=False)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, related_name='+', db_index=False)
+    # Set on exactly one of a skill's rows, for listings that show each skill once
+    is_primary = models.BooleanField(default=False)
+
+    skill_name = models.CharField(max_length=100)
+    skill_description = models.TextField(default="", blank=True)
+    cost_range = models.CharField(max_length=100, default=None, null=True, blank=True)
+    # cost_range with '' for NULL, the sort key of the cost column
+    cost_sort = models.CharField(max_length=100, default="", blank=True)
+    provider_username = models.CharField(max_length=150)
+    # str(provider)
+    provider_name = models.CharField(max_length=300)
+    provider_url = models.CharField(max_length=300)
+    category_name = models.CharField(max_length=100, default=None, null=True, blank=True)
+    category_url = models.CharField(max_length=300, default="", blank=True)
+
+    class Meta:
+        indexes = [
+            # Category tables, one per sort key, see pagination.py
+            models.Index(fields=['category', 'skill_name', 'id'], name='entry_category_name_idx'),
+            models.Index(fields=['category', 'cost_sort', 'id'], name='entry_category_cost_idx'),
+            # Profile pages
+            models.Index(fields=['provider', 'is_primary', 'skill_name'], name='entry_provider_idx'),
+        ]
+
+    def __str__(self):
+        return self.skill_name
+
+
+class Job(models.Model):
+    """
+        A unit of background work waiting for the run_jobs worker, see jobs.py
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    # Dotted path of the function that does the work, called with arguments as keyword arguments
+    task = models.CharField(max_length=200)
+    arguments = models.JSONField(default=dict, blank=True)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    # At most one queued job per key, enqueueing it again while it waits does nothing
+    dedupe_key = models.CharField(max_length=200, default=None, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, default="", blank=True)
+    locked_at = models.DateTimeField(default=None, null=True, blank=True)
+    last_error = models.TextField(default="", blank=True)
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The workers' claim query, see jobs.claim
+            models.Index(fields=['status', '-priority', 'run_at', 'id'], name='job_claim_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['dedupe_key'], condition=models.Q(status='queued'),
+                                    name='job_queued_dedupe_key'),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.task, self.arguments)
+
+
+class SearchWord(models.Model):
+    """
+        A distinct lower case word of the searchable names, broken into SearchTrigram rows, see fuzzy.py
+    """
+    word = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.word
+
+
+class SearchTrigram(models.Model):
+    trigram = models.CharField(max_length=3)
+    word = models.ForeignKey(SearchWord, on_delete=models.CASCADE, related_name='+', db_index=False)
+    # Number of trigrams in the word, for the similarity
+    size = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            # size follows from the word so this is unique per (trigram, word), with size in it the index covers the
+            # whole similarity lookup
+            models.UniqueConstraint(fields=['trigram', 'word', 'size'], name='trigram_word_size_unique'),
+        ]
+
+
+class SearchName(models.Model):
+    """
+        One row per word of the name of a searchable category, provider or skill
+    """
+    word = models.ForeignKey(SearchWord, on_delete=models.CASCADE, related_name='+', db_index=False)
+    # search.KINDS
+    kind = models.PositiveSmallIntegerField()
+    object_id = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['word', 'kind', 'object_id'], name='search_name_word_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_name_object_idx'),
+        ]
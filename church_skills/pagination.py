@@ -0,0 +1,80 @@
+# Python imports
+import base64
+import binascii
+import json
+
+# Django imports
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk):
+    payload = json.dumps([value, pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+    # Only what encode_cursor() writes for the (non-null) sort keys gets through, a null would reach the ORM as
+    # sort_key__gte=None and a list or dict would quietly match nothing.  bool is an int too
+    if not isinstance(pk, int) or isinstance(pk, bool):
+        raise InvalidCursor(token)
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        raise InvalidCursor(token)
+    return value, pk
+
+
+class KeysetPaginator:
+    """
+        Cursor (keyset) pagination over (sort_key, id).  Instead of an OFFSET the next page starts right after the last
+        row of the previous one, so the database seeks straight to it through the (sort_key, id) index
+    """
+    def __init__(self, queryset, sort_expression, ascending=True, page_size=50):
+        # sort_expression should match an index together with id, that is what keeps deep pages as cheap as the first
+        self.queryset = queryset.annotate(sort_key=sort_expression)
+        self.ascending = ascending
+        self.page_size = page_size
+
+    def page_queryset(self, cursor=None):
+        """
+            The queryset for the page after cursor, with one extra row to tell whether another page follows
+        """
+        queryset = self.queryset
+        if cursor:
+            value, pk = decode_cursor(cursor)
+            if self.ascending:
+                # The redundant >= gives the database a lower bound to start its index range scan from
+                queryset = queryset.filter(Q(sort_key__gte=value), Q(sort_key__gt=value) | Q(sort_key=value, pk__gt=pk))
+            else:
+                queryset = queryset.filter(Q(sort_key__lte=value), Q(sort_key__lt=value) | Q(sort_key=value, pk__lt=pk))
+        if self.ascending:
+            queryset = queryset.order_by('sort_key', 'pk')
+        else:
+            queryset = queryset.order_by('-sort_key', '-pk')
+        return queryset[:self.page_size + 1]
+
+    def split(self, rows):
+        next_cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            next_cursor = encode_cursor(rows[-1].sort_key, rows[-1].pk)
+        return rows, next_cursor
+
+    def page(self, cursor=None):
+        """
+            Returns (rows, next_cursor), next_cursor is None on the last page
+        """
+        return self.split(list(self.page_queryset(cursor)))
+
+    async def apage(self, cursor=None):
+        """
+            page() for async views
+        """
+        return self.split([row async for row in self.page_queryset(cursor).aiterator()])
@@ -0,0 +1,86 @@
+"""
+    Loads everything a profile shows in a fixed number of queries, whatever the number of skills and categories.
+
+    A provider is read in one query with its User row (the two tables are joined by the model inheritance, and
+    select_related('user_ptr') hands the parent row back as the User the templates compare against request.user), and
+    its skills and categories are each prefetched in one more query.  Users that aren't providers take two queries,
+    the provider lookup that finds nothing and then the user's own.  The profile page and the JSON profile endpoint
+    are both built from load() (aload() in async views)
+"""
+# Python imports
+from collections import namedtuple
+
+# Django imports
+from django.contrib.auth import get_user_model as users
+from django.db.models import Prefetch
+
+# Local imports
+from .dataset import url_builder
+from .models import Category, Provider, Skill
+
+
+Profile = namedtuple('Profile', ['user', 'provider', 'skills', 'categories'])
+ProfileSkill = namedtuple('ProfileSkill', ['name', 'slug', 'description', 'cost_range', 'categories'])
+ProfileCategory = namedtuple('ProfileCategory', ['name', 'slug', 'url'])
+
+
+def providers():
+    return Provider.objects.select_related('user_ptr').prefetch_related(
+        Prefetch('skill_set', queryset=Skill.objects.order_by('name', 'pk'), to_attr='profile_skills'),
+        Prefetch('categories', queryset=Category.objects.order_by('name', 'pk'), to_attr='profile_categories'),
+    )
+
+
+def assemble(provider):
+    category_url = url_builder('church_skills:category_detail')
+    categories = [ProfileCategory(category.name, category.slug, category_url(category.slug))
+                  for category in provider.profile_categories]
+    # A skill is listed under every category of its provider, see directory.py
+    skills = [ProfileSkill(skill.name, skill.slug, skill.description, skill.cost_range, categories)
+              for skill in provider.profile_skills]
+    return Profile(provider.user_ptr, provider, skills, categories)
+
+
+def load(username):
+    """
+        The Profile of username, None when there is no such user
+    """
+    provider = providers().filter(username=username).first()
+    if provider is None:
+        user = users().objects.filter(username=username).first()
+        return Profile(user, None, [], []) if user is not None else None
+    return assemble(provider)
+
+
+async def aload(username):
+    """
+        load() for async views, the same queries through the async ORM
+    """
+    provider = await providers().filter(username=username).afirst()
+    if provider is None:
+        user = await users().objects.filter(username=username).afirst()
+        return Profile(user, None, [], []) if user is not None else None
+    return assemble(provider)
+
+
+def as_json(profile, viewer=None):
+    data = {
+        'username': profile.user.username,
+        'name': profile.user.get_full_name(),
+        'is_self': viewer is not None and viewer.pk == profile.user.pk,
+        'provider': None,
+        'skill_count': len(profile.skills),
+        'skills': [{'name': skill.name, 'slug': skill.slug, 'description': skill.description,
+                    'cost_range': skill.cost_range} for skill in profile.skills],
+    }
+    provider = profile.provider
+    if provider is not None:
+        data['provider'] = {
+            'company_name': provider.company_name,
+            'phone_number': provider.phone_number,
+            'email_address': provider.email_address,
+            'website': provider.website,
+            'about_me': provider.about_me,
+            'categories': [{'name': category.name, 'slug': category.slug} for category in profile.categories],
+        }
+    return data
@@ -0,0 +1,193 @@
+"""
+    Per-request timing and slow request capture.
+
+    ProfilingMiddleware adds a Server-Timing header with the number of SQL queries and the time spent in them, the time
+    spent rendering templates and the total, so the browser's network panel shows where a slow page spent its time.  The
+    timings say too much about the site to hand to everybody, the header is only sent to staff users, or to everybody
+    when SKILLS_SERVER_TIMING is on (by default it follows DEBUG).  Queries are counted by an execute wrapper installed
+    on every database connection and templates are timed by the TimedDjangoTemplates backend, both only do work while a
+    request is being timed.
+
+    A random sample of requests (SKILLS_PROFILE_SAMPLE_RATE) is also run under cProfile with every query recorded.
+    When one of those takes longer than SKILLS_PROFILE_THRESHOLD milliseconds the profile and the query list are
+    written to SKILLS_PROFILE_DIR, the .prof files open with pstats or snakeviz.  Requests that aren't sampled only
+    pay for the counters.  Under ASGI cProfile only sees the event loop thread, work done in sync_to_async threads
+    shows up in the query list and timings but not in the profile
+"""
+# Python imports
+import contextvars
+import cProfile
+import json
+import os
+import random
+import re
+import time
+
+# Django imports
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+
+
+# The timing of the request being handled, None outside of ProfilingMiddleware.  A context variable rather than a
+# thread local so that async views and the sync_to_async threads they use see the same one
+current = contextvars.ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    def __init__(self, capture=False):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        # Only sampled requests keep the SQL itself
+        self.query_log = [] if capture else None
+
+    def server_timing(self, total):
+        return ', '.join([
+            'db;dur={:.1f};desc="{} queries"'.format(self.query_time * 1000, self.queries),
+            'tpl;dur={:.1f}'.format(self.template_time * 1000),
+            'app;dur={:.1f}'.format(max(total - self.query_time - self.template_time, 0) * 1000),
+            'total;dur={:.1f}'.format(total * 1000),
+        ])
+
+
+def record_query(execute, sql, params, many, context):
+    timing = current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        timing.queries += 1
+        timing.query_time += elapsed
+        if timing.query_log is not None:
+            timing.query_log.append({'sql': sql, 'params': repr(params), 'many': many, 'ms': elapsed * 1000})
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # connection_created fires again on every reconnect of the same wrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timing = current.get()
+        if timing is None:
+            return super(TimedTemplate, self).render(context, request)
+        start = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(context, request)
+        finally:
+            timing.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+        The Django template backend with render time recorded for ProfilingMiddleware
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def dump_name(request, total):
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match is not None else request.path
+    return '{}-{}-{:.0f}ms'.format(time.strftime('%Y%m%d-%H%M%S'), re.sub(r'[^\w.-]+', '_', name).strip('_'),
+                                   total * 1000)
+
+
+def write_dump(request, response, timing, profiler, total):
+    directory = getattr(settings, 'SKILLS_PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+    os.makedirs(directory, exist_ok=True)
+    name = dump_name(request, total)
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(directory, name + '.prof'))
+    with open(os.path.join(directory, name + '.sql.json'), 'w') as output:
+        json.dump({
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'total_ms': total * 1000,
+            'query_ms': timing.query_time * 1000,
+            'template_ms': timing.template_time * 1000,
+            'queries': timing.query_log,
+        }, output, indent=2)
+
+
+class ProfilingMiddleware:
+    """
+        Should come first in MIDDLEWARE so that the total covers the other middleware too
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'SKILLS_PROFILE_SAMPLE_RATE', 0.0)
+        self.threshold = getattr(settings, 'SKILLS_PROFILE_THRESHOLD', 500) / 1000
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def start(self):
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        timing = RequestTiming(capture=sampled)
+        profiler = None
+        if sampled:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Only one profiler can run at a time, another sampled request already has it
+                profiler = None
+        return timing, profiler, current.set(timing)
+
+    def show_timing(self, request):
+        """
+            Whether the response to request gets the Server-Timing header
+        """
+        enabled = getattr(settings, 'SKILLS_SERVER_TIMING', None)
+        if enabled if enabled is not None else settings.DEBUG:
+            return True
+        # AuthenticationMiddleware comes later, a request it never saw (a redirect from CommonMiddleware) has no user
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_authenticated and user.is_staff
+
+    def finish(self, request, response, timing, profiler, token, show_timing):
+        if profiler is not None:
+            profiler.disable()
+        current.reset(token)
+        total = time.perf_counter() - timing.start
+        if show_timing:
+            response['Server-Timing'] = timing.server_timing(total)
+        if timing.query_log is not None and total >= self.threshold:
+            write_dump(request, response, timing, profiler, total)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing, profiler, token = self.start()
+        # The handler turns exceptions into responses before they get here
+        response = self.get_response(request)
+        return self.finish(request, response, timing, profiler, token, self.show_timing(request))
+
+    async def __acall__(self, request):
+        timing, profiler, token = self.start()
+        response = await self.get_response(request)
+        # Looking at request.user may load the user, which is sync only ORM work
+        show_timing = await sync_to_async(self.show_timing)(request)
+        return self.finish(request, response, timing, profiler, token, show_timing)
@@ -0,0 +1,159 @@
+"""
+    Read replica routing.
+
+    Views marked with ReplicaReadMixin read from the SKILLS_REPLICA_ALIAS database when answering GET and HEAD
+    requests, everything else (signup, password change, the admin, management commands, background threads) reads and
+    writes the primary.  Writes always go to the primary, and a request that writes pins its browser to the primary
+    for SKILLS_REPLICA_STICKY_SECONDS through a cookie, so that somebody who has just changed their profile sees the
+    change even if the replica hasn't caught up yet.  Users and sessions are always read from the primary, a login
+    that hasn't reached the replica would otherwise look like a logout.
+
+    Routing is off until the replica alias is in DATABASES.  With SQLite the replica is a second file refreshed from
+    the primary by the replicate_database command, see settings.py
+"""
+# Python imports
+import contextvars
+import os
+import time
+
+# Django imports
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Apps whose tables are always read from the primary
+PRIMARY_APPS = {'auth', 'sessions', 'contenttypes', 'admin'}
+STICKY_COOKIE = 'skills_primary'
+
+# The routing state of the request being handled, None outside of ReplicaMiddleware.  An object changed in place
+# rather than a value set again so that changes made in sync_to_async threads are seen by the request
+current = contextvars.ContextVar('replica_routing', default=None)
+
+
+def replica_alias():
+    """
+        The replica's database alias, None when there is no replica configured
+    """
+    alias = getattr(settings, 'SKILLS_REPLICA_ALIAS', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+def reads_replica():
+    """
+        Whether the request being handled reads from the replica
+    """
+    routing = current.get()
+    return (routing is not None and routing.use_replica and not routing.sticky and not routing.wrote
+            and replica_alias() is not None)
+
+
+def replica_version():
+    """
+        A value that changes whenever an SQLite replica is refreshed, '' when the request doesn't read from one.
+        Cached responses rendered from the replica are keyed on it, otherwise a page rendered from a replica that is
+        behind would be cached under the version stamps bumped by the write it hasn't seen yet (see cache.py)
+    """
+    if not reads_replica():
+        return ''
+    database = settings.DATABASES[replica_alias()]
+    if not database['ENGINE'].endswith('sqlite3'):
+        return ''
+    stamps = []
+    # Refreshing writes to the -wal file, checkpoints move the pages into the database file
+    for path in [str(database['NAME']), str(database['NAME']) + '-wal']:
+        try:
+            stamps.append(str(os.stat(path).st_mtime_ns))
+        except OSError:
+            stamps.append('0')
+    return ':'.join(stamps)
+
+
+class RequestRouting:
+    def __init__(self, sticky=False):
+        # Set for the views that may read from the replica
+        self.use_replica = False
+        # The browser wrote recently, or this request has
+        self.sticky = sticky
+        self.wrote = False
+
+
+class ReplicaReadMixin:
+    """
+        Marks a view as read only, its GET and HEAD requests read from the replica
+    """
+    use_replica = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not reads_replica() or model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Reads inside a transaction are usually about to be written back
+            return DEFAULT_DB_ALIAS
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        routing = current.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, objects from either can be related
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its tables with everything else when it is copied
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+        Sets up the routing state for ReplicaRouter and pins browsers that wrote to the primary
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'SKILLS_REPLICA_STICKY_SECONDS', 30)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        routing = RequestRouting(sticky=sticky)
+        return routing, current.set(routing)
+
+    def finish(self, response, routing, token):
+        current.reset(token)
+        if routing.wrote:
+            response.set_cookie(STICKY_COOKIE, str(int(time.time() + self.sticky_seconds)),
+                                max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing, token = self.start(request)
+        return self.finish(self.get_response(request), routing, token)
+
+    async def __acall__(self, request):
+        routing, token = self.start(request)
+        return self.finish(await self.get_response(request), routing, token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = current.get()
+        view_class = getattr(view_func, 'view_class', None)
+        if routing is not None and request.method in ('GET', 'HEAD'):
+            routing.use_replica = getattr(view_class, 'use_replica', False)
@@ -0,0 +1,306 @@
+# Python imports
+import re
+from collections import namedtuple
+
+# Django imports
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+# Local imports
+from . import fuzzy
+from .models import Category, Provider, Skill
+
+
+SearchHit = namedtuple('SearchHit', ['kind', 'pk', 'rank'])
+
+# Every indexed model gets a kind, the kind is folded into the index rowid so a single row can be found (and
+# replaced) by primary key lookup instead of scanning the index
+KINDS = {
+    'category': 1,
+    'provider': 2,
+    'skill': 3,
+}
+KIND_NAMES = {code: kind for kind, code in KINDS.items()}
+KIND_SHIFT = 2
+MODEL_KINDS = {
+    Category: 'category',
+    Provider: 'provider',
+    Skill: 'skill',
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query or '')
+
+
+def document_for(obj):
+    """
+        Returns the (kind, title, body) that gets indexed for a model instance
+    """
+    if isinstance(obj, Skill):
+        return 'skill', obj.name or '', obj.description or ''
+    if isinstance(obj, Provider):
+        title = ' '.join(part for part in [obj.company_name, obj.first_name, obj.last_name] if part)
+        return 'provider', title, obj.about_me or ''
+    if isinstance(obj, Category):
+        return 'category', obj.name or '', ''
+    raise TypeError('{} is not a searchable model'.format(type(obj).__name__))
+
+
+def fuzzy_names(objs):
+    """
+        The (kind, pk, name) tuples the trigram index takes for model instances
+    """
+    names = []
+    for obj in objs:
+        kind, title, body = document_for(obj)
+        names.append((KINDS[kind], obj.pk, title))
+    return names
+
+
+class BaseSearchBackend:
+    """
+        Interface for the directory search index.  Backends are kept up to date by the background jobs the model
+        signals in signals.py queue (see tasks.py), and keep the trigram index of fuzzy.py up to date along with their
+        own
+    """
+    def index(self, obj):
+        raise NotImplementedError
+
+    def index_many(self, objs):
+        for obj in objs:
+            self.index(obj)
+
+    def remove(self, obj):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def search(self, query, kinds=None, limit=None):
+        """
+            Returns a list of SearchHit ordered best match first
+        """
+        raise NotImplementedError
+
+    def filter_queryset(self, queryset, query):
+        """
+            Restricts a Category/Provider/Skill queryset to the rows matching query
+        """
+        raise NotImplementedError
+
+    def filter_entries(self, queryset, query):
+        """
+            Restricts a DirectoryEntry queryset to the entries of the skills matching query
+        """
+        return queryset.filter(skill__in=self.filter_queryset(Skill.objects.all(), query))
+
+    def fuzzy_search(self, query, kinds=None, limit=None):
+        """
+            SearchHits for the names spelled nearly like query, for when search() finds nothing, ranked by similarity
+        """
+        codes = [KINDS[kind] for kind in kinds] if kinds else None
+        return [SearchHit(KIND_NAMES[code], pk, score) for code, pk, score in fuzzy.search(query, codes, limit)]
+
+    def rebuild(self, chunk_size=1000):
+        self.clear()
+        count = 0
+        for model in MODEL_KINDS:
+            for obj in model.objects.all().iterator(chunk_size=chunk_size):
+                self.index(obj)
+                count += 1
+        return count
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """
+        Fallback for databases without full-text support, every search scans the tables.  Only the trigram index for
+        fuzzy_search() is kept
+    """
+    fields = {
+        'category': ['name'],
+        'provider': ['company_name', 'first_name', 'last_name', 'about_me'],
+        'skill': ['name', 'description'],
+    }
+
+    def index(self, obj):
+        fuzzy.index(fuzzy_names([obj]))
+
+    def index_many(self, objs):
+        fuzzy.index(fuzzy_names(objs))
+
+    def remove(self, obj):
+        fuzzy.remove([(KINDS[document_for(obj)[0]], obj.pk)])
+
+    def clear(self):
+        fuzzy.clear()
+
+    def rebuild(self, chunk_size=1000):
+        self.clear()
+        count = 0
+        for model in MODEL_KINDS:
+            chunk = []
+            for obj in model.objects.all().iterator(chunk_size=chunk_size):
+                chunk.append(obj)
+                if len(chunk) >= chunk_size:
+                    self.index_many(chunk)
+                    count += len(chunk)
+                    chunk = []
+            self.index_many(chunk)
+            count += len(chunk)
+        return count
+
+    def _filter(self, queryset, kind, query):
+        for token in tokenize(query):
+            condition = Q()
+            for field in self.fields[kind]:
+                condition |= Q(**{field + '__icontains': token})
+            queryset = queryset.filter(condition)
+        return queryset
+
+    def filter_queryset(self, queryset, query):
+        if not tokenize(query):
+            return queryset.none()
+        return self._filter(queryset, MODEL_KINDS[queryset.model], query)
+
+    def search(self, query, kinds=None, limit=None):
+        if not tokenize(query):
+            return []
+        hits = []
+        for model, kind in MODEL_KINDS.items():
+            if kinds and kind not in kinds:
+                continue
+            pks = self._filter(model.objects.all(), kind, query).values_list('pk', flat=True)
+            hits.extend(SearchHit(kind, pk, 0.0) for pk in pks[:limit])
+        return hits[:limit]
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+        SQLite FTS5 index over category, provider and skill text, results are ranked with bm25
+    """
+    table = 'church_skills_search_index'
+    # bm25 column weights for (kind, title, body), titles count for more than descriptions
+    weights = (0.0, 10.0, 1.0)
+
+    @staticmethod
+    def rowid(kind, pk):
+        return (pk << KIND_SHIFT) | KINDS[kind]
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every token so user input can never be parsed as FTS syntax, the trailing * gives prefix matches
+        tokens = tokenize(query)
+        return ' '.join('"{}"*'.format(token) for token in tokens)
+
+    def index(self, obj):
+        kind, title, body = document_for(obj)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table), [self.rowid(kind, obj.pk)])
+            cursor.execute('INSERT INTO {} (rowid, kind, title, body) VALUES (%s, %s, %s, %s)'.format(self.table),
+                           [self.rowid(kind, obj.pk), kind, title, body])
+        fuzzy.index(fuzzy_names([obj]))
+
+    def index_many(self, objs):
+        objs = list(objs)
+        rows = []
+        for obj in objs:
+            kind, title, body = document_for(obj)
+            rows.append([self.rowid(kind, obj.pk), kind, title, body])
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(self.table), [row[:1] for row in rows])
+            self._insert_many(cursor, rows)
+        fuzzy.index(fuzzy_names(objs))
+
+    def remove(self, obj):
+        kind = document_for(obj)[0]
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table), [self.rowid(kind, obj.pk)])
+        fuzzy.remove([(KINDS[kind], obj.pk)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.table))
+        fuzzy.clear()
+
+    def rebuild(self, chunk_size=1000):
+        self.clear()
+        count = 0
+        with connection.cursor() as cursor:
+            for model in MODEL_KINDS:
+                rows = []
+                objs = []
+                for obj in model.objects.all().iterator(chunk_size=chunk_size):
+                    kind, title, body = document_for(obj)
+                    rows.append([self.rowid(kind, obj.pk), kind, title, body])
+                    objs.append(obj)
+                    if len(rows) >= chunk_size:
+                        self._insert_many(cursor, rows)
+                        fuzzy.index(fuzzy_names(objs))
+                        count += len(rows)
+                        rows = []
+                        objs = []
+                self._insert_many(cursor, rows)
+                fuzzy.index(fuzzy_names(objs))
+                count += len(rows)
+            cursor.execute("INSERT INTO {0} ({0}) VALUES ('optimize')".format(self.table))
+        return count
+
+    def _insert_many(self, cursor, rows):
+        if rows:
+            cursor.executemany('INSERT INTO {} (rowid, kind, title, body) VALUES (%s, %s, %s, %s)'.format(self.table),
+                               rows)
+
+    def search(self, query, kinds=None, limit=None):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        sql = 'SELECT rowid, kind, bm25({}, %s, %s, %s) AS score FROM {} WHERE {} MATCH %s'.format(
+            self.table, self.table, self.table)
+        params = list(self.weights) + [expression]
+        if kinds:
+            sql += ' AND kind IN ({})'.format(', '.join(['%s'] * len(kinds)))
+            params.extend(kinds)
+        sql += ' ORDER BY score'
+        if limit:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [SearchHit(kind, rowid >> KIND_SHIFT, rank) for rowid, kind, rank in cursor.fetchall()]
+
+    def filter_queryset(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        kind = MODEL_KINDS[queryset.model]
+        # Matches are found in the index and joined back by primary key, the base table is never scanned
+        where = ('{pk} IN (SELECT rowid >> {shift} FROM {table} WHERE {table} MATCH %s AND kind = %s)'.format(
+            pk=connection.ops.quote_name(queryset.model._meta.db_table) + '.'
+            + connection.ops.quote_name(queryset.model._meta.pk.column),
+            shift=KIND_SHIFT, table=self.table))
+        return queryset.extra(where=[where], params=[expression, kind])
+
+    def filter_entries(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        # The same lookup on the entries' skill ids, filter_queryset()'s table reference doesn't survive being nested
+        # in a subquery
+        where = ('{column} IN (SELECT rowid >> {shift} FROM {table} WHERE {table} MATCH %s AND kind = %s)'.format(
+            column=connection.ops.quote_name(queryset.model._meta.db_table) + '.'
+            + connection.ops.quote_name(queryset.model._meta.get_field('skill').column),
+            shift=KIND_SHIFT, table=self.table))
+        return queryset.extra(where=[where], params=[expression, 'skill'])
+
+
+def get_backend():
+    backend = getattr(settings, 'SKILLS_SEARCH_BACKEND', None)
+    if backend is None:
+        backend = 'SQLiteFTSBackend' if connection.vendor == 'sqlite' else 'SimpleSearchBackend'
+        backend = 'church_skills.search.' + backend
+    return import_string(backend)()
@@ -0,0 +1,147 @@
+"""
+    Per-process cache of search results with single-flight misses.
+
+    When a term is announced to the whole congregation hundreds of identical searches arrive at once.  SearchView
+    answers them from a bounded LRU of recent results, each entry expiring SKILLS_SEARCH_CACHE_TTL seconds after it was
+    computed.  Keys are made of the normalized query, the sort and page asked for, and the version stamps of the
+    directory and of the search index (see cache.py), so a skill, provider or category write or a search index update
+    in any process moves every search onto new keys and the stale entries are simply never read again.
+
+    A miss is single-flight: the first request for a key runs the query and requests for the same key arriving while
+    it runs wait for its result instead of running it again, within one event loop (ASGI) as well as across the
+    threads of a WSGI worker.  Hits, misses and coalesced requests are counted in the skills_search_cache_total metric
+"""
+# Python imports
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+
+# Django imports
+from django.conf import settings
+
+# Local imports
+from . import cache, metrics
+from .routers import replica_version
+from .search import tokenize
+
+
+class Abandoned(Exception):
+    """
+        The request computing a result went away before finishing it, those waiting for it compute it themselves
+    """
+
+
+def normalize(query):
+    # The backends only ever look at the tokens, case insensitively
+    return ' '.join(tokenize(query)).lower()
+
+
+def count(result):
+    metrics.record([(metrics.sample_key('skills_search_cache_total', result=result), 1)])
+
+
+class SearchResultCache:
+    def __init__(self, max_size=500, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key: (expires, value), least recently used first
+        self.entries = OrderedDict()
+        # key: concurrent.futures.Future of the computation under way, which works across event loops
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def store(self, key, value):
+        with self.lock:
+            self.in_flight.pop(key, None)
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def claim(self, key):
+        """
+            ('hit', value) for a fresh entry, otherwise ('lead', future) when the caller is to compute the value and
+            ('wait', future) when another request already is
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    return 'hit', entry[1]
+                del self.entries[key]
+            future = self.in_flight.get(key)
+            if future is not None:
+                return 'wait', future
+            future = self.in_flight[key] = concurrent.futures.Future()
+            # A running future can't be cancelled, a waiter that goes away mustn't take the result with it
+            future.set_running_or_notify_cancel()
+            return 'lead', future
+
+    async def get_or_compute(self, key, compute):
+        """
+            The cached value of key, awaiting compute() for it on a miss
+        """
+        while True:
+            state, value = self.claim(key)
+            if state == 'hit':
+                count('hit')
+                return value
+            future = value
+            if state == 'lead':
+                break
+            count('coalesced')
+            try:
+                return await asyncio.wrap_future(future)
+            except Abandoned:
+                continue
+
+        count('miss')
+        try:
+            value = await compute()
+        except Exception as error:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            future.set_exception(error)
+            raise
+        except BaseException:
+            # Cancelled, the waiters start over
+            with self.lock:
+                self.in_flight.pop(key, None)
+            future.set_exception(Abandoned())
+            raise
+        self.store(key, value)
+        future.set_result(value)
+        return value
+
+
+_results = None
+_results_lock = threading.Lock()
+
+
+def get_results():
+    global _results
+    with _results_lock:
+        if _results is None:
+            _results = SearchResultCache(getattr(settings, 'SKILLS_SEARCH_CACHE_SIZE', 500),
+                                         getattr(settings, 'SKILLS_SEARCH_CACHE_TTL', 60))
+        return _results
+
+
+def result_key(query, *parts):
+    versions = cache.get_versions([cache.directory_key(), cache.search_key()])
+    return (normalize(query),) + parts + tuple(versions) + (replica_version(),)
+
+
+async def cached(key, compute):
+    return await get_results().get_or_compute(key, compute)
+
+
+def clear():
+    get_results().clear()
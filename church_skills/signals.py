@@ -0,0 +1,324 @@
+# Django imports
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+
+# Local imports
+from . import backends, cache, counts, directory, jobs, tasks, typeahead
+from .models import Category, Provider, Skill
+from .search import MODEL_KINDS
+
+
+# ------------------------------------------------- Search index -------------------------------------------------------
+# Indexed by a background job, the job reads the row when it runs so a deletion is picked up the same way
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Provider)
+@receiver(post_save, sender=Skill)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Provider)
+@receiver(post_delete, sender=Skill)
+def queue_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    kind = MODEL_KINDS[sender]
+    jobs.enqueue(tasks.update_search_index, {'kind': kind, 'pk': instance.pk}, priority=10,
+                 dedupe_key='search:{}:{}'.format(kind, instance.pk))
+
+
+# ------------------------------------------------- Category counts ----------------------------------------------------
+@receiver(pre_save, sender=Skill)
+def remember_skill_provider(sender, instance, raw=False, **kwargs):
+    instance._previous_provider_id = instance._previous_name = None
+    if not raw and instance.pk is not None:
+        instance._previous_provider_id, instance._previous_name = Skill.objects.filter(pk=instance.pk)\
+            .values_list('provider_id', 'name').first() or (None, None)
+
+
+@receiver(post_save, sender=Skill)
+def count_saved_skill(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_previous_provider_id', None)
+    if created or previous != instance.provider_id:
+        counts.skill_moved(previous, instance.provider_id)
+
+
+# pre_delete rather than post_delete, when a provider is deleted its category links are removed along with its skills
+# and by post_delete there is nothing left to tell which categories the skill was counted in
+@receiver(pre_delete, sender=Skill)
+def count_deleted_skill(sender, instance, **kwargs):
+    counts.skill_moved(instance.provider_id, None)
+
+
+@receiver(pre_delete, sender=Provider)
+def count_deleted_provider(sender, instance, **kwargs):
+    # Its skills take themselves out through count_deleted_skill
+    counts.adjust(counts.provider_category_ids(instance.pk), providers=-1)
+
+
+@receiver(m2m_changed, sender=Provider.categories.through)
+def count_category_links(sender, instance, action, reverse, pk_set, **kwargs):
+    through = Provider.categories.through
+    own_field, other_field = ('category_id', 'provider_id') if reverse else ('provider_id', 'category_id')
+
+    if action in ('pre_remove', 'pre_clear'):
+        # Only links that actually exist count, remove() is allowed to name objects that aren't linked
+        linked = through.objects.filter(**{own_field: instance.pk})
+        if pk_set is not None:
+            linked = linked.filter(**{other_field + '__in': pk_set})
+        instance._unlinked_ids = set(linked.values_list(other_field, flat=True))
+        return
+    if action in ('post_remove', 'post_clear'):
+        changed, sign = getattr(instance, '_unlinked_ids', set()), -1
+    elif action == 'post_add':
+        # Django has already dropped links that existed before from pk_set
+        changed, sign = pk_set, 1
+    else:
+        return
+
+    with transaction.atomic():
+        if reverse:
+            counts.providers_linked(changed, [instance.pk], sign)
+        else:
+            counts.providers_linked([instance.pk], changed, sign)
+
+
+# ------------------------------------------------- Directory entries --------------------------------------------------
+@receiver(post_save, sender=Skill)
+def refresh_skill_entries(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    directory.refresh_skills([instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Provider)
+def update_provider_entries(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and set(update_fields) == {'last_login'}):
+        return
+    directory.update_providers([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def update_category_entries(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    directory.update_categories([instance])
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_providers(sender, instance, **kwargs):
+    # The links go with the category, its providers' skills may be left without any category
+    instance._provider_ids = list(Provider.categories.through.objects.filter(category_id=instance.pk)
+                                  .values_list('provider_id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def refresh_category_provider_entries(sender, instance, **kwargs):
+    directory.refresh_providers(getattr(instance, '_provider_ids', []))
+
+
+@receiver(m2m_changed, sender=Provider.categories.through)
+def refresh_linked_entries(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_provider_ids = list(Provider.categories.through.objects.filter(category_id=instance.pk)
+                                              .values_list('provider_id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        directory.refresh_providers([instance.pk])
+    elif action == 'post_clear':
+        directory.refresh_providers(getattr(instance, '_cleared_provider_ids', []))
+    else:
+        directory.refresh_providers(pk_set)
+
+
+# ------------------------------------------------- Response cache -----------------------------------------------------
+def category_slugs(provider_ids):
+    return Category.objects.filter(provider__in=[pk for pk in provider_ids if pk is not None])\
+        .values_list('slug', flat=True)
+
+
+def usernames(provider_ids):
+    return User.objects.filter(pk__in=[pk for pk in provider_ids if pk is not None])\
+        .values_list('username', flat=True)
+
+
+def bump_providers(provider_ids, extra_keys=()):
+    """
+        Invalidates the directory wide pages plus the profile and category pages of the given providers
+    """
+    keys = [cache.directory_key()] + list(extra_keys)
+    keys += [cache.provider_key(username) for username in usernames(provider_ids)]
+    keys += [cache.category_key(slug) for slug in category_slugs(provider_ids)]
+    cache.bump(keys)
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=Provider)
+def remember_cache_names(sender, instance, raw=False, **kwargs):
+    # A renamed slug/username still has pages cached under the old name
+    instance._previous_cache_name = None
+    if not raw and instance.pk is not None:
+        field = 'slug' if sender is Category else 'username'
+        instance._previous_cache_name = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    cache.bump([cache.directory_key(), cache.category_key(instance.slug),
+                cache.category_key(getattr(instance, '_previous_cache_name', None) or instance.slug)])
+
+
+@receiver(post_save, sender=Provider)
+def bump_provider(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_cache_name', None) or instance.username
+    bump_providers([instance.pk], [cache.provider_key(previous)])
+
+
+# pre_delete because the provider's category links are gone by post_delete
+@receiver(pre_delete, sender=Provider)
+def bump_deleted_provider(sender, instance, **kwargs):
+    bump_providers([instance.pk], [cache.provider_key(instance.username)])
+
+
+@receiver(post_save, sender=User)
+def bump_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Logging in saves last_login, which isn't shown anywhere
+    if raw or (update_fields is not None and set(update_fields) == {'last_login'}):
+        return
+    previous = getattr(instance, '_previous_cache_name', None) or instance.username
+    cache.bump([cache.provider_key(instance.username), cache.provider_key(previous)])
+
+
+@receiver(post_save, sender=Skill)
+def bump_skill(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_providers([instance.provider_id, getattr(instance, '_previous_provider_id', None)])
+
+
+@receiver(pre_delete, sender=Skill)
+def bump_deleted_skill(sender, instance, **kwargs):
+    bump_providers([instance.provider_id])
+
+
+@receiver(m2m_changed, sender=Provider.categories.through)
+def bump_category_links(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # Once cleared there is no telling which pages showed the links
+        if reverse:
+            instance._cleared_pages = list(instance.provider_set.values_list('pk', flat=True))
+        else:
+            instance._cleared_pages = list(instance.categories.values_list('slug', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        provider_ids = list(pk_set) if pk_set is not None else getattr(instance, '_cleared_pages', [])
+        keys = [cache.category_key(instance.slug)]
+        keys += [cache.provider_key(username) for username in usernames(provider_ids)]
+    else:
+        if pk_set is not None:
+            slugs = Category.objects.filter(pk__in=pk_set).values_list('slug', flat=True)
+        else:
+            slugs = getattr(instance, '_cleared_pages', [])
+        keys = [cache.provider_key(instance.username)] + [cache.category_key(slug) for slug in slugs]
+    cache.bump([cache.directory_key()] + keys)
+
+
+# ------------------------------------------------- Template fragments -------------------------------------------------
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Provider)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Provider)
+def bump_user_fragments(sender, instance, update_fields=None, **kwargs):
+    # The navigation shows the logged in user's name
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    cache.invalidate_user_fragments(instance.pk)
+
+
+# ------------------------------------------------- Thumbnails ---------------------------------------------------------
+@receiver(pre_save, sender=Provider)
+def remember_picture(sender, instance, raw=False, **kwargs):
+    instance._previous_picture = None
+    if not raw and instance.pk is not None:
+        instance._previous_picture = Provider.objects.filter(pk=instance.pk).values_list('picture', flat=True).first()
+
+
+@receiver(post_save, sender=Provider)
+def queue_thumbnails(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    changed = (instance.picture.name or None) != (getattr(instance, '_previous_picture', None) or None)
+    if changed or (instance.picture and not instance.picture_hash):
+        jobs.enqueue(tasks.generate_thumbnails, {'provider_id': instance.pk},
+                     dedupe_key='thumbnails:{}'.format(instance.pk))
+
+
+# ------------------------------------------------- Typeahead ----------------------------------------------------------
+# Applied on commit, a rolled back save must not leave a suggestion behind in memory
+@receiver(post_save, sender=Category)
+def suggest_category(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: typeahead.category_saved(instance))
+
+
+@receiver(post_save, sender=Provider)
+def suggest_provider(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: typeahead.provider_saved(instance))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Provider)
+def remove_suggestion(sender, instance, **kwargs):
+    # Taken now, the deletion sets instance.pk to None before the transaction commits
+    kind, pk = 'category' if sender is Category else 'provider', instance.pk
+    transaction.on_commit(lambda: typeahead.removed(kind, pk))
+
+
+@receiver(post_save, sender=Skill)
+def suggest_skill(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_name = None if created else getattr(instance, '_previous_name', None)
+    old_provider_id = None if created else getattr(instance, '_previous_provider_id', None)
+    name, provider_id = instance.name, instance.provider_id
+    transaction.on_commit(lambda: typeahead.skill_moved(old_name, old_provider_id, name, provider_id))
+
+
+@receiver(post_delete, sender=Skill)
+def remove_skill_suggestion(sender, instance, **kwargs):
+    name, provider_id = instance.name, instance.provider_id
+    transaction.on_commit(lambda: typeahead.skill_moved(name, provider_id, None, None))
+
+
+# ------------------------------------------------- Cached users -------------------------------------------------------
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Provider)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Provider)
+def forget_cached_user(sender, instance, **kwargs):
+    pk = instance.pk
+    backends.forget_user(pk)
+    # A request that read the old row before the save committed may have cached it again in the meantime.  pk is
+    # taken now, a deletion sets instance.pk to None before the transaction commits
+    transaction.on_commit(lambda: backends.forget_user(pk))
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        backends.forget_user(user.pk)
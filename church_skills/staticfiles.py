@@ -0,0 +1,133 @@
+"""
+    Fingerprinted, precompressed static files served by the site itself.
+
+    collectstatic with CompressedManifestStaticFilesStorage copies every file under a name containing the hash of its
+    content (css url() references are rewritten to match, the {% static %} tag looks the names up in the manifest)
+    and writes a gzip and, when the brotli package is installed, a brotli version next to each text file.  A hashed
+    name always stands for the same content, so StaticFileView serves those with a year long immutable
+    Cache-Control, picking the smallest encoding the browser accepts.  Files still referenced by a hand-versioned name
+    that isn't in the manifest keep their plain url and are revalidated on every use.
+
+    A front proxy can serve STATIC_ROOT itself (with gzip_static / brotli_static in nginx), the view is for when
+    there is none
+"""
+# Python imports
+import gzip
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Django imports
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+
+# Types worth compressing, images and fonts are compressed already
+COMPRESSIBLE = ('.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico')
+# Below this the headers outweigh the savings
+MIN_SIZE = 256
+# Best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# The hash ManifestStaticFilesStorage puts before the extension
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 so collecting the same file twice gives the same bytes
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+
+def available_encodings():
+    return [(encoding, suffix) for encoding, suffix in ENCODINGS if encoding != 'br' or brotli is not None]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        try:
+            return super(CompressedManifestStaticFilesStorage, self).stored_name(name)
+        except ValueError:
+            # Not collected, a missing file shouldn't take the whole page down with it
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super(CompressedManifestStaticFilesStorage, self).post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in paths:
+            hashed_name = self.hashed_files.get(self.hash_key(self.clean_name(name)))
+            for stored in {name, hashed_name} - {None}:
+                for compressed in self.compress_file(stored):
+                    yield name, compressed, True
+
+    def compress_file(self, name):
+        """
+            Writes the compressed versions of name that come out smaller than it, returns their names
+        """
+        if not name.lower().endswith(COMPRESSIBLE):
+            return []
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < MIN_SIZE:
+            return []
+        written = []
+        for encoding, suffix in available_encodings():
+            compressed = compress(data, encoding)
+            target = name + suffix
+            if self.exists(target):
+                self.delete(target)
+            if len(compressed) < len(data):
+                self._save(target, ContentFile(compressed))
+                written.append(target)
+        return written
+
+
+def accepted_encodings(header):
+    """
+        The content codings an Accept-Encoding header allows, leaving out those given q=0
+    """
+    accepted = set()
+    for part in header.split(','):
+        coding, *parameters = [item.strip() for item in part.split(';')]
+        quality = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+def negotiate(storage, name, accept_encoding):
+    """
+        (path, encoding) of the best version of name for the client, encoding None for the file itself, or None when
+        there is no such file.  Raises SuspiciousFileOperation for names outside of STATIC_ROOT
+    """
+    path = storage.path(name)
+    if not os.path.isfile(path):
+        return None
+    accepted = accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODINGS:
+        if (encoding in accepted or '*' in accepted) and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def content_type(name):
+    guessed, encoding = mimetypes.guess_type(name)
+    return guessed or 'application/octet-stream'
+
+
+def is_hashed(name):
+    return HASHED_NAME.search(name) is not None
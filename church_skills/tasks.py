@@ -0,0 +1,35 @@
+"""
+    The background jobs queued by the handlers in signals.py, see jobs.py.  Each one reads the current rows when it
+    runs, so a job queued several times (or run again after a failure) still does the right thing
+"""
+# Local imports
+from . import cache, thumbnails
+from .models import Provider
+from .search import MODEL_KINDS, get_backend
+
+
+KIND_MODELS = {kind: model for model, kind in MODEL_KINDS.items()}
+
+
+def update_search_index(kind, pk):
+    """
+        Indexes the row as it is now, or takes it out of the index when it has been deleted
+    """
+    model = KIND_MODELS[kind]
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        get_backend().remove(model(pk=pk))
+    else:
+        get_backend().index(obj)
+    cache.bump([cache.search_key()])
+
+
+def generate_thumbnails(provider_id):
+    provider = Provider.objects.filter(pk=provider_id).first()
+    if provider is None:
+        return
+    previous = provider.picture_hash
+    thumbnails.generate(provider)
+    if provider.picture_hash != previous:
+        # The hash is written with update(), which doesn't run the signals that bump the profile page
+        cache.bump([cache.provider_key(provider.username)])
@@ -0,0 +1,63 @@
+"""
+    {% cachedfragment 'name' [per_user] %}...{% endcachedfragment %} caches the chrome every page shares, the head
+    links and the navigation, so that rendering a page is mostly its own body block.
+
+    A per_user fragment is cached once for anonymous visitors and once for each logged in user, the others once for
+    everybody.  A user's copies are dropped through a version stamp (see cache.py) by
+    cache.invalidate_user_fragments(user_id), which signals.py calls when a user is saved.  Keys also include the
+    static files manifest, so a deploy with new assets doesn't serve links to the old ones, a deploy that only changes
+    the chrome templates should clear the cache.  The CSRF token is cached as a placeholder and filled in for every
+    render
+"""
+# Django imports
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.safestring import mark_safe
+
+# Local imports
+from church_skills import cache
+
+register = template.Library()
+
+
+class CachedFragmentNode(template.Node):
+    def __init__(self, nodelist, name, per_user):
+        self.nodelist = nodelist
+        self.name = name
+        self.per_user = per_user
+
+    def render(self, context):
+        name = str(self.name.resolve(context))
+        keys = []
+        user = ''
+        if self.per_user:
+            visitor = context.get('user')
+            if visitor is not None and visitor.is_authenticated:
+                user = visitor.pk
+                keys.append(cache.user_fragments_key(visitor.pk))
+            else:
+                user = 'anonymous'
+        key = cache.fragment_cache_key(name, user, cache.get_versions(keys),
+                                       getattr(staticfiles_storage, 'manifest_hash', ''))
+
+        store = cache.get_cache()
+        content = store.get(key)
+        if content is None:
+            with context.push(csrf_token=cache.CSRF_PLACEHOLDER):
+                content = self.nodelist.render(context)
+            store.set(key, content, getattr(settings, 'SKILLS_CACHE_TIMEOUT', 60 * 60 * 24))
+        token = context.get('csrf_token')
+        if token:
+            content = content.replace(cache.CSRF_PLACEHOLDER, str(token))
+        return mark_safe(content)
+
+
+@register.tag
+def cachedfragment(parser, token):
+    bits = token.split_contents()
+    if len(bits) not in (2, 3) or (len(bits) == 3 and bits[2] != 'per_user'):
+        raise template.TemplateSyntaxError("'{}' takes a fragment name and optionally per_user".format(bits[0]))
+    nodelist = parser.parse(('endcachedfragment',))
+    parser.delete_first_token()
+    return CachedFragmentNode(nodelist, parser.compile_filter(bits[1]), len(bits) == 3)
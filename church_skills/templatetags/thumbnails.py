@@ -0,0 +1,41 @@
+# Django imports
+from django import template
+from django.utils.html import format_html, format_html_join
+
+# Local imports
+from church_skills import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(provider, use, image_format='jpeg'):
+    """
+        The srcset value for one format of a provider's picture, empty when it has no thumbnails yet
+    """
+    if not provider or not provider.picture_hash:
+        return ''
+    return thumbnails.srcset(provider.picture_hash, use, image_format)
+
+
+@register.simple_tag
+def picture(provider, use, alt=None, css_class=''):
+    """
+        A <picture> with a WebP source and a JPEG fallback, each with every width in a srcset so the browser picks the
+        smallest one that is sharp on its screen.  Falls back to the uploaded file when there are no thumbnails yet
+    """
+    if not provider or not provider.picture:
+        return ''
+    alt = str(provider) if alt is None else alt
+    if not provider.picture_hash:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', provider.picture.url, alt, css_class)
+
+    digest, sizes = provider.picture_hash, thumbnails.DISPLAY_SIZES[use]
+    sources = format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', [
+        (thumbnails.content_type(image_format), thumbnails.srcset(digest, use, image_format), sizes)
+        for image_format in thumbnails.available_formats() if image_format != 'jpeg'
+    ])
+    image = format_html('<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy">',
+                        thumbnails.rendition_url(digest, use, thumbnails.RENDITIONS[use][0], 'jpeg'),
+                        thumbnails.srcset(digest, use, 'jpeg'), sizes, alt, css_class)
+    return format_html('<picture>{}{}</picture>', sources, image)
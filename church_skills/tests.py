@@ -1,3 +1,885 @@
-from django.test import TestCase
+# Python imports
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import pstats
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+# Django imports
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.html import format_html
+from django.utils.http import http_date
+
+# Local imports
+from . import (backends, benchmark, cache, checks, counts, directory, importer, jobs, metrics, profiles, routers,
+               searchcache, staticfiles, thumbnails, typeahead, views)
+from .admin import CategoryAdmin, EstimatedCountPaginator
+from .db import retry_on_locked
+from .models import Category, DirectoryEntry, Job, Provider, Skill
+from .pagination import encode_cursor
+from .search import get_backend
+
+
+def concurrent_writer(path, writes, results):
+    """
+        Runs in a child process against its own connection to the file database at path.  Every write reads the
+        counter and then updates it, the read to write upgrade is exactly what SQLite refuses while another
+        connection is writing
+    """
+    wrapper = type(connections['default'])(dict(connections['default'].settings_dict, NAME=path), 'default')
+    connections['default'] = wrapper
+
+    @retry_on_locked(attempts=50, base_delay=0.005, max_delay=0.2)
+    def write():
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT value FROM counter')
+                value = cursor.fetchone()[0]
+                cursor.execute('UPDATE counter SET value = %s', [value + 1])
+                cursor.execute('INSERT INTO entries (pid) VALUES (%s)', [os.getpid()])
+
+    try:
+        for _ in range(writes):
+            write()
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            results.put(('ok', cursor.fetchone()[0]))
+    except Exception as error:
+        results.put(('error', repr(error)))
+    finally:
+        wrapper.close()
+
+
+def failing_task(message):
+    raise ValueError(message)
+
+
+@unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+class ConcurrentWriteTests(SimpleTestCase):
+    processes = 8
+    writes = 40
+
+    def test_concurrent_writers_all_complete(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stress.sqlite3')
+            setup = sqlite3.connect(path)
+            setup.executescript('CREATE TABLE counter (value INTEGER); INSERT INTO counter VALUES (0);'
+                                'CREATE TABLE entries (id INTEGER PRIMARY KEY, pid INTEGER);')
+            setup.close()
+
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            workers = [context.Process(target=concurrent_writer, args=(path, self.writes, results))
+                       for _ in range(self.processes)]
+            for worker in workers:
+                worker.start()
+            outcomes = [results.get(timeout=120) for _ in workers]
+            for worker in workers:
+                worker.join()
+
+            self.assertEqual(outcomes, [('ok', 'wal')] * self.processes)
+            check = sqlite3.connect(path)
+            total = self.processes * self.writes
+            # No lost updates and no lost rows
+            self.assertEqual(check.execute('SELECT value FROM counter').fetchone()[0], total)
+            self.assertEqual(check.execute('SELECT COUNT(*) FROM entries').fetchone()[0], total)
+            check.close()
+
+
+class BenchmarkTests(TestCase):
+    def test_generated_directory_is_reproducible(self):
+        benchmark.generate(providers=30, skills=200, categories=5, seed=7)
+        first = list(Skill.objects.order_by('slug').values_list('slug', 'provider__username', 'cost_range'))
+        Skill.objects.all().delete()
+        Provider.objects.all().delete()
+        Category.objects.all().delete()
+        benchmark.generate(providers=30, skills=200, categories=5, seed=7)
+        second = list(Skill.objects.order_by('slug').values_list('slug', 'provider__username', 'cost_range'))
+        self.assertEqual(len(first), 200)
+        self.assertEqual(first, second)
+
+    def test_every_view_is_measured(self):
+        benchmark.generate(providers=30, skills=200, categories=5, seed=7)
+        results = benchmark.run(iterations=2, warmup=0)
+        self.assertEqual([result['name'] for result in results['results']],
+                         [name for name, url, xhr in benchmark.scenarios()])
+        self.assertEqual(results['rows'], {'categories': 5, 'providers': 30, 'skills': 200})
+        for result in results['results']:
+            self.assertEqual(result['requests'], 2)
+            self.assertGreater(result['queries_max'], 0)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # Two of every count, so pages split rows with equal sort keys
+        for number in range(7):
+            Category.objects.create(name='Category {}'.format(number), slug='category-{}'.format(number),
+                                    skill_count=number // 2 + 1)
+
+    def table_page(self, cursor=None, **params):
+        params = dict(params, page_size=2, **({'cursor': cursor} if cursor else {}))
+        return self.client.get('/api/Categories/', params)
+
+    def test_walking_every_page_returns_each_row_once_in_order(self):
+        for ascending in ['true', 'false']:
+            names, cursor = [], None
+            while True:
+                data = self.table_page(cursor, sorting_method='skill_count', ascending=ascending).json()
+                self.assertLessEqual(len(data['results']), 2)
+                names += [row['name'] for row in data['results']]
+                cursor = data['next_cursor']
+                if cursor is None:
+                    break
+            expected = sorted(Category.objects.all(), key=lambda category: (category.skill_count, category.pk),
+                              reverse=ascending == 'false')
+            self.assertEqual(names, [format_html('<a href="{}">{}</a>', category.get_absolute_url(), category.name)
+                                     for category in expected])
+
+    def test_tampered_cursors_are_rejected(self):
+        for value, pk in [(None, 1), ({'a': 1}, 1), ([1], 1), (True, 1), ('Category 1', 'x'), ('Category 1', True)]:
+            self.assertEqual(self.table_page(encode_cursor(value, pk)).status_code, 400)
+        self.assertEqual(self.table_page('not a cursor').status_code, 400)
+        self.assertEqual(self.table_page(encode_cursor('Category 1', 1)).status_code, 200)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        # Only the routing decisions are looked at, no query goes to the replica
+        patcher = mock.patch.object(routers, 'replica_alias', return_value='replica')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def route(self, method='get', cookie=None, view=views.MainView.as_view()):
+        """
+            The databases Skill and User are read from while ReplicaMiddleware handles the request, and the response
+        """
+        request = getattr(RequestFactory(), method)('/')
+        if cookie is not None:
+            request.COOKIES[routers.STICKY_COOKIE] = str(cookie)
+        router, databases = routers.ReplicaRouter(), []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            databases.extend([router.db_for_read(Skill), router.db_for_read(User)])
+            if method == 'post':
+                router.db_for_write(Skill)
+            return HttpResponse()
+
+        middleware = routers.ReplicaMiddleware(get_response)
+        return databases, middleware(request)
+
+    def test_reads_go_to_the_replica_until_the_browser_writes(self):
+        databases, response = self.route()
+        self.assertEqual(databases, ['replica', 'default'])
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.route(view=views.CreateUserView.as_view())[0], ['default', 'default'])
+
+        databases, response = self.route('post')
+        self.assertEqual(databases, ['default', 'default'])
+        sticky = response.cookies[routers.STICKY_COOKIE]
+        self.assertEqual(sticky['max-age'], 30)
+        self.assertEqual(self.route(cookie=sticky.value)[0], ['default', 'default'])
+        self.assertEqual(self.route(cookie=int(time.time()) - 1)[0], ['replica', 'default'])
+
+        with mock.patch.object(routers, 'replica_alias', return_value=None):
+            self.assertEqual(self.route()[0], ['default', 'default'])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_saving_a_skill_moves_the_pages_that_show_it(self):
+        provider = Provider.objects.create(username='sam', company_name='Sam Home Services')
+        self.client.get('/Profiles/sam')
+        self.assertEqual(self.client.get('/Profiles/sam')['X-Cache'], 'HIT')
+        self.client.get('/')
+        self.assertEqual(self.client.get('/')['X-Cache'], 'HIT')
+        Skill.objects.create(name='Gutter cleaning', provider=provider)
+        for url in ['/', '/Profiles/sam']:
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertContains(response, 'Gutter cleaning')
+        # Other providers' pages are left alone
+        Provider.objects.create(username='alex')
+        self.client.get('/Profiles/alex')
+        Skill.objects.create(name='Painting', provider=provider)
+        self.assertEqual(self.client.get('/Profiles/alex')['X-Cache'], 'HIT')
+
+    def test_renamed_user_sees_the_new_name_on_cached_pages(self):
+        user = User.objects.create_user(username='jordan', password='Correct-Horse-42')
+        self.client.login(username='jordan', password='Correct-Horse-42')
+        self.assertContains(self.client.get('/Categories/'), 'jordan')
+        self.assertEqual(self.client.get('/Categories/')['X-Cache'], 'HIT')
+        user.username = 'jordan.lee'
+        user.save()
+        response = self.client.get('/Categories/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'jordan.lee')
+
+    def test_loading_fixtures_leaves_the_stamps_alone(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'directory.json')
+        with open(path, 'w') as output:
+            json.dump([
+                {'model': 'church_skills.category', 'pk': 1, 'fields': {'name': 'Plumbing', 'slug': 'plumbing'}},
+                {'model': 'auth.user', 'pk': 1, 'fields': {'username': 'sam', 'password': '!'}},
+                {'model': 'church_skills.provider', 'pk': 1, 'fields': {'company_name': 'Sam Co'}},
+                {'model': 'church_skills.skill', 'pk': 1, 'fields': {'name': 'Drains', 'provider': 1}},
+            ], output)
+        keys = [cache.directory_key(), cache.category_key('plumbing'), cache.provider_key('sam')]
+        versions = cache.get_versions(keys)
+        call_command('loaddata', path, verbosity=0)
+        self.assertEqual(Skill.objects.get().provider.company_name, 'Sam Co')
+        self.assertEqual(cache.get_versions(keys), versions)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        Category.objects.create(name='Plumbing', slug='plumbing', skill_count=1)
+
+    def test_matching_etag_gets_304_until_the_rows_change(self):
+        etag = self.client.get('/Categories/')['ETag']
+        self.assertEqual(self.client.get('/Categories/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Category.objects.create(name='Roofing', slug='roofing', skill_count=1)
+        self.assertEqual(self.client.get('/Categories/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_deletion_and_login_change_the_etag_and_dates_are_not_trusted(self):
+        Category.objects.create(name='Roofing', slug='roofing', skill_count=1)
+        first = self.client.get('/Categories/')
+        self.assertNotIn('Last-Modified', first)
+        # Only the ETag can tell the page changed, the newest last_updated is the same after the deletion
+        Category.objects.get(slug='plumbing').delete()
+        response = self.client.get('/Categories/', HTTP_IF_NONE_MATCH=first['ETag'],
+                                   HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/Categories/', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+                         .status_code, 200)
+        Provider.objects.create_user(username='robin', password='Correct-Horse-42')
+        self.client.login(username='robin', password='Correct-Horse-42')
+        self.assertEqual(self.client.get('/Categories/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class DatasetTests(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        for name, skill_count in [('Roofing', 3), ('Carpentry', 1), ('Plumbing', 2)]:
+            Category.objects.create(name=name, slug=name.lower(), skill_count=skill_count, provider_count=1)
+
+    def test_dataset_has_parallel_columns_and_sort_ranks(self):
+        data = self.client.get('/api/Categories/', {'dataset': 1}).json()
+        self.assertTrue(data['dataset'])
+        self.assertEqual(data['count'], 3)
+        columns = data['columns']
+        self.assertEqual(set(len(values) for values in columns.values()), {3})
+        by_rank = sorted(range(3), key=lambda row: data['sort_keys']['name'][row])
+        self.assertEqual([columns['name'][row] for row in by_rank], ['Carpentry', 'Plumbing', 'Roofing'])
+        by_rank = sorted(range(3), key=lambda row: data['sort_keys']['skill_count'][row])
+        self.assertEqual([columns['skill_count'][row] for row in by_rank], [1, 2, 3])
+
+    def test_conditional_view_sends_a_single_etag(self):
+        response = self.client.get('/Categories/', {'dataset': 1}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTrue(response.json()['dataset'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/Categories/', {'dataset': 1}, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # No second tag over the content is in play, even when the page is rendered rather than cached
+        cache.get_cache().clear()
+        content_etag = '"{}"'.format(hashlib.sha1(response.content).hexdigest())
+        self.assertEqual(self.client.get('/Categories/', {'dataset': 1}, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                                         HTTP_IF_NONE_MATCH=content_etag).status_code, 200)
+        # The same tag whether the response was rendered or came from the response cache
+        self.assertEqual(self.client.get('/Categories/', {'dataset': 1}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                         ['ETag'], etag)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ServerTimingTests(TestCase):
+    def test_timings_are_only_sent_to_staff_or_when_enabled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/Categories/'))
+        with self.settings(SKILLS_SERVER_TIMING=True):
+            self.assertRegex(self.client.get('/Categories/')['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+            self.assertIn('Server-Timing', self.client.get('/api/Categories/'))
+        Provider.objects.create_user(username='staff', password='Correct-Horse-42', is_staff=True)
+        self.client.login(username='staff', password='Correct-Horse-42')
+        self.assertIn('total;dur=', self.client.get('/Categories/')['Server-Timing'])
+        self.assertIn('Server-Timing', self.client.get('/api/Categories/'))
+
+    def test_sampled_slow_requests_are_written_out(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache.get_cache().clear()
+        with self.settings(SKILLS_PROFILE_SAMPLE_RATE=1, SKILLS_PROFILE_THRESHOLD=0, SKILLS_PROFILE_DIR=directory.name):
+            self.client.get('/Categories/')
+        names = sorted(os.listdir(directory.name))
+        self.assertEqual([os.path.splitext(name)[1] for name in names], ['.prof', '.json'])
+        self.assertGreater(pstats.Stats(os.path.join(directory.name, names[0])).total_calls, 0)
+        with open(os.path.join(directory.name, names[1])) as dump:
+            data = json.load(dump)
+        self.assertEqual((data['path'], data['status']), ('/Categories/', 200))
+        self.assertTrue(any('church_skills_category' in query['sql'] for query in data['queries']))
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], SKILLS_METRICS_TOKEN='scrape-token')
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = self.settings(SKILLS_METRICS_DIR=directory.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        metrics.clear()
+        self.addCleanup(metrics.clear)
+
+    def test_requests_are_counted_and_only_shown_to_scrapers(self):
+        self.client.get('/Categories/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('skills_responses_total{status="2xx",view="church_skills:category_list"} 1',
+                      response.content.decode())
+        Provider.objects.create_user(username='staff', password='Correct-Horse-42', is_staff=True)
+        self.client.login(username='staff', password='Correct-Horse-42')
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class CachedAuthTests(TestCase):
+    password = 'Correct-Horse-42'
+
+    def setUp(self):
+        Provider.objects.create_user(username='casey', password=self.password)
+        self.client.login(username='casey', password=self.password)
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries if 'auth_user' in query['sql'] or 'django_session' in query['sql']]
+
+    def test_authenticated_page_views_make_no_auth_queries(self):
+        self.auth_queries('/Categories/')
+        self.assertEqual(self.auth_queries('/Categories/'), [])
+
+    def test_password_change_logs_out_other_sessions(self):
+        other = self.client_class()
+        other.login(username='casey', password=self.password)
+        self.auth_queries('/Categories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/accounts/password_change/', {'old_password': self.password,
+                                                            'new_password1': 'Battery-Staple-43',
+                                                            'new_password2': 'Battery-Staple-43'})
+        self.assertTrue(self.client.get('/Categories/').wsgi_request.user.is_authenticated)
+        self.assertFalse(other.get('/Categories/').wsgi_request.user.is_authenticated)
+
+    def test_deleted_user_is_forgotten_on_commit(self):
+        user = User.objects.get(username='casey')
+        pk = user.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+            # Read again by a request that still saw the row
+            backends.get_cache().set(backends.user_key(pk), user)
+        self.assertIsNone(backends.get_cache().get(backends.user_key(pk)))
+
+    def test_process_local_cache_is_refused_for_several_workers(self):
+        self.assertEqual(checks.shared_caches_check(None), [])
+        with self.settings(SKILLS_WORKERS=4):
+            self.assertEqual([error.id for error in checks.shared_caches_check(None)], ['church_skills.E001'])
+
+
+class JobQueueTests(TestCase):
+    def test_saves_are_indexed_by_the_worker(self):
+        skill = Skill.objects.create(name='Bricklaying', provider=Provider.objects.create(username='sam'))
+        skill.name = 'Bricklaying and pointing'
+        skill.save()
+        self.assertEqual(Job.objects.filter(task='church_skills.tasks.update_search_index').count(), 2)
+        self.assertEqual(get_backend().search('pointing', kinds=['skill']), [])
+        self.assertEqual(jobs.run_pending(), (2, 0))
+        self.assertEqual([hit.pk for hit in get_backend().search('pointing', kinds=['skill'])], [skill.pk])
+
+        skill.delete()
+        jobs.run_pending()
+        self.assertEqual(get_backend().search('pointing', kinds=['skill']), [])
+        self.assertFalse(Job.objects.exists())
+
+    def test_duplicates_are_queued_once_and_failures_retried(self):
+        for _ in range(3):
+            jobs.enqueue(failing_task, {'message': 'broken'}, dedupe_key='broken', max_attempts=2)
+        with self.assertLogs('church_skills.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_pending(), (0, 1))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('ValueError: broken', job.last_error)
+        # Waiting out its backoff, a new copy can't be queued alongside it
+        self.assertEqual(jobs.run_pending(), (0, 0))
+        Job.objects.update(run_at=job.date_added)
+        with self.assertLogs('church_skills.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_pending(), (0, 1))
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+        jobs.enqueue(failing_task, {'message': 'broken'}, dedupe_key='broken')
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+
+
+class SearchCacheTests(SimpleTestCase):
+    def test_concurrent_misses_share_one_computation(self):
+        results = searchcache.SearchResultCache(max_size=2, ttl=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return ['result']
+
+        async def search():
+            return await asyncio.gather(*[results.get_or_compute('hymns', compute) for _ in range(20)])
+
+        self.assertEqual(asyncio.run(search()), [['result']] * 20)
+        self.assertEqual(len(calls), 1)
+        asyncio.run(results.get_or_compute('hymns', compute))
+        self.assertEqual(len(calls), 1)
+        # The least recently used key is the one evicted
+        for key in ['choir', 'hymns', 'organ']:
+            asyncio.run(results.get_or_compute(key, compute))
+        self.assertEqual(list(results.entries), ['hymns', 'organ'])
+
+
+class CategoryCountTests(TestCase):
+    def test_counts_follow_saves_and_reconcile_repairs_drift(self):
+        plumbing = Category.objects.create(name='Plumbing', slug='plumbing')
+        roofing = Category.objects.create(name='Roofing', slug='roofing')
+        provider = Provider.objects.create(username='sam')
+        provider.categories.add(plumbing, roofing)
+        skill = Skill.objects.create(name='Drains', provider=provider)
+        Skill.objects.create(name='Pipes', provider=provider)
+        provider.categories.remove(roofing)
+        skill.delete()
+        self.assertEqual(dict(Category.objects.values_list('slug', 'skill_count')), {'plumbing': 1, 'roofing': 0})
+        self.assertEqual(Category.objects.get(slug='plumbing').provider_count, 1)
+        # Saving a copy loaded before the counts moved leaves them alone
+        plumbing.name = 'Plumbing and heating'
+        plumbing.save()
+        self.assertEqual(Category.objects.get(slug='plumbing').skill_count, 1)
+
+        # A bulk write skips the signals
+        Category.objects.filter(slug='plumbing').update(skill_count=7, provider_count=0)
+        self.assertEqual(list(counts.drifted().values_list('slug', flat=True)), ['plumbing'])
+        self.assertEqual(counts.reconcile(), 1)
+        plumbing.refresh_from_db()
+        self.assertEqual((plumbing.skill_count, plumbing.provider_count), (1, 1))
+        self.assertFalse(counts.drifted().exists())
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(text)
+        return path
+
+    def test_rerun_resumes_after_the_last_committed_chunk(self):
+        path = self.write('categories.csv', 'name\nPlumbing\nRoofing\nPainting\nFencing\nTiling\n')
+        checkpoint = path + '.checkpoint'
+        # An earlier run committed the first two chunks of two rows and then failed
+        with open(checkpoint, 'w') as output:
+            json.dump({'rows': 4}, output)
+        result = importer.run('category', path, chunk_size=2, checkpoint=checkpoint)
+        self.assertEqual((result.rows, result.created), (1, 1))
+        self.assertEqual(list(Category.objects.values_list('slug', flat=True)), ['tiling'])
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_rows_are_upserted_on_their_natural_keys(self):
+        importer.run('category', self.write('categories.csv', 'name\nPlumbing\n'))
+        provider = '{"username": "sam", "company_name": "Sam Co", "categories": "plumbing"}\n'
+        importer.run('provider', self.write('providers.jsonl', provider))
+        skills = self.write('skills.csv', 'provider,name,cost_range\nsam,Drains,$20\nsam,Pipes,$30\nnobody,Roofs,$5\n')
+        first = importer.run('skill', skills)
+        self.assertEqual((first.created, first.updated, first.skipped), (2, 0, 1))
+        second = importer.run('skill', self.write('more.csv', 'provider,name,cost_range\nsam,Drains,$25\n'))
+        self.assertEqual((second.created, second.updated), (0, 1))
+        self.assertEqual(dict(Skill.objects.values_list('name', 'cost_range')), {'Drains': '$25', 'Pipes': '$30'})
+        plumbing = Category.objects.get(slug='plumbing')
+        self.assertEqual((plumbing.skill_count, plumbing.provider_count), (2, 1))
+        self.assertEqual(DirectoryEntry.objects.filter(category=plumbing).count(), 2)
+
+    def test_names_without_ascii_letters_keep_their_own_rows(self):
+        result = importer.run('category', self.write('categories.csv', 'name\n配管\n屋根\n🔧\n'))
+        self.assertEqual((result.created, result.skipped), (2, 1))
+        self.assertEqual(sorted(Category.objects.values_list('slug', flat=True)), ['屋根', '配管'])
+        importer.run('provider', self.write('providers.csv', 'username,categories\nsam,配管\n'))
+        result = importer.run('skill', self.write('skills.csv', 'provider,name\nsam,排水\nsam,給湯\nsam,!!\n'))
+        self.assertEqual((result.created, result.skipped), (2, 1))
+        self.assertEqual(Category.objects.get(slug='配管').skill_count, 2)
+
+    def test_only_the_categories_touched_are_reconciled(self):
+        Category.objects.create(name='Roofing', slug='roofing')
+        Category.objects.filter(slug='roofing').update(skill_count=3)
+        importer.run('category', self.write('categories.csv', 'name\nPlumbing\n'))
+        importer.run('provider', self.write('providers.csv', 'username,categories\nsam,plumbing\n'))
+        importer.run('skill', self.write('skills.csv', 'provider,name\nsam,Drains\n'))
+        self.assertEqual(dict(Category.objects.values_list('slug', 'skill_count')), {'plumbing': 1, 'roofing': 3})
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ExportTests(TestCase):
+    def test_export_streams_rows_for_logged_in_users(self):
+        plumbing = Category.objects.create(name='Plumbing', slug='plumbing')
+        sam = Provider.objects.create_user(username='sam', password='Correct-Horse-42', company_name='Sam Co')
+        sam.categories.add(plumbing)
+        Skill.objects.create(name='Drains', cost_range='$20', provider=sam)
+        Skill.objects.create(name='Painting', provider=Provider.objects.create(username='alex'))
+        self.assertEqual(self.client.get('/export/directory.csv').status_code, 302)
+
+        self.client.login(username='sam', password='Correct-Horse-42')
+        response = self.client.get('/export/directory.csv')
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(row['name'], row['provider'], row['categories']) for row in rows],
+                         [('Drains', 'sam', 'plumbing'), ('Painting', 'alex', '')])
+
+        response = self.client.get('/export/directory.ndjson', {'category': 'plumbing'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Drains'])
+        self.assertEqual(self.client.get('/export/directory.csv', {'since': 'last week'}).status_code, 400)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        plumbing = Category.objects.create(name='Plumbing', slug='plumbing')
+        sam = Provider.objects.create(username='sam', company_name='Sam Co')
+        sam.categories.add(plumbing)
+        for name in ['Pipes', 'Drains', 'Boilers']:
+            Skill.objects.create(name=name, provider=sam)
+        jobs.run_pending()
+
+    async def test_json_views_answer_through_the_async_handler(self):
+        client = AsyncClient()
+        data = (await client.get('/api/Categories/plumbing/', {'page_size': 2})).json()
+        self.assertEqual(data['category']['skill_count'], 3)
+        self.assertEqual(len(data['results']), 2)
+        rest = (await client.get('/api/Categories/plumbing/', {'page_size': 2, 'cursor': data['next_cursor']})).json()
+        self.assertIn('Pipes', rest['results'][0]['name'])
+        self.assertIsNone(rest['next_cursor'])
+        self.assertEqual((await client.get('/api/Categories/roofing/')).status_code, 404)
+
+        profile = (await client.get('/api/Profiles/sam')).json()
+        self.assertEqual([skill['name'] for skill in profile['skills']], ['Boilers', 'Drains', 'Pipes'])
+        self.assertFalse(profile['is_self'])
+        response = await client.get('/search_results', {'name': 'drains'})
+        self.assertContains(response, 'Drains')
+        self.assertNotContains(response, 'Boilers')
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        typeahead.reset()
+        self.addCleanup(typeahead.reset)
+
+    def labels(self, query):
+        return [result['label'] for result in self.client.get('/typeahead', {'q': query}).json()['results']]
+
+    def test_suggestions_rank_by_popularity_and_follow_saves(self):
+        Category.objects.create(name='Plumbing', slug='plumbing', skill_count=2)
+        Category.objects.create(name='Plastering', slug='plastering', skill_count=9)
+        Category.objects.create(name='Roofing', slug='roofing', skill_count=5)
+        self.assertEqual(self.labels('pl'), ['Plastering', 'Plumbing'])
+        self.assertEqual(self.labels('plu'), ['Plumbing'])
+
+        # Changes after the index is loaded come in through the overlay
+        with self.captureOnCommitCallbacks(execute=True):
+            provider = Provider.objects.create(username='sam', company_name='Plumb Perfect')
+            Skill.objects.create(name='Plumbing repairs', provider=provider)
+        self.assertEqual(set(self.labels('plu')), {'Plumbing', 'Plumb Perfect', 'Plumbing repairs'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.get(slug='plastering').delete()
+        self.assertNotIn('Plastering', self.labels('pl'))
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = self.settings(MEDIA_ROOT=directory.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_renditions_are_made_in_the_background_and_served_for_good(self):
+        picture = io.BytesIO()
+        Image.new('RGB', (800, 400), (200, 40, 40)).save(picture, format='PNG')
+        provider = Provider.objects.create(username='sam', picture=SimpleUploadedFile('sam.png', picture.getvalue()))
+        self.assertIsNone(provider.picture_hash)
+        jobs.run_pending()
+        provider.refresh_from_db()
+        digest = provider.picture_hash
+        self.assertEqual(digest, hashlib.sha256(picture.getvalue()).hexdigest()[:thumbnails.HASH_LENGTH])
+
+        name = thumbnails.rendition_name(digest, 'list', 64, 'jpeg')
+        with default_storage.open(name, 'rb') as rendition:
+            self.assertEqual(Image.open(rendition).size, (64, 32))
+        response = self.client.get('/media/' + name)
+        self.assertEqual(response['Cache-Control'], thumbnails.CACHE_CONTROL)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        # A rendition missing on disk is made again when it is asked for
+        default_storage.delete(name)
+        self.assertEqual(self.client.get('/media/' + name).status_code, 200)
+        self.assertTrue(default_storage.exists(name))
+        unknown_width = name.replace('-64.', '-65.')
+        self.assertEqual(self.client.get('/media/' + unknown_width).status_code, 404)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'],
+                   STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'])
+class StaticFileTests(TestCase):
+    def setUp(self):
+        source, root = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(root.cleanup)
+        os.makedirs(os.path.join(source.name, 'site'))
+        with open(os.path.join(source.name, 'site', 'style.css'), 'w') as output:
+            output.write('body { margin: 0; }\n' * 100)
+        overrides = self.settings(STATICFILES_DIRS=[source.name], STATIC_ROOT=root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_fingerprinted_files_are_served_compressed_and_immutable(self):
+        name = staticfiles_storage.stored_name('site/style.css')
+        self.assertTrue(staticfiles.is_hashed(name))
+        response = self.client.get('/static/' + name, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], staticfiles.CACHE_CONTROL)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'body { margin: 0; }\n' * 100)
+
+        response = self.client.get('/static/' + name, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        # The name without the hash can change content, it is revalidated
+        response = self.client.get('/static/site/style.css')
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.get('/static/site/style.css', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                         .status_code, 304)
+        self.assertEqual(self.client.get('/static/../settings.py').status_code, 404)
+
+
+class FragmentCacheTests(TestCase):
+    template = Template("{% load fragments %}{% cachedfragment 'nav' per_user %}{{ user.first_name }}"
+                        "{% endcachedfragment %}")
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def render(self, user):
+        return self.template.render(Context({'user': user}))
+
+    def test_per_user_fragments_are_kept_until_the_user_is_saved(self):
+        sam = User.objects.create_user(username='sam', first_name='Sam')
+        alex = User.objects.create_user(username='alex', first_name='Alex')
+        self.assertEqual(self.render(sam), 'Sam')
+        self.assertEqual(self.render(alex), 'Alex')
+        self.assertEqual(self.render(AnonymousUser()), '')
+
+        # Rendered from the cache until a save says otherwise
+        sam.first_name = 'Samuel'
+        self.assertEqual(self.render(sam), 'Sam')
+        sam.save(update_fields=['last_login'])
+        self.assertEqual(self.render(sam), 'Sam')
+        sam.save()
+        self.assertEqual(self.render(sam), 'Samuel')
+        self.assertEqual(self.render(alex), 'Alex')
+
+
+class DirectoryEntryTests(TestCase):
+    def entries(self):
+        return sorted(DirectoryEntry.objects.values_list('skill_name', 'provider_name', 'category_name', 'is_primary'),
+                      key=lambda entry: (entry[0], entry[2] or ''))
+
+    def test_entries_follow_skills_providers_and_categories(self):
+        plumbing = Category.objects.create(name='Plumbing', slug='plumbing')
+        roofing = Category.objects.create(name='Roofing', slug='roofing')
+        sam = Provider.objects.create(username='sam')
+        skill = Skill.objects.create(name='Drains', provider=sam)
+        Skill.objects.create(name='Unlisted')
+        self.assertEqual(self.entries(), [('Drains', 'sam', None, True)])
+
+        sam.categories.add(plumbing, roofing)
+        self.assertEqual(self.entries(), [('Drains', 'sam', 'Plumbing', True), ('Drains', 'sam', 'Roofing', False)])
+        sam.company_name = 'Sam Co'
+        sam.save()
+        roofing.name = 'Roofs'
+        roofing.save()
+        skill.name = 'Drain clearing'
+        skill.save()
+        expected = [('Drain clearing', 'Sam Co', 'Plumbing', True), ('Drain clearing', 'Sam Co', 'Roofs', False)]
+        self.assertEqual(self.entries(), expected)
+
+        # Bulk writes skip the signals, rebuild() catches up
+        DirectoryEntry.objects.all().delete()
+        self.assertEqual(directory.rebuild(chunk_size=1), 2)
+        self.assertEqual(self.entries(), expected)
+
+        plumbing.delete()
+        self.assertEqual(self.entries(), [('Drain clearing', 'Sam Co', 'Roofs', True)])
+        skill.delete()
+        self.assertEqual(self.entries(), [])
+
+
+class SearchIndexTests(TestCase):
+    def test_title_matches_rank_first_and_prefixes_match(self):
+        provider = Provider.objects.create(username='sam', company_name='Sam Home Services')
+        described = Skill.objects.create(name='Handyman', description='Odd jobs, some plumbing', provider=provider)
+        named = Skill.objects.create(name='Plumbing', description='Pipes and drains', provider=provider)
+        Skill.objects.create(name='Roofing', description='Shingles', provider=provider)
+        jobs.run_pending()
+        backend = get_backend()
+        self.assertEqual([hit.pk for hit in backend.search('plumbing', kinds=['skill'])], [named.pk, described.pk])
+        self.assertEqual([hit.pk for hit in backend.search('plum', kinds=['skill'])], [named.pk, described.pk])
+        self.assertEqual(set(backend.filter_queryset(Skill.objects.all(), 'plu').values_list('pk', flat=True)),
+                         {named.pk, described.pk})
+        # Search syntax in the query is taken as plain words
+        self.assertEqual([hit.pk for hit in backend.search('plumb* OR "roof', kinds=['skill'])], [])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class FuzzySearchTests(TestCase):
+    def test_misspelled_search_finds_similar_names(self):
+        provider = Provider.objects.create(username='pat', company_name='Sparky Electricians')
+        skill = Skill.objects.create(name='Plumbing repair', provider=provider)
+        jobs.run_pending()
+        backend = get_backend()
+        self.assertEqual(backend.search('plumbng'), [])
+        self.assertEqual([hit.pk for hit in backend.fuzzy_search('plumbng', kinds=['skill'])], [skill.pk])
+        self.assertEqual([hit.pk for hit in backend.fuzzy_search('electrision', kinds=['provider'])], [provider.pk])
+        self.assertContains(self.client.get('/search_results', {'name': 'plumbng'}), 'Plumbing repair')
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(EstimatedCountPaginator, 'exact_limit', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for number in range(8):
+            Category.objects.create(name='Category {}'.format(number), slug='category-{}'.format(number))
+
+    def test_unfiltered_lists_take_the_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        paginator = EstimatedCountPaginator(Category.objects.order_by('pk'), 3)
+        self.assertEqual((paginator.count, paginator.num_pages), (8, 3))
+        self.assertFalse(paginator.capped)
+
+    def test_capped_counts_page_on_past_the_limit(self):
+        # Without statistics, as on a database that was never analyzed, the count stops at the limit
+        filtered = Category.objects.filter(name__startswith='Category')
+        for queryset in [Category.objects.order_by('pk'), filtered.order_by('pk')]:
+            paginator = EstimatedCountPaginator(queryset, 2)
+            self.assertEqual(str(paginator.count), '5+')
+            self.assertEqual(paginator.num_pages, 3)
+            page = paginator.page(4)
+            self.assertEqual([category.name for category in page], ['Category 6', 'Category 7'])
+            self.assertTrue(page.has_next())
+            self.assertEqual(list(paginator.page_range)[-1], 5)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        with mock.patch.object(CategoryAdmin, 'list_per_page', 2):
+            response = self.client.get('/admin/church_skills/category/', {'p': 4})
+        self.assertContains(response, '5+ ')
+        self.assertContains(response, '>Category 0</a>')
+        self.assertContains(response, '?p=5')
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class AdminTests(TestCase):
+    def test_recategorize_updates_counts_and_directory(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        old = Category.objects.create(name='Plumbing', slug='plumbing')
+        new = Category.objects.create(name='Carpentry', slug='carpentry')
+        providers = [Provider.objects.create(username='provider{}'.format(number)) for number in range(3)]
+        for provider in providers:
+            provider.categories.add(old)
+            Skill.objects.create(name='Repairs', provider=provider)
+        self.assertEqual(self.client.get('/admin/church_skills/skill/').status_code, 200)
+
+        self.client.post('/admin/church_skills/provider/', {'action': 'recategorize', 'category': new.pk,
+                                                             '_selected_action': [p.pk for p in providers[:2]]})
+        old.refresh_from_db()
+        new.refresh_from_db()
+        self.assertEqual((old.provider_count, old.skill_count), (1, 1))
+        self.assertEqual((new.provider_count, new.skill_count), (2, 2))
+        self.assertEqual(DirectoryEntry.objects.filter(category=new).count(), 2)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ProfileQueryTests(TestCase):
+    def create_provider(self, username, skills, categories):
+        provider = Provider.objects.create(username=username, company_name='{} Ltd'.format(username))
+        provider.categories.set([Category.objects.create(name='{} {}'.format(username, number),
+                                                         slug='{}-{}'.format(username, number))
+                                 for number in range(categories)])
+        for number in range(skills):
+            Skill.objects.create(name='Skill {}'.format(number), provider=provider)
+        return provider
+
+    def test_profile_queries_do_not_grow_with_skills(self):
+        self.create_provider('small', skills=1, categories=1)
+        self.create_provider('large', skills=30, categories=5)
+        for username in ['small', 'large']:
+            with self.assertNumQueries(3):
+                profile = profiles.load(username)
+            self.assertEqual(len(profile.skills[0].categories), len(profile.categories))
+            with self.assertNumQueries(3):
+                self.assertEqual(async_to_sync(profiles.aload)(username), profile)
+        User.objects.create_user(username='visitor')
+        with self.assertNumQueries(2):
+            profile = profiles.load('visitor')
+        self.assertEqual((profile.user.username, profile.provider, profile.skills), ('visitor', None, []))
+        with self.assertNumQueries(2):
+            self.assertIsNone(profiles.load('nobody'))
+
+        queries = []
+        for username in ['small', 'large']:
+            with CaptureQueriesContext(connection) as captured:
+                self.assertContains(self.client.get('/Profiles/{}'.format(username)), '{} Ltd'.format(username))
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+        data = self.client.get('/api/Profiles/large').json()
+        self.assertEqual(data['skill_count'], 30)
+        self.assertEqual(len(data['provider']['categories']), 5)
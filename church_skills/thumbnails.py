@@ -0,0 +1,134 @@
+"""
+    Downscaled renditions of Provider.picture.
+
+    Every picture is resized to a few widths for each use (RENDITIONS), as JPEG and as WebP, and stored in the default
+    storage under thumbnails/ with the hash of the uploaded file in the name.  A new upload gets new names, so the
+    files never change once written and can be served with a year long immutable Cache-Control.  The hash is kept on
+    the provider (picture_hash) so templates can build the urls without touching the files, see the picture and
+    srcset tags in templatetags/thumbnails.py.
+
+    Renditions are made by a background job queued when a provider is saved with a new picture (see tasks.py), by the
+    generate_thumbnails command for pictures uploaded before, and by ThumbnailView when a file is requested that isn't
+    on disk (after moving servers, say).  In production have the web server serve MEDIA_ROOT/thumbnails with
+    CACHE_CONTROL and fall back to the site for missing files
+"""
+# Python imports
+import hashlib
+import io
+import re
+from collections import namedtuple
+
+from PIL import Image, ImageOps, features
+
+# Django imports
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# Local imports
+from .models import Provider
+
+
+# Use: widths generated, the 1x and 2x versions of the displayed size
+RENDITIONS = {
+    'list': [64, 128],
+    'profile': [320, 640],
+}
+# The sizes attribute for each use, the width the image is displayed at
+DISPLAY_SIZES = {
+    'list': '64px',
+    'profile': '(max-width: 360px) 100vw, 320px',
+}
+# Preferred first, browsers take the first <source> they understand
+FORMATS = {
+    'webp': ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+PREFIX = 'thumbnails'
+HASH_LENGTH = 20
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+Rendition = namedtuple('Rendition', ['digest', 'use', 'width', 'image_format'])
+
+NAME_PATTERN = re.compile(r'^{}/[0-9a-f]{{2}}/(?P<digest>[0-9a-f]{{{}}})-(?P<use>\w+)-(?P<width>\d+)'
+                          r'\.(?P<extension>\w+)$'.format(PREFIX, HASH_LENGTH))
+
+
+def available_formats():
+    return [image_format for image_format in FORMATS if image_format != 'webp' or features.check('webp')]
+
+
+def rendition_name(digest, use, width, image_format):
+    return '{}/{}/{}-{}-{}.{}'.format(PREFIX, digest[:2], digest, use, width, FORMATS[image_format][0])
+
+
+def parse_name(name):
+    """
+        The Rendition a storage name stands for, None if it isn't one
+    """
+    match = NAME_PATTERN.match(name)
+    if match is None or match['use'] not in RENDITIONS or int(match['width']) not in RENDITIONS[match['use']]:
+        return None
+    for image_format, (extension, content_type, options) in FORMATS.items():
+        if extension == match['extension']:
+            return Rendition(match['digest'], match['use'], int(match['width']), image_format)
+    return None
+
+
+def content_type(image_format):
+    return FORMATS[image_format][1]
+
+
+def rendition_url(digest, use, width, image_format):
+    return default_storage.url(rendition_name(digest, use, width, image_format))
+
+
+def srcset(digest, use, image_format):
+    return ', '.join('{} {}w'.format(rendition_url(digest, use, width, image_format), width)
+                     for width in RENDITIONS[use])
+
+
+def resize(image, width, image_format):
+    copy = image.copy()
+    # thumbnail() keeps the aspect ratio and never enlarges
+    copy.thumbnail((width, width * 4), Image.LANCZOS)
+    if image_format == 'jpeg' and copy.mode != 'RGB':
+        # JPEG has no transparency, flatten onto white
+        background = Image.new('RGB', copy.size, (255, 255, 255))
+        rgba = copy.convert('RGBA')
+        background.paste(rgba, mask=rgba.split()[-1])
+        copy = background
+    output = io.BytesIO()
+    copy.save(output, format=image_format.upper(), **FORMATS[image_format][2])
+    return output.getvalue()
+
+
+def generate(provider, force=False):
+    """
+        Writes any missing renditions of the provider's picture (all of them with force) and records the picture's
+        hash on the provider.  Returns the hash, None when the provider has no picture
+    """
+    digest = None
+    if provider.picture:
+        with provider.picture.open('rb') as picture:
+            data = picture.read()
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+        image = None
+        for use, widths in RENDITIONS.items():
+            for width in widths:
+                for image_format in available_formats():
+                    name = rendition_name(digest, use, width, image_format)
+                    if default_storage.exists(name):
+                        if not force:
+                            continue
+                        default_storage.delete(name)
+                    if image is None:
+                        # Phone photos are stored sideways with an orientation tag, which the renditions lose
+                        image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+                    default_storage.save(name, ContentFile(resize(image, width, image_format)))
+
+    if digest != provider.picture_hash:
+        # update() so that saving the hash doesn't run the save signals all over again
+        Provider.objects.filter(pk=provider.pk).update(picture_hash=digest)
+        provider.picture_hash = digest
+    return digest
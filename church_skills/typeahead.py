@@ -0,0 +1,340 @@
+"""
+    In-memory prefix index for the search box suggestions.
+
+    Suggestions are category names, provider company names and skill names (one per distinct name, however many
+    providers offer it), ranked by popularity: the category's skill count, the number of skills a provider offers and
+    the number of skills listed under a name.  Every word of a suggestion is put in one sorted list which is searched
+    with bisect, a prefix is the run of words between two bisections.  Short prefixes match a large part of the list,
+    so for any prefix matching more than SCAN_LIMIT words the best suggestions are worked out when the index is
+    built, everything else is a scan of at most SCAN_LIMIT words.  wsgi.py and asgi.py start loading the index when
+    the server starts.
+
+    The sorted arrays are never changed once built.  Saves and deletes (see signals.py) go into a small overlay of
+    added/changed suggestions and removed ones that is merged into every answer, and the index is rebuilt in a
+    background thread once the overlay grows past MAX_OVERLAY or the index is older than SKILLS_TYPEAHEAD_MAX_AGE
+    seconds.  The age limit is also what brings in changes made by other worker processes and popularity that drifts
+    without a model save (the category counts are updated with queryset updates)
+"""
+# Python imports
+import bisect
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+
+# Django imports
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count, Min, Q
+from django.db.models.functions import Lower
+from django.urls import reverse
+
+# Local imports
+from .models import Category, Provider, Skill
+from .search import tokenize
+
+
+logger = logging.getLogger(__name__)
+
+Suggestion = namedtuple('Suggestion', ['kind', 'key', 'label', 'target', 'popularity'])
+
+SCAN_LIMIT = 1000
+KEEP = 50
+MAX_OVERLAY = 2000
+TOKEN_END = '\U0010ffff'
+
+
+def words(text):
+    return tokenize((text or '').lower())
+
+
+def skill_key(name):
+    return ' '.join(words(name))
+
+
+def rank(suggestion):
+    return suggestion.popularity, -len(suggestion.label)
+
+
+def matches(suggestion, query_words):
+    """
+        Whether every query word is the start of some word of the suggestion
+    """
+    label_words = words(suggestion.label)
+    return all(any(word.startswith(query_word) for word in label_words) for query_word in query_words)
+
+
+class PrefixIndex:
+    def __init__(self, suggestions):
+        self.suggestions = suggestions
+        self.numbers = {(suggestion.kind, suggestion.key): number for number, suggestion in enumerate(suggestions)}
+        pairs = sorted((word, number) for number, suggestion in enumerate(suggestions)
+                       for word in set(words(suggestion.label)))
+        self.words = [word for word, number in pairs]
+        self.owners = [number for word, number in pairs]
+        # prefix: numbers of its best KEEP suggestions, best first, for prefixes too common to scan
+        self.best = {}
+        self.precompute()
+
+    def range(self, prefix):
+        return bisect.bisect_left(self.words, prefix), bisect.bisect_left(self.words, prefix + TOKEN_END)
+
+    def precompute(self):
+        # Find the prefixes too common to scan, stepping through the distinct next letters of each, every one a
+        # bisection away from the previous
+        pending = ['']
+        while pending:
+            prefix = pending.pop()
+            low, high = self.range(prefix)
+            if high - low <= SCAN_LIMIT:
+                continue
+            if prefix:
+                self.best[prefix] = []
+            position = low
+            while position < high:
+                word = self.words[position]
+                if len(word) == len(prefix):
+                    position += 1
+                    continue
+                child = word[:len(prefix) + 1]
+                pending.append(child)
+                position = self.range(child)[1]
+
+        # Then hand out the suggestions best first, each one joins the lists of the common prefixes of its words
+        # until they are full
+        unfilled = len(self.best)
+        for number in sorted(range(len(self.suggestions)), key=lambda number: rank(self.suggestions[number]),
+                             reverse=True):
+            for word in set(words(self.suggestions[number].label)):
+                for length in range(1, len(word) + 1):
+                    best = self.best.get(word[:length])
+                    if best is None:
+                        # Longer prefixes of this word are rarer still
+                        break
+                    if len(best) < KEEP and (not best or best[-1] != number):
+                        best.append(number)
+                        if len(best) == KEEP:
+                            unfilled -= 1
+            if not unfilled:
+                break
+
+    def candidates(self, query_words):
+        """
+            Numbers of suggestions that may match, taken from the rarest of the query words
+        """
+        ranges = [(self.range(word), word) for word in query_words]
+        (low, high), word = min(ranges, key=lambda item: item[0][1] - item[0][0])
+        if high - low <= SCAN_LIMIT:
+            return set(self.owners[low:high])
+        return self.best.get(word, [])
+
+    def get(self, kind, key):
+        number = self.numbers.get((kind, key))
+        return None if number is None else self.suggestions[number]
+
+
+def load_suggestions():
+    suggestions = []
+    for pk, name, slug, skill_count in Category.objects.exclude(name__isnull=True)\
+            .values_list('pk', 'name', 'slug', 'skill_count').iterator():
+        suggestions.append(Suggestion('category', pk, name, slug, skill_count))
+    providers = Provider.objects.exclude(Q(company_name__isnull=True) | Q(company_name=''))\
+        .annotate(skills=Count('skill')).values_list('pk', 'company_name', 'username', 'skills')
+    for pk, company_name, username, skills in providers.iterator():
+        suggestions.append(Suggestion('provider', pk, company_name, username, skills))
+    # One suggestion per distinct name, the search they lead to finds every provider offering it
+    skill_names = {}
+    names = Skill.objects.filter(provider__isnull=False).values(lowered=Lower('name'))\
+        .annotate(label=Min('name'), skills=Count('pk')).values_list('label', 'skills')
+    for label, skills in names.iterator():
+        # Names differing only in punctuation end up under the same key
+        key = skill_key(label)
+        if key:
+            previous = skill_names.get(key)
+            skill_names[key] = Suggestion('skill', key, label, label, skills + (previous.popularity if previous else 0))
+    suggestions += skill_names.values()
+    return suggestions
+
+
+class Typeahead:
+    """
+        A PrefixIndex plus the overlay of changes made since it was built
+    """
+    def __init__(self):
+        self.index = None
+        self.built = 0
+        self.lock = threading.Lock()
+        self.first_build = threading.Lock()
+        self.rebuilding = False
+        self.sequence = itertools.count()
+        # (kind, key): (sequence, suggestion), suggestion None for removed ones.  Replaced rather than changed in place
+        # so that readers can go through it without taking the lock
+        self.overlay = {}
+
+    def build(self):
+        start = next(self.sequence)
+        index = PrefixIndex(load_suggestions())
+        with self.lock:
+            # Changes made while the index was loading may or may not be in it, they stay in the overlay
+            self.overlay = {key: value for key, value in self.overlay.items() if value[0] > start}
+            self.index = index
+            self.built = time.monotonic()
+
+    def rebuild_in_background(self):
+        def run():
+            try:
+                self.build()
+            finally:
+                self.rebuilding = False
+                connection.close()
+
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+        threading.Thread(target=run, name='typeahead-rebuild', daemon=True).start()
+
+    def warm(self):
+        """
+            Loads the index in a background thread, requests that need it before it is ready wait for it
+        """
+        def run():
+            try:
+                with self.first_build:
+                    if self.index is None:
+                        self.build()
+            except DatabaseError as error:
+                # Not migrated yet for example, the first request that needs the index tries again
+                logger.warning('Could not load the typeahead index: %s', error)
+            finally:
+                connection.close()
+
+        threading.Thread(target=run, name='typeahead-warm', daemon=True).start()
+
+    def get_index(self):
+        if self.index is None:
+            with self.first_build:
+                if self.index is None:
+                    self.build()
+        elif (len(self.overlay) > MAX_OVERLAY
+              or time.monotonic() - self.built > getattr(settings, 'SKILLS_TYPEAHEAD_MAX_AGE', 300)):
+            self.rebuild_in_background()
+        return self.index
+
+    def suggest(self, query, limit=8):
+        query_words = words(query)
+        if not query_words:
+            return []
+        index = self.get_index()
+        overlay = self.overlay
+        found = []
+        for number in index.candidates(query_words):
+            suggestion = index.suggestions[number]
+            if (suggestion.kind, suggestion.key) in overlay:
+                continue
+            # With a single word the candidates are exactly the suggestions having a word starting with it
+            if len(query_words) > 1 and not matches(suggestion, query_words):
+                continue
+            found.append(suggestion)
+        found += [suggestion for sequence, suggestion in overlay.values()
+                  if suggestion is not None and matches(suggestion, query_words)]
+        return heapq.nlargest(limit, found, key=rank)
+
+    def current(self, kind, key):
+        if (kind, key) in self.overlay:
+            return self.overlay[(kind, key)][1]
+        return self.index.get(kind, key)
+
+    def put(self, kind, key, suggestion):
+        if self.index is None:
+            # Nothing loaded yet, it will be read from the database when it is
+            return
+        with self.lock:
+            overlay = dict(self.overlay)
+            overlay[(kind, key)] = (next(self.sequence), suggestion)
+            self.overlay = overlay
+
+    def adjust(self, kind, key, amount, label=None, target=None):
+        """
+            Changes a suggestion's popularity, creating it when label is given.  Skill names nobody offers any more
+            are removed
+        """
+        if self.index is None:
+            return
+        suggestion = self.current(kind, key)
+        if suggestion is None:
+            if label is None:
+                return
+            suggestion = Suggestion(kind, key, label, target, 0)
+        popularity = max(suggestion.popularity + amount, 0)
+        if kind == 'skill' and popularity == 0:
+            self.put(kind, key, None)
+        else:
+            self.put(kind, key, suggestion._replace(popularity=popularity))
+
+
+typeahead = Typeahead()
+
+
+def suggest(query, limit=8):
+    return typeahead.suggest(query, limit)
+
+
+def warm():
+    typeahead.warm()
+
+
+def reset():
+    """
+        Drops the index, it is loaded again on next use
+    """
+    with typeahead.first_build, typeahead.lock:
+        typeahead.index = None
+        typeahead.overlay = {}
+
+
+def category_saved(category):
+    if category.name:
+        typeahead.put('category', category.pk, Suggestion('category', category.pk, category.name, category.slug,
+                                                          category.skill_count))
+    else:
+        typeahead.put('category', category.pk, None)
+
+
+def provider_saved(provider):
+    if provider.company_name:
+        current = typeahead.current('provider', provider.pk) if typeahead.index is not None else None
+        typeahead.put('provider', provider.pk, Suggestion('provider', provider.pk, provider.company_name,
+                                                          provider.username, current.popularity if current else 0))
+    else:
+        typeahead.put('provider', provider.pk, None)
+
+
+def removed(kind, key):
+    typeahead.put(kind, key, None)
+
+
+def skill_moved(old_name, old_provider_id, new_name, new_provider_id):
+    """
+        A skill was added (old_* None), deleted (new_* None), renamed or given to another provider
+    """
+    if old_name is not None and skill_key(old_name) and skill_key(old_name) != skill_key(new_name or ''):
+        typeahead.adjust('skill', skill_key(old_name), -1)
+    if new_name is not None and skill_key(new_name) and skill_key(new_name) != skill_key(old_name or ''):
+        typeahead.adjust('skill', skill_key(new_name), 1, label=new_name, target=new_name)
+    if old_provider_id != new_provider_id:
+        if old_provider_id is not None:
+            typeahead.adjust('provider', old_provider_id, -1)
+        if new_provider_id is not None:
+            typeahead.adjust('provider', new_provider_id, 1)
+
+
+def url_for(suggestion):
+    if suggestion.kind == 'category':
+        return Category.create_url(suggestion.target)
+    if suggestion.kind == 'provider':
+        return Provider.create_url(suggestion.target)
+    return '{}?{}'.format(reverse('church_skills:search_results'), urlencode({'name': suggestion.target}))
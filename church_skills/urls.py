@@ -8,12 +8,33 @@ urlpatterns = [
     path('', views.MainView.as_view(), name='main'),
     # ex: /search_results/
     path('search_results', views.SearchView.as_view(), name='search_results'),
+    # ex: /typeahead?q=plu
+    path('typeahead', views.TypeaheadView.as_view(), name='typeahead'),
     # --------------------------------------Categories------------------------------------------------------------------
     # ex: /Categories/
     path('Categories/', views.CategoryListView.as_view(), name='category_list'),
     # ex: /Categories/Beef/
     path('Categories/<slug>/', views.CategoryDetailView.as_view(), name='category_detail'),
     path('Categories/<path:slug>', views.CategoryDetailView.as_view(), name='category_detail'),
+    # --------------------------------------Export----------------------------------------------------------------------
+    # ex: /export/directory.csv?category=plumbing&since=2022-01-01
+    path('export/directory.<format>', views.ExportView.as_view(), name='export'),
+    # --------------------------------------JSON----------------------------------------------------------------------
+    # ex: /api/Categories/?sorting_method=skill_count&ascending=false
+    path('api/Categories/', views.CategoryListJsonView.as_view(), name='category_list_json'),
+    # ex: /api/Categories/plumbing/?cursor=...
+    path('api/Categories/<slug>/', views.CategoryDetailJsonView.as_view(), name='category_detail_json'),
+    # ex: /api/Profiles/admin
+    path('api/Profiles/<username>', views.ProfileJsonView.as_view(), name='profile_json'),
+    # --------------------------------------Thumbnails----------------------------------------------------------------
+    # ex: /media/thumbnails/3f/3f9c...-profile-320.webp
+    path('media/thumbnails/<path:name>', views.ThumbnailView.as_view(), name='thumbnail'),
+    # --------------------------------------Static files--------------------------------------------------------------
+    # ex: /static/RecipeBook/css/table_1.5.3c2b9a71d0e4.css
+    path('static/<path:name>', views.StaticFileView.as_view(), name='static'),
+    # --------------------------------------Metrics-------------------------------------------------------------------
+    # ex: /metrics
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
     # -----------------------------------Profiles-----------------------------------------------------------------------
     # ex: /Profiles/
     path('Profiles/', views.ProfileListView.as_view(), name='profile_list'),
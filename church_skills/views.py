@@ -1,11 +1,21 @@
+# Python imports
+import os
+
 # Django imports
+from asgiref.sync import sync_to_async
 from django.views.generic import ListView, DetailView, FormView, View
-from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation, ValidationError
 from django.shortcuts import HttpResponseRedirect, reverse, redirect, render
-from django.db.models import Count, F
-from django import db
-from django.core.serializers import serialize
-from django.http import JsonResponse
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.decorators import method_decorator
+from django.core.files.storage import default_storage
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse, HttpResponseBadRequest, Http404
+from django.urls import reverse_lazy
+from django.utils.html import format_html
 from django.contrib.auth import login, views as auth_views, get_user_model as users
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm
@@ -13,6 +23,13 @@ from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm
 # Local imports
 from .models import *
 from .forms import *
+from . import dataset, export, metrics, profiles, searchcache, staticfiles, thumbnails, typeahead
+from .cache import VersionedCacheMixin, category_key, provider_key
+from .conditional import ConditionalGetMixin, latest, table_state
+from .db import retry_on_locked
+from .pagination import KeysetPaginator, InvalidCursor
+from .routers import ReplicaReadMixin
+from .search import get_backend
 from urllib.parse import urlencode
 
 
@@ -25,6 +42,168 @@ class SearchMixin(View):
         return context
 
 
+class InvalidTableRequest(ValueError):
+    pass
+
+
+class TableJsonMixin:
+    """
+        Shared JSON endpoint for the sortable tables.  Rows come back a page at a time using keyset pagination over a
+        fixed whitelist of sort fields, each backed by a (sort key, id) index.  With ?dataset=1 a small enough table
+        comes back whole as columns instead, see dataset.py
+    """
+    sort_fields = {}
+    default_sort = 'name'
+    page_size = 50
+    max_page_size = 200
+    # values_list() fields read for the columnar dataset, pk first
+    dataset_fields = ['pk']
+
+    def get_table_queryset(self):
+        raise NotImplementedError
+
+    def table_row(self, obj):
+        raise NotImplementedError
+
+    def dataset_columns(self, rows):
+        """
+            {column: list of values} for the dataset_fields tuples in rows, which must include an 'id' column
+        """
+        raise NotImplementedError
+
+    def wants_dataset(self):
+        return bool(self.request.GET.get('dataset'))
+
+    def dataset_queryset(self):
+        """
+            The dataset_fields and every sort key of at most one row more than the dataset limit
+        """
+        sort_keys = {'sort_' + name: expression for name, expression in self.sort_fields.items()}
+        return self.get_table_queryset().annotate(**sort_keys).order_by()\
+            .values_list(*self.dataset_fields, *sort_keys)[:dataset.dataset_limit() + 1]
+
+    def dataset_json(self, rows):
+        """
+            The columnar response for rows, None when there are too many of them to send at once
+        """
+        if len(rows) > dataset.dataset_limit():
+            return None
+        width = len(self.dataset_fields)
+        pks = [row[0] for row in rows]
+        sort_keys = {name: dataset.sort_ranks([row[width + number] for row in rows], pks)
+                     for number, name in enumerate(self.sort_fields)}
+        # A conditional view's ETag covers the same rows, the mixin sets it on the response
+        return dataset.dataset_response(self.request, self.dataset_columns([row[:width] for row in rows]), sort_keys,
+                                        content_etag=not isinstance(self, ConditionalGetMixin))
+
+    def get_paginator(self):
+        """
+            Reads the sort order and page size from the query string, raises InvalidTableRequest for a bad one
+        """
+        sorting_method = self.request.GET.get('sorting_method', self.default_sort)
+        if sorting_method not in self.sort_fields:
+            raise InvalidTableRequest('Unknown sorting method')
+        ascending = self.request.GET.get('ascending', 'true') == 'true'
+        try:
+            page_size = min(max(int(self.request.GET.get('page_size', self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            page_size = self.page_size
+
+        self.sorting_method = sorting_method
+        return KeysetPaginator(self.get_table_queryset(), self.sort_fields[sorting_method],
+                               ascending=ascending, page_size=page_size)
+
+    def table_data(self, paginator, rows, next_cursor):
+        return {
+            'results': [self.table_row(obj) for obj in rows],
+            'page_size': paginator.page_size,
+            'next_cursor': next_cursor,
+            'sorting_method': self.sorting_method,
+            'ascending': paginator.ascending,
+            'dataset': False,
+        }
+
+    def table_json(self):
+        if self.wants_dataset():
+            response = self.dataset_json(list(self.dataset_queryset()))
+            if response is not None:
+                return response
+        try:
+            paginator = self.get_paginator()
+            rows, next_cursor = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        except InvalidTableRequest as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        return JsonResponse(data=self.table_data(paginator, rows, next_cursor))
+
+
+class AsyncTableJsonMixin(TableJsonMixin):
+    """
+        TableJsonMixin for async views, the page is read with the async ORM so no thread is held while it runs.
+        get_table_queryset() must not touch the database itself, look up anything it needs in the handler first
+    """
+    async def fetch_dataset_rows(self):
+        return [row async for row in self.dataset_queryset()]
+
+    async def fetch_page(self, paginator, cursor):
+        return await paginator.apage(cursor)
+
+    async def table_json(self):
+        if self.wants_dataset():
+            response = self.dataset_json(await self.fetch_dataset_rows())
+            if response is not None:
+                return response
+        try:
+            paginator = self.get_paginator()
+            rows, next_cursor = await self.fetch_page(paginator, self.request.GET.get('cursor'))
+        except InvalidCursor:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        except InvalidTableRequest as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        return JsonResponse(data=self.table_data(paginator, rows, next_cursor))
+
+
+async def request_user(request):
+    """
+        request.user is loaded from the session the first time it is used, which is sync only ORM work, so async
+        views resolve it here in a thread.  Returns None for anonymous visitors
+    """
+    def resolve():
+        return request.user if request.user.is_authenticated else None
+    return await sync_to_async(resolve)()
+
+
+# The skill tables read DirectoryEntry rows, see directory.py
+SKILL_SORT_FIELDS = {
+    'name': F('skill_name'),
+    'cost_range': F('cost_sort'),
+}
+
+
+def skill_table_row(entry):
+    return {
+        # Skills link to their provider's profile, see Skill.get_absolute_url
+        'name': format_html('<a href="{}">{}</a>', entry.provider_url, entry.skill_name),
+        'provider': format_html('<a href="{}">{}</a>', entry.provider_url, entry.provider_name),
+        'cost_range': entry.cost_range,
+    }
+
+
+SKILL_DATASET_FIELDS = ['pk', 'skill_name', 'cost_range', 'provider_url', 'provider_name']
+
+
+def skill_dataset_columns(rows):
+    columns = {'id': [], 'name': [], 'url': [], 'provider': [], 'cost_range': []}
+    for pk, name, cost_range, url, provider in rows:
+        columns['id'].append(pk)
+        columns['name'].append(name)
+        columns['url'].append(url)
+        columns['provider'].append(provider)
+        columns['cost_range'].append(cost_range)
+    return columns
+
+
 class BaseUpdateView(SearchMixin, FormView):
     def get_context_data(self, **kwargs):
         context = super(BaseUpdateView, self).get_context_data()
@@ -32,211 +211,410 @@ class BaseUpdateView(SearchMixin, FormView):
 
 
 # ------------------------------------- Main and Search Views ----------------------------------------------------------
-class MainView(SearchMixin, ListView):
+class MainView(ReplicaReadMixin, ConditionalGetMixin, VersionedCacheMixin, SearchMixin, ListView):
     model = Category
     template_name = 'skills/main_page.html'
     context_object_name = 'categories'
     queryset = None
 
+    def get_validators(self):
+        return [*table_state(Category.objects.all()), *table_state(Skill.objects.all()),
+                *table_state(Provider.objects.all())]
+
     def get_context_data(self, *args, **kwargs):
         context = super(MainView, self).get_context_data()
-        categories = Category.objects.all().annotate(recipe_count=Count('recipe')).order_by('recipe_count')[:5]
-        recipes = Recipe.objects.all().order_by('-id')[:10]
+        categories = Category.objects.filter(skill_count__gt=0).order_by('-skill_count', '-id')[:5]
+        skills = Skill.objects.filter(provider__isnull=False).select_related('provider').order_by('-id')[:10]
 
         context['categories'] = categories
-        context['recipes'] = recipes
+        context['skills'] = skills
+        context['category_total'] = Category.objects.filter(skill_count__gt=0).count()
+        context['skill_total'] = Skill.objects.count()
         return context
 
 
-class SearchView(SearchMixin, ListView):
-    model = Recipe
+class SearchView(ReplicaReadMixin, AsyncTableJsonMixin, SearchMixin):
+    """
+        Async so that a single ASGI worker can keep many searches in flight.  The FTS query runs on a raw cursor and
+        rendering the page reads request.user, neither of which may run on the event loop, so those go through
+        sync_to_async.  Results are cached and identical searches running at the same time share one query, see
+        searchcache.py
+    """
     template_name = 'skills/search_results.html'
-    context_object_name = 'search_results'
-    queryset = None
+    result_limit = 100
+    sort_fields = SKILL_SORT_FIELDS
+    dataset_fields = SKILL_DATASET_FIELDS
+    # Set by table_json when the query matches no skill, the skills spelled nearly like it are listed instead
+    similar_skills = None
+
+    def result_key(self, *parts):
+        return searchcache.result_key(self.request.GET.get('name'), *parts)
+
+    async def find_results(self, name):
+        backend = get_backend()
+        # Each kind is searched separately so one kind with many matches can't crowd out the others
+        results = {'fuzzy': False}
+        for kind, model in [('category', Category), ('provider', Provider), ('skill', Skill)]:
+            hits = await sync_to_async(backend.search)(name, kinds=[kind], limit=self.result_limit)
+            if not hits:
+                # Misspelled perhaps, "plumbng" still finds Plumbing
+                hits = await sync_to_async(backend.fuzzy_search)(name, kinds=[kind], limit=self.result_limit)
+                results['fuzzy'] = results['fuzzy'] or bool(hits)
+            pks = [hit.pk for hit in hits]
+            if model is Skill:
+                # Skills come from their directory entries, which also leaves out those without a provider
+                queryset = DirectoryEntry.objects.filter(is_primary=True, skill_id__in=pks)
+                objects = {entry.skill_id: entry async for entry in queryset.aiterator()}
+            else:
+                objects = {obj.pk: obj async for obj in model.objects.filter(pk__in=pks).aiterator()}
+            results[kind] = [objects[hit.pk] for hit in hits if hit.pk in objects]
+        return results
 
-    def get_context_data(self, *args, **kwargs):
+    async def get_context_data(self, *args, **kwargs):
         context = super(SearchView, self).get_context_data()
         name = self.request.GET.get('name')
-        recipes = Recipe.objects.filter(name__icontains=name)
-        for recipe in recipes:
-            recipe.total_time = recipe.cook_time + recipe.prep_time
-            if "http" in recipe.source:
-                recipe.link = recipe.source
+        results = await searchcache.cached(self.result_key('results'), lambda: self.find_results(name))
         form = self.search
 
         context['name'] = name
-        context['recipes'] = recipes
+        context['categories'] = results['category']
+        context['providers'] = results['provider']
+        context['skills'] = results['skill']
+        context['fuzzy'] = results['fuzzy']
         context['form'] = form
         return context
 
-    def get(self, request, *args, **kwargs):
+    def get_table_queryset(self):
+        if self.similar_skills is not None:
+            return DirectoryEntry.objects.filter(is_primary=True, skill_id__in=self.similar_skills)
+        return get_backend().filter_entries(DirectoryEntry.objects.filter(is_primary=True),
+                                            self.request.GET.get('name'))
+
+    def find_similar_skills(self, name):
+        """
+            The pks of the skills spelled nearly like name when no skill matches it, as on the page, otherwise None
+        """
+        backend = get_backend()
+        if backend.search(name, kinds=['skill'], limit=1):
+            return None
+        return [hit.pk for hit in backend.fuzzy_search(name, kinds=['skill'], limit=self.result_limit)] or None
+
+    async def table_json(self):
+        name = self.request.GET.get('name')
+        self.similar_skills = await searchcache.cached(self.result_key('similar'),
+                                                       sync_to_async(lambda: self.find_similar_skills(name)))
+        return await super(SearchView, self).table_json()
+
+    async def fetch_dataset_rows(self):
+        return await searchcache.cached(self.result_key('dataset'), super(SearchView, self).fetch_dataset_rows)
+
+    async def fetch_page(self, paginator, cursor):
+        key = self.result_key('page', self.sorting_method, paginator.ascending, paginator.page_size, cursor)
+        return await searchcache.cached(key, lambda: super(SearchView, self).fetch_page(paginator, cursor))
+
+    def table_row(self, obj):
+        return skill_table_row(obj)
+
+    def dataset_columns(self, rows):
+        return skill_dataset_columns(rows)
+
+    async def get(self, request, *args, **kwargs):
         if self.request.headers.get('x_requested_with') == 'XMLHttpRequest':
-            name = self.request.GET.get('name')
-            sorting_method = self.request.GET.get('sorting_method')
-            ascending = self.request.GET.get('ascending')
-            data = []
-            if ascending == "true":
-                if sorting_method == "source":
-                    query = None
-                elif sorting_method == "total_time":
-                    query = Recipe.objects.filter(name__icontains=name)\
-                        .annotate(total_time=F('prep_time') + F('cook_time')).order_by('total_time')
-                else:
-                    query = Recipe.objects.filter(name__icontains=name)\
-                        .annotate(total_time=F('prep_time') + F('cook_time')).order_by(sorting_method)
-            elif ascending != "true":
-                if sorting_method == "source":
-                    query = None
-                elif sorting_method == "total_time":
-                    query = Recipe.objects.filter(name__icontains=name)\
-                        .annotate(total_time=F('prep_time') + F('cook_time')).order_by('total_time').reverse()
-                else:
-                    query = Recipe.objects.filter(name__icontains=name)\
-                        .annotate(total_time=F('prep_time') + F('cook_time')).order_by(sorting_method).reverse()
-            else:
-                query = None
-                data = serialize('json', None)
-
-            if query is not None:
-                for obj in query:
-                    url_link = '<a href="' + obj.get_absolute_url() + '">' + obj.name + '</a>'
-                    if "http" in obj.source:
-                        source = '<a href="' + obj.source + '">' + obj.source + '</a>'
-                    else:
-                        source = obj.source
-                    json_data = {"name": url_link, "servings": obj.servings, "time": format_time(obj.total_time),
-                                 "source": source}
-                    data.append(json_data)
-
-            return JsonResponse(data=data, safe=False)
+            return await self.table_json()
         else:
-            return render(self.request, self.template_name, context=self.get_context_data())
+            context = await self.get_context_data()
+            return await sync_to_async(render)(self.request, self.template_name, context=context)
+
+    async def post(self, request, *args, **kwargs):
+        form = SearchForm(request.POST)
+        if form.is_valid():
+            name = form.cleaned_data['search_name']
+            base_url = reverse('church_skills:search_results')
+            query_string = urlencode({'name': name})
+            url = '{}?{}'.format(base_url, query_string)
+            return HttpResponseRedirect(url)
+        else:
+            raise ValidationError
 
-    @staticmethod
-    def post(request):
-        if request.method == 'POST':
-            form = SearchForm(request.POST)
-            if form.is_valid():
-                name = form.cleaned_data['search_name']
-                base_url = reverse('RecipeBook:search_results')
-                query_string = urlencode({'name': name})
-                url = '{}?{}'.format(base_url, query_string)
-                return HttpResponseRedirect(url)
-            else:
-                raise ValidationError
+
+class TypeaheadView(View):
+    """
+        Suggestions for the search box as the visitor types, answered from the in-memory prefix index
+    """
+    default_limit = 8
+    max_limit = 20
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '')
+        try:
+            limit = min(max(int(request.GET.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+
+        results = [{
+            'label': suggestion.label,
+            'kind': suggestion.kind,
+            'url': typeahead.url_for(suggestion),
+            'popularity': suggestion.popularity,
+        } for suggestion in typeahead.suggest(query, limit)]
+        response = JsonResponse({'query': query, 'results': results})
+        # Typing and deleting a letter asks for the same prefix again
+        patch_cache_control(response, public=True, max_age=60)
+        return response
 
 
 # ------------------------------------- Category views -----------------------------------------------------------------
-class CategoryListView(SearchMixin, ListView):
+class CategoryTableMixin:
+    sort_fields = {
+        'name': EmptyIfNull('name'),
+        'skill_count': F('skill_count'),
+        'provider_count': F('provider_count'),
+    }
+    dataset_fields = ['pk', 'name', 'slug', 'skill_count', 'provider_count']
+
+    def get_table_queryset(self):
+        return Category.objects.filter(skill_count__gt=0)
+
+    def table_row(self, obj):
+        return {
+            'name': format_html('<a href="{}">{}</a>', obj.get_absolute_url(), obj.name),
+            'skill_count': obj.skill_count,
+            'provider_count': obj.provider_count,
+        }
+
+    def dataset_columns(self, rows):
+        category_url = dataset.url_builder('church_skills:category_detail')
+        columns = {'id': [], 'name': [], 'url': [], 'skill_count': [], 'provider_count': []}
+        for pk, name, slug, skill_count, provider_count in rows:
+            columns['id'].append(pk)
+            columns['name'].append(name)
+            columns['url'].append(category_url(slug))
+            columns['skill_count'].append(skill_count)
+            columns['provider_count'].append(provider_count)
+        return columns
+
+
+class CategoryListView(ReplicaReadMixin, ConditionalGetMixin, VersionedCacheMixin, CategoryTableMixin, TableJsonMixin,
+                       SearchMixin, ListView):
     model = Category
     template_name = 'skills/category_list.html'
     context_object_name = 'category_list'
     queryset = None
 
+    def get_validators(self):
+        # Count changes move last_updated too, see counts.adjust
+        return list(table_state(Category.objects.all()))
+
     def get_context_data(self, *args, **kwargs):
         context = super(CategoryListView, self).get_context_data()
-        categories = Category.objects.all()
-        for category in categories:
-            category.recipes = Recipe.objects.filter(categories=category)
-        # context = {'categories': categories}
+        # The counts are stored on the category, so this is a single query however many categories there are
+        categories = Category.objects.filter(skill_count__gt=0).order_by('name')
         context['categories'] = categories
         return context
 
     def get(self, request, *args, **kwargs):
         if self.request.headers.get('x_requested_with') == 'XMLHttpRequest':
-            sorting_method = self.request.GET.get('sorting_method')
-            ascending = self.request.GET.get('ascending')
-            query_base = Category.objects.all().annotate(recipe_count=Count('recipe'))
-            data = []
-            if ascending == "true":
-                if sorting_method == "recipe_count":
-                    query = query_base.order_by('recipe_count')
-                else:
-                    query = query_base.order_by(sorting_method)
-            elif ascending != "true":
-                if sorting_method == "recipe_count":
-                    query = query_base.order_by('recipe_count').reverse()
-                else:
-                    query = query_base.order_by(sorting_method).reverse()
-            else:
-                query = None
-                data = serialize('json', None)
-
-            if query is not None:
-                for obj in query:
-                    if obj.recipe_count > 0:
-                        url_link = '<a href="' + obj.get_absolute_url() + '">' + obj.name + '</a>'
-                        json_data = {"name": url_link, "recipe_count": obj.recipe_count}
-                        data.append(json_data)
-                    else:
-                        pass
-
-            return JsonResponse(data=data, safe=False)
+            return self.table_json()
         else:
             return render(self.request, self.template_name, context=self.get_context_data())
 
 
-class CategoryDetailView(SearchMixin, DetailView):
+class CategoryDetailView(ReplicaReadMixin, ConditionalGetMixin, VersionedCacheMixin, TableJsonMixin, SearchMixin,
+                         DetailView):
     model = Category
     template_name = 'skills/category_detail.html'
-    context_object_name = 'category_recipe_list'
+    context_object_name = 'category_skill_list'
     queryset = None
     slug_field = 'slug'
     slug_url_kwarg = 'slug'
+    sort_fields = SKILL_SORT_FIELDS
+    dataset_fields = SKILL_DATASET_FIELDS
+
+    def get_cache_versions(self):
+        return [category_key(self.kwargs['slug'])]
+
+    def get_validators(self):
+        # Skills and providers joining or leaving the category change its counts and with them its last_updated, so
+        # only edits to the rows themselves need looking at
+        row = Category.objects.filter(slug=self.kwargs['slug']).annotate(
+            skills_updated=latest(Skill.objects.filter(provider__categories=OuterRef('pk'))),
+            providers_updated=latest(Provider.objects.filter(categories=OuterRef('pk'))),
+        ).values_list('pk', 'last_updated', 'skills_updated', 'providers_updated').first()
+        return list(row or [])
 
     def get_context_data(self, *args, **kwargs):
         context = super(CategoryDetailView, self).get_context_data()
         category = self.get_object()
-        category.recipes = Recipe.objects.filter(categories=category)
-        for recipe in category.recipes:
-            recipe.total_time = format_time(recipe.prep_time + recipe.cook_time)
-            if "http" in recipe.source:
-                recipe.link = recipe.source
+        category.skills = DirectoryEntry.objects.filter(category=category).order_by('skill_name', 'id')
 
         context['category'] = category
         return context
 
+    def get_table_queryset(self):
+        return DirectoryEntry.objects.filter(category=self.get_object())
+
+    def table_row(self, obj):
+        return skill_table_row(obj)
+
+    def dataset_columns(self, rows):
+        return skill_dataset_columns(rows)
+
     def get(self, request, *args, **kwargs):
         if self.request.headers.get('x_requested_with') == 'XMLHttpRequest':
-            sorting_method = self.request.GET.get('sorting_method')
-            ascending = self.request.GET.get('ascending')
-            query_base = Recipe.objects.filter(categories=self.get_object())\
-                .annotate(total_time=F('prep_time') + F('cook_time'))
-            data = []
-            if ascending == "true":
-                if sorting_method == "source":
-                    query = None
-                elif sorting_method == "total_time":
-                    query = query_base.order_by('total_time')
-                else:
-                    query = query_base.order_by(sorting_method)
-            elif ascending != "true":
-                if sorting_method == "source":
-                    query = None
-                elif sorting_method == "total_time":
-                    query = query_base.order_by('total_time').reverse()
-                else:
-                    query = query_base.order_by(sorting_method).reverse()
-            else:
-                query = None
-                data = serialize('json', None)
-
-            if query is not None:
-                for obj in query:
-                    url_link = '<a href="' + obj.get_absolute_url() + '">' + obj.name + '</a>'
-                    if "http" in obj.source:
-                        source = '<a href="' + obj.source + '">' + obj.source + '</a>'
-                    else:
-                        source = obj.source
-                    json_data = {"name": url_link, "servings": obj.servings, "time": format_time(obj.total_time),
-                                 "source": source}
-                    data.append(json_data)
-
-            return JsonResponse(data=data, safe=False)
+            return self.table_json()
         else:
             return render(self.request, self.template_name, context=self.get_context_data())
 
 
+# ------------------------------------------------ Export views --------------------------------------------------------
+class ExportView(LoginRequiredMixin, View):
+    """
+        Streams the whole directory (or one category of it) as CSV or NDJSON without loading it into memory
+    """
+    def get(self, request, *args, **kwargs):
+        file_format = self.kwargs['format']
+        if file_format not in export.FORMATS:
+            raise Http404
+        since = None
+        if request.GET.get('since'):
+            try:
+                since = export.parse_since(request.GET['since'])
+            except ValueError as error:
+                return HttpResponseBadRequest(str(error))
+
+        lines = export.export_lines(file_format, category=request.GET.get('category'), updated_since=since)
+        response = StreamingHttpResponse(lines, content_type=export.FORMATS[file_format])
+        response['Content-Disposition'] = 'attachment; filename="directory.{}"'.format(file_format)
+        return response
+
+
+# ------------------------------------------------ JSON views ----------------------------------------------------------
+class CategoryListJsonView(ReplicaReadMixin, CategoryTableMixin, AsyncTableJsonMixin, View):
+    """
+        The category table as JSON, served with the async ORM
+    """
+    async def get(self, request, *args, **kwargs):
+        return await self.table_json()
+
+
+class CategoryDetailJsonView(ReplicaReadMixin, AsyncTableJsonMixin, View):
+    """
+        A category and a page of its skills as JSON, served with the async ORM
+    """
+    sort_fields = SKILL_SORT_FIELDS
+    dataset_fields = SKILL_DATASET_FIELDS
+
+    def get_table_queryset(self):
+        return DirectoryEntry.objects.filter(category=self.category)
+
+    def table_row(self, obj):
+        return skill_table_row(obj)
+
+    def dataset_columns(self, rows):
+        return skill_dataset_columns(rows)
+
+    def table_data(self, paginator, rows, next_cursor):
+        data = super(CategoryDetailJsonView, self).table_data(paginator, rows, next_cursor)
+        data['category'] = {
+            'name': self.category.name,
+            'slug': self.category.slug,
+            'skill_count': self.category.skill_count,
+            'provider_count': self.category.provider_count,
+        }
+        return data
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            self.category = await Category.objects.aget(slug=self.kwargs['slug'])
+        except Category.DoesNotExist:
+            raise Http404
+        return await self.table_json()
+
+
+class ProfileJsonView(ReplicaReadMixin, View):
+    """
+        A provider's profile and skills as JSON, served with the async ORM
+    """
+    async def get(self, request, *args, **kwargs):
+        profile = await profiles.aload(self.kwargs['username'])
+        if profile is None:
+            raise Http404
+        return JsonResponse(data=profiles.as_json(profile, await request_user(request)))
+
+
+# ------------------------------------------------ Thumbnail views -----------------------------------------------------
+class ThumbnailView(View):
+    """
+        Serves picture thumbnails with a far-future Cache-Control, making any that are missing on the way
+    """
+    def get(self, request, *args, **kwargs):
+        name = '{}/{}'.format(thumbnails.PREFIX, self.kwargs['name'])
+        rendition = thumbnails.parse_name(name)
+        if rendition is None:
+            raise Http404
+        if not default_storage.exists(name):
+            provider = Provider.objects.filter(picture_hash=rendition.digest).first()
+            if provider is None:
+                raise Http404
+            retry_on_locked(thumbnails.generate)(provider)
+            if not default_storage.exists(name):
+                # The picture was replaced since the page linking here was rendered
+                raise Http404
+
+        response = FileResponse(default_storage.open(name, 'rb'), content_type=thumbnails.content_type(
+            rendition.image_format))
+        response['Cache-Control'] = thumbnails.CACHE_CONTROL
+        return response
+
+
+# ------------------------------------------------ Static files --------------------------------------------------------
+class StaticFileView(View):
+    """
+        Serves the collected static files, precompressed when the browser accepts it.  Fingerprinted names are cached
+        for good, anything else is revalidated against its modification time
+    """
+    def get(self, request, *args, **kwargs):
+        name = self.kwargs['name']
+        try:
+            found = staticfiles.negotiate(staticfiles_storage, name, request.headers.get('Accept-Encoding', ''))
+        except SuspiciousFileOperation:
+            raise Http404
+        if found is None:
+            raise Http404
+        path, encoding = found
+
+        hashed = staticfiles.is_hashed(name)
+        last_modified = int(os.stat(path).st_mtime)
+        if not hashed:
+            not_modified = get_conditional_response(request, last_modified=last_modified)
+            if not_modified is not None:
+                return not_modified
+
+        response = FileResponse(open(path, 'rb'), content_type=staticfiles.content_type(name))
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+        if name.lower().endswith(staticfiles.COMPRESSIBLE):
+            # Caches must keep the encodings apart
+            patch_vary_headers(response, ['Accept-Encoding'])
+        response['Last-Modified'] = http_date(last_modified)
+        if hashed:
+            response['Cache-Control'] = staticfiles.CACHE_CONTROL
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+# ------------------------------------------------ Metrics views -------------------------------------------------------
+class MetricsView(View):
+    """
+        Prometheus scrape target, the metrics of every worker process added together
+    """
+    def get(self, request, *args, **kwargs):
+        if not metrics.can_scrape(request):
+            raise PermissionDenied
+        return HttpResponse(metrics.exposition(metrics.collect()), content_type=metrics.CONTENT_TYPE)
+
+
 # --------------------------------------------- Authentication views ---------------------------------------------------
 class CreateUserView(SearchMixin, FormView):
     template_name = 'registration/account_creation.html'
@@ -248,46 +626,35 @@ class CreateUserView(SearchMixin, FormView):
         context['account_form'] = self.account_form
         return context
 
+    @staticmethod
+    @retry_on_locked
+    def create_account(form):
+        with transaction.atomic():
+            return users().objects.create_user(username=form.clean_username(),
+                                               password=form.clean_password2(),
+                                               email=form.clean_email(),
+                                               first_name=form.clean_first_name(),
+                                               last_name=form.clean_last_name())
+
     def post(self, request, *args, **kwargs):
         if request.method == 'POST':
             form = AccountCreationForm(request.POST)
             if form.is_valid():
-                print(True)
-                username = form.clean_username()
-                password = form.clean_password2()
-                email = form.clean_email()
-                first_name = form.clean_first_name()
-                last_name = form.clean_last_name()
-                user = users().objects.create_user(username=username,
-                                                   password=password,
-                                                   email=email)
-                user.first_name = first_name
-                user.last_name = last_name
-
-                print(user)
-
-                while True:
-                    try:
-                        user.save()
-                        break
-                    except db.utils.OperationalError:
-                        print("DB is locked")
-
-                print(users().objects.get(username=username))
-
-                login(request, user)
-
-                return redirect('RecipeBook:main')
+                user = self.create_account(form)
+                # Logging in writes last_login and the session
+                retry_on_locked(login)(request, user)
+
+                return redirect('church_skills:main')
             else:
-                print("form was not valid")
-                print(form.error_messages)
-                return render('RecipeBook:create_user', template_name='registration/account_creation.html',
-                              context={'account_form': form})
+                context = self.get_context_data()
+                context['account_form'] = form
+                return render(request, self.template_name, context=context)
 
         else:
             return render(self.request, self.template_name, self.get_context_data())
 
 
+@method_decorator(retry_on_locked, name='form_valid')
 class LoginView(SearchMixin, auth_views.LoginView):
     template_name = 'registration/login.html'
     redirect_field_name = "redirect"
@@ -303,12 +670,15 @@ class LoginView(SearchMixin, auth_views.LoginView):
         return context
 
 
+@method_decorator(retry_on_locked, name='dispatch')
 class LogoutView(SearchMixin, auth_views.LogoutView):
     pass
 
 
+@method_decorator(retry_on_locked, name='form_valid')
 class PasswordChangeView(SearchMixin, auth_views.PasswordChangeView):
     template_name = 'registration/password_change.html'
+    success_url = reverse_lazy('church_skills:password_change_done')
     form = PasswordChangeForm
 
     def get_context_data(self, **kwargs):
@@ -322,26 +692,44 @@ class PasswordChangeDoneView(SearchMixin, auth_views.PasswordChangeDoneView):
     template_name = 'registration/password_change_done.html'
 
 
-class ProfileListView(SearchMixin, ListView):
+class ProfileListView(ReplicaReadMixin, SearchMixin, ListView):
     model = users()
     queryset = None
 
     # Only here to serve as a path for the profiles
 
 
-class ProfileDetailView(SearchMixin, DetailView):
+class ProfileDetailView(ReplicaReadMixin, ConditionalGetMixin, VersionedCacheMixin, SearchMixin, DetailView):
     model = users()
     template_name = 'skills/profile_page.html'
     queryset = None
     slug_field = 'username'
     slug_url_kwarg = 'username'
 
+    def get_cache_versions(self):
+        return [provider_key(self.kwargs['username'])]
+
+    def get_validators(self):
+        skills = Skill.objects.filter(provider=OuterRef('pk'))
+        row = users().objects.filter(username=self.kwargs['username']).annotate(
+            provider_updated=latest(Provider.objects.filter(pk=OuterRef('pk'))),
+            skills_updated=latest(skills),
+            skill_rows=Subquery(skills.order_by().values('provider').annotate(rows=Count('pk')).values('rows')),
+            categories_updated=latest(Category.objects.filter(provider=OuterRef('pk'))),
+        ).values_list('pk', 'first_name', 'last_name', 'provider_updated', 'skills_updated', 'skill_rows',
+                      'categories_updated').first()
+        return list(row or [])
+
+    def get_object(self, queryset=None):
+        self.profile = profiles.load(self.kwargs['username'])
+        if self.profile is None:
+            raise Http404
+        return self.profile.user
+
     def get_context_data(self, **kwargs):
         context = super(ProfileDetailView, self). get_context_data()
-        user = self.get_object()
-        recipes_submitted = Recipe.objects.filter(submitter=user)
-
-        context['username'] = user
-        context['recipes_submitted'] = recipes_submitted
+        context['username'] = self.profile.user
+        context['provider'] = self.profile.provider
+        context['skills_submitted'] = self.profile.skills
 
         return context
\ No newline at end of file
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoProject.settings')
 
 application = get_asgi_application()
+
+# Load the search box suggestions while the first requests come in, rather than in the first request that needs them
+from church_skills import typeahead  # noqa: E402
+
+typeahead.warm()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its Server-Timing total covers everything below it
+    'church_skills.profiling.ProfilingMiddleware',
+    # Reports the query counts measured by ProfilingMiddleware, so it must come after it
+    'church_skills.metrics.MetricsMiddleware',
+    # Picks the database each request reads from, see church_skills/routers.py
+    'church_skills.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,11 +61,19 @@ ROOT_URLCONF = 'djangoProject.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend with render time reported by the profiling middleware
+        'BACKEND': 'church_skills.profiling.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Templates are compiled once per process rather than on every render, restart to pick up edits.  The
+            # chrome every page shares is cached as rendered fragments, see church_skills/templatetags/fragments.py
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -79,13 +94,99 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Seconds a connection waits for a lock before giving up
+            'timeout': 20,
+        },
+    },
+    # A read replica, see church_skills/routers.py.  To try it locally uncomment this and keep the second file up to
+    # date with "python manage.py replicate_database --interval 5"
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': BASE_DIR / 'db.replica.sqlite3',
+    #     'OPTIONS': {
+    #         'timeout': 20,
+    #     },
+    #     # Tests read and write the test copy of the primary
+    #     'TEST': {
+    #         'MIRROR': 'default',
+    #     },
+    # },
+}
+
+# The read only views read from SKILLS_REPLICA_ALIAS once it is in DATABASES, a browser that wrote is kept on the
+# primary for SKILLS_REPLICA_STICKY_SECONDS so it sees its own changes
+DATABASE_ROUTERS = ['church_skills.routers.ReplicaRouter']
+
+SKILLS_REPLICA_ALIAS = 'replica'
+SKILLS_REPLICA_STICKY_SECONDS = 30
+
+# Applied to every new SQLite connection, see church_skills/db.py
+SKILLS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# The cache holds the sessions, the logged in users and the version stamps of the response cache, which every worker
+# process has to see.  LocMemCache is only right for a single process (runserver), with more workers use a shared cache:
+# 'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'
+# The church_skills.E001 system check refuses a process local cache when SKILLS_WORKERS is more than 1
+
+SKILLS_WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
     }
 }
 
+# Sessions are written to the database and the cache and read from the cache, falling back to the database for
+# sessions the cache has lost
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+
+
+# Profiling, see church_skills/profiling.py
+# Fraction of requests run under cProfile with their queries recorded, those slower than the threshold (milliseconds)
+# are written to SKILLS_PROFILE_DIR
+
+SKILLS_PROFILE_SAMPLE_RATE = 0.01
+SKILLS_PROFILE_THRESHOLD = 500
+SKILLS_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# The Server-Timing header goes to staff users only, and to everybody while DEBUG is on or when this is True
+# SKILLS_SERVER_TIMING = True
+
+
+# Metrics, see church_skills/metrics.py
+# Every worker process keeps its counters in a file in this directory, which should be emptied on deploy.  Defaults to
+# a directory under the system temp directory
+# SKILLS_METRICS_DIR = BASE_DIR / 'metrics'
+
+# /metrics is only served to staff users, to these client addresses and to scrapers sending the token as
+# "Authorization: Bearer <token>"
+SKILLS_METRICS_ALLOWED_IPS = []
+SKILLS_METRICS_TOKEN = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
+# Logged in users are kept in the session cache, see church_skills/backends.py.  Only one backend is listed, Django
+# tries every backend's authenticate() and a second ModelBackend would hash every failed login's password twice
+AUTHENTICATION_BACKENDS = [
+    'church_skills.backends.CachedModelBackend',
+]
+
+SKILLS_USER_CACHE_TIMEOUT = 300
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -102,6 +203,11 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+LOGIN_URL = 'church_skills:login'
+LOGIN_REDIRECT_URL = 'church_skills:main'
+LOGOUT_REDIRECT_URL = 'church_skills:main'
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
 
@@ -118,8 +224,62 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.0/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic fingerprints and precompresses the static files (brotli too when the brotli package is installed),
+# the site serves them with immutable caching, see church_skills/staticfiles.py
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'church_skills.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Uploaded files, the provider pictures and their thumbnails
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Directory search
+# Defaults to the SQLite FTS5 index on SQLite and to plain table scans on other databases
+
+# SKILLS_SEARCH_BACKEND = 'church_skills.search.SQLiteFTSBackend'
+
+# Searches that match nothing fall back to names at least this similar (the share of trigrams in common), see
+# church_skills/fuzzy.py
+SKILLS_FUZZY_THRESHOLD = 0.3
+
+# Each process keeps the results of its last SKILLS_SEARCH_CACHE_SIZE searches for up to SKILLS_SEARCH_CACHE_TTL
+# seconds, any write to the directory invalidates them, see church_skills/searchcache.py
+SKILLS_SEARCH_CACHE_SIZE = 500
+SKILLS_SEARCH_CACHE_TTL = 60
+
+# Seconds before each process reloads its search box suggestions, see church_skills/typeahead.py
+SKILLS_TYPEAHEAD_MAX_AGE = 300
+
+# Tables with at most this many rows are sent to the browser whole and sorted there, see church_skills/dataset.py
+SKILLS_TABLE_DATASET_LIMIT = 2000
+
+
+# Directory response cache, see church_skills/cache.py
+# Entries are invalidated through version stamps, the timeout only lets unused entries age out
+
+SKILLS_CACHE_ALIAS = 'default'
+SKILLS_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# Background jobs, see church_skills/jobs.py
+# Search indexing and thumbnails are queued by the requests and run by `python manage.py run_jobs`.  A failed job is
+# retried after SKILLS_JOB_RETRY_DELAY seconds, doubling up to SKILLS_JOB_MAX_RETRY_DELAY, one still running after
+# SKILLS_JOB_TIMEOUT seconds is taken to belong to a worker that died
+
+SKILLS_JOB_RETRY_DELAY = 30
+SKILLS_JOB_MAX_RETRY_DELAY = 60 * 60
+SKILLS_JOB_TIMEOUT = 10 * 60